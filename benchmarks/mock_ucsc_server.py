@@ -0,0 +1,165 @@
+"""
+    A local stand-in for the parts of the UCSC REST API and hgdownload server that
+    ucscpynome talks to. Used by the benchmark suite so that runs are repeatable and
+    do not depend on the network or on UCSC's load.
+
+    Served endpoints:
+        - GET /list/ucscGenomes
+        - GET /list/chromosomes?genome={genome}
+        - GET /getData/sequence?genome={genome};chrom={chrom};start={start};end={end}
+        - GET /goldenpath/{src}/liftOver/{src}To{Target}.over.chain.gz
+"""
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+# A repeating block of sequence with some soft-masked and N bases in it, so the
+# payloads look roughly like real UCSC output.
+_BLOCK = ("ACGTTGCAAGGCTTAC" * 48 + "acgtaacgttgcatgc" * 8 + "N" * 64) * 64
+
+
+def _dna(start, end):
+    """ Deterministic DNA for the half-open interval [start, end) """
+    length = end - start
+    offset = start % len(_BLOCK)
+    repeats = (offset + length) // len(_BLOCK) + 1
+    return (_BLOCK * repeats)[offset:offset + length]
+
+
+class MockUCSCServer():
+    """
+        A threaded HTTP server that mimics the UCSC API.
+
+        Params:
+            genomes (dict): genome name -> organism name
+            num_chromosomes (int): number of chromosomes in every genome
+            chrom_size (int): size of every chromosome in bases
+            latency (float): seconds to sleep before answering each request
+            port (int): port to listen on, 0 picks a free port
+    """
+
+    def __init__(self, genomes=None, num_chromosomes=4, chrom_size=100000,
+                 latency=0.0, port=0):
+        self.genomes = genomes or {"hg19": "Human", "hg38": "Human"}
+        self.chromosomes = {"chr" + str(i + 1): chrom_size for i in range(num_chromosomes)}
+        self.latency = latency
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self.__server = ThreadingHTTPServer(("127.0.0.1", port), self.__make_handler())
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def chain_file(self):
+        """ An identity chain file mapping every chromosome onto itself """
+        lines = []
+        for i, (chrom, size) in enumerate(self.chromosomes.items()):
+            lines.append("chain 1000 %s %d + 0 %d %s %d + 0 %d %d" %
+                         (chrom, size, size, chrom, size, size, i + 1))
+            lines.append(str(size))
+            lines.append("")
+        return ("\n".join(lines) + "\n").encode()
+
+    def __make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_body(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, status, obj):
+                self.send_body(status, json.dumps(obj).encode())
+
+            def do_GET(self):
+                with server._count_lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query.replace(";", "&")).items()}
+
+                if parts.path == "/list/ucscGenomes":
+                    genomes = {g: {"organism": org} for g, org in server.genomes.items()}
+                    self.send_json(200, {"ucscGenomes": genomes})
+
+                elif parts.path == "/list/chromosomes":
+                    if query.get("genome") not in server.genomes:
+                        self.send_json(400, {"error": "unknown genome"})
+                        return
+                    self.send_json(200, {"genome": query["genome"],
+                                         "chromCount": len(server.chromosomes),
+                                         "chromosomes": server.chromosomes})
+
+                elif parts.path == "/getData/sequence":
+                    chrom = query.get("chrom")
+                    if query.get("genome") not in server.genomes or chrom not in server.chromosomes:
+                        self.send_json(400, {"error": "can not find chrom=" + str(chrom)})
+                        return
+                    size = server.chromosomes[chrom]
+                    start = int(query.get("start", 0))
+                    end = min(int(query.get("end", size)), size)
+                    if start >= end:
+                        self.send_json(400, {"error": "start must be less than end"})
+                        return
+                    self.send_json(200, {"genome": query["genome"], "chrom": chrom,
+                                         "start": start, "end": end, "dna": _dna(start, end)})
+
+                elif parts.path.startswith("/goldenpath/") and parts.path.endswith(".over.chain.gz"):
+                    self.send_body(200, gzip.compress(server.chain_file()),
+                                   "application/x-gzip")
+
+                else:
+                    self.send_json(404, {"error": "not found: " + parts.path})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a mock UCSC API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chromosomes", type=int, default=4)
+    parser.add_argument("--chrom-size", type=int, default=100000)
+    args = parser.parse_args()
+    mock = MockUCSCServer(num_chromosomes=args.chromosomes, chrom_size=args.chrom_size,
+                          latency=args.latency, port=args.port)
+    print("Serving mock UCSC API at " + mock.url)
+    mock.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
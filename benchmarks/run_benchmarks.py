@@ -0,0 +1,184 @@
+"""
+    Benchmark suite for ucscpynome.
+
+    Starts a local mock of the UCSC API (see mock_ucsc_server.py), points ucscpynome
+    at it and times the main operations at several scales:
+
+        - parse_bed     : SequenceSet construction from a BED file
+        - to_bed        : SequenceSet.to_bed
+        - to_fasta      : SequenceSet.to_fasta, fetching every sequence
+        - download      : Genome.download_sequence for a whole genome
+        - liftover      : SequenceSet.liftover (only if the liftOver binary is present)
+        - import_*      : cold start of a fresh interpreter, bare and importing ucscpynome
+
+    Results are printed and appended as one JSON line per run to the output file, so
+    runs from different commits can be compared.
+
+    Usage (from the repository root):
+        python benchmarks/run_benchmarks.py --scales 100,1000,10000 --latency 0.005
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from mock_ucsc_server import MockUCSCServer
+
+SRC_GENOME = "hg19"
+TARGET_GENOME = "hg38"
+
+
+def write_bed(path, rows, chromosomes, chrom_size, interval=200):
+    """ Writes a BED file with the given number of rows spread over the chromosomes """
+    chroms = list(chromosomes)
+    with open(path, "w") as f:
+        for i in range(rows):
+            chrom = chroms[i % len(chroms)]
+            start = (i * 7919) % (chrom_size - interval)
+            f.write("%s\t%d\t%d\tfeature_%d\n" % (chrom, start, start + interval, i))
+
+
+def timed(func, repeat):
+    """ Best wall-clock time of func() over repeat runs """
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# statements timed by the import benchmarks, each in a fresh interpreter
+IMPORT_STATEMENTS = {
+    "import_bare": "pass",
+    "import_package": "import ucscpynome",
+    "import_bed": "from ucscpynome import SequenceSet",
+    "import_network": "import ucscpynome, requests",
+}
+
+
+def time_imports(repeat):
+    """ Best wall-clock time of starting an interpreter and running each statement """
+    results = {}
+    for name, statement in IMPORT_STATEMENTS.items():
+        command = [sys.executable, "-c", statement]
+        results[name] = timed(lambda: subprocess.run(command, check=True,
+                                                     cwd=os.path.dirname(BENCH_DIR)),
+                              max(repeat, 5))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    from ucscpynome import retry, Genome, SequenceSet
+
+    results = []
+
+    def record(name, scale, seconds, items):
+        result = {"benchmark": name, "scale": scale, "seconds": round(seconds, 6),
+                  "items_per_second": round(items / seconds, 2) if seconds > 0 else None}
+        results.append(result)
+        print("%-12s %10d %12.4f s %14s items/s" %
+              (name, scale, seconds, result["items_per_second"]))
+
+    mock = MockUCSCServer(num_chromosomes=args.chromosomes, chrom_size=args.chrom_size,
+                          latency=args.latency)
+    with mock, tempfile.TemporaryDirectory() as workdir:
+        retry.API_URL = mock.url
+        retry.DOWNLOAD_URL = mock.url
+        src_genome = Genome(SRC_GENOME)
+        target_genome = Genome(TARGET_GENOME)
+
+        for scale in args.scales:
+            bed_path = os.path.join(workdir, "in_%d.bed" % scale)
+            write_bed(bed_path, scale, mock.chromosomes, args.chrom_size)
+
+            record("parse_bed", scale,
+                   timed(lambda: SequenceSet([bed_path], src_genome), args.repeat), scale)
+
+            sequence_set = SequenceSet([bed_path], src_genome)
+            out_bed = os.path.join(workdir, "out.bed")
+            record("to_bed", scale,
+                   timed(lambda: sequence_set.to_bed(out_bed), args.repeat), scale)
+
+            if scale <= args.max_fetch_rows:
+                out_fasta = os.path.join(workdir, "out.fasta")
+                # a fresh set every run so every sequence is fetched again
+                record("to_fasta", scale,
+                       timed(lambda: SequenceSet([bed_path], src_genome).to_fasta(out_fasta),
+                             args.repeat), scale)
+
+            if args.liftover:
+                record("liftover", scale,
+                       timed(lambda: sequence_set.liftover(target_genome), args.repeat), scale)
+
+        prefix = os.path.join(workdir, "genome")
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = timed(lambda: src_genome.download_sequence(prefix), args.repeat)
+        record("download", args.chromosomes * args.chrom_size, seconds,
+               args.chromosomes * args.chrom_size)
+
+    for name, seconds in time_imports(args.repeat).items():
+        record(name, 1, seconds, 1)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {"scales": args.scales, "latency": args.latency,
+                   "chromosomes": args.chromosomes, "chrom_size": args.chrom_size,
+                   "repeat": args.repeat},
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ucscpynome against a mock UCSC API")
+    parser.add_argument("--scales", default="100,1000,10000",
+                        help="comma separated numbers of BED rows to benchmark with")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds of latency the mock server adds to every request")
+    parser.add_argument("--chromosomes", type=int, default=4,
+                        help="number of chromosomes in the mock genomes")
+    parser.add_argument("--chrom-size", type=int, default=1000000,
+                        help="size in bases of every mock chromosome")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs per benchmark, the best one is kept")
+    parser.add_argument("--max-fetch-rows", type=int, default=1000,
+                        help="largest scale at which to_fasta (one request per row) is run")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results.jsonl"),
+                        help="file to append the results to")
+    args = parser.parse_args(argv)
+    args.scales = [int(s) for s in args.scales.split(",") if s]
+
+    liftover_binary = os.path.join(os.path.dirname(BENCH_DIR), "ucscpynome", "liftOver")
+    args.liftover = os.access(liftover_binary, os.X_OK)
+    if not args.liftover:
+        print("liftOver binary not found at " + liftover_binary + ", skipping liftover")
+
+    report = run(args)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(report) + "\n")
+    print("Results appended to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import unittest
+from unittest import mock
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.append("..")
+from ucscpynome import Genome
+from ucscpynome.cli import main, load_manifest, run_tasks, ManifestError
+
+TEST_GENOME = "hg19"
+TEST_TARGET_GENOME = "hg38"
+TEST_OTHER_TARGET_GENOME = "hg18"
+
+
+def mocked_requests_get(*args, **kwargs):
+    class MockResponse:
+        def __init__(self, json_data, status_code):
+            self.json_data = json_data
+            self.status_code = status_code
+
+        def json(self):
+            return self.json_data
+
+    if "getData/sequence" in args[0] and "start=" not in args[0]:
+        return MockResponse({"dna": "ACGT"}, 200)
+    elif "list/chromosomes" in args[0]:
+        return MockResponse({"chromosomes": {"chr1": 4, "chrUn_gl000220": 4}}, 200)
+    elif "getData/sequence" in args[0]:
+        start = int(args[0].split("start=")[1].split(";")[0])
+        end = int(args[0].split("end=")[1])
+        return MockResponse({"dna": "C" * (end - start)}, 200)
+    elif "list/ucscGenomes" in args[0]:
+        return MockResponse({"ucscGenomes": {TEST_GENOME: {"organism": "Human"},
+                                             TEST_TARGET_GENOME: {"organism": "Human"},
+                                             TEST_OTHER_TARGET_GENOME: {"organism": "Human"}}}, 200)
+    raise AssertionError("unexpected request " + args[0])
+
+
+def fake_liftover(src_genome, target_genome, src_file, target_file, unmapped_file=None,
+                  path_to_chain=None):
+    """ Stands in for the liftOver tool: copies the source rows, slowly """
+    time.sleep(0.05)
+    with open(src_file) as src, open(target_file, "w") as target:
+        target.write(src.read())
+
+
+class TestRunManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, "a.bed"), "w") as f:
+            f.write("chr1\t0\t5\tfirst\nchr1\t10\t12\tsecond\n")
+        self.manifest = self.write_manifest([
+            {"id": "extract", "type": "extract", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "output": "a.fasta"},
+            {"id": "wrapped", "type": "extract", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "output": "b.fasta", "line_width": 2, "depends_on": ["extract"]},
+            {"id": "broken", "type": "extract", "genome": TEST_GENOME, "bed": ["missing.bed"],
+             "output": "c.fasta"},
+            {"id": "after_broken", "type": "extract", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "output": "d.fasta", "depends_on": ["broken"]},
+        ])
+        self.registry = [mock.patch.object(Genome, '_Genome__populated', False),
+                         mock.patch.dict(Genome._Genome__genome_dict, clear=True),
+                         mock.patch.dict(Genome._Genome__organism_dict, clear=True)]
+        for patch in self.registry:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.registry:
+            patch.stop()
+        self.tmp.cleanup()
+
+    def write_manifest(self, tasks):
+        path = os.path.join(self.tmp.name, "manifest.json")
+        with open(path, "w") as f:
+            json.dump({"tasks": tasks}, f)
+        return path
+
+    def run_main(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            status = main(["run", self.manifest] + list(args))
+        return status, out.getvalue()
+
+    # tasks run in dependency order, failures block their dependents only
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_run(self, mock_get):
+        status, output = self.run_main("--workers", "2")
+        self.assertEqual(status, 1)
+        with open(os.path.join(self.tmp.name, "a.fasta")) as f:
+            self.assertEqual(f.read(), "> first\nCCCCC\n> second\nCC\n")
+        with open(os.path.join(self.tmp.name, "b.fasta")) as f:
+            self.assertEqual(f.read(), "> first\nCC\nCC\nC\n> second\nCC\n")
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "d.fasta")))
+        self.assertIn("failed   broken", output)
+        self.assertIn("blocked  after_broken", output)
+        self.assertIn("2 of 4 tasks run", output)
+
+    # completed tasks are checkpointed and skipped on the next run
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_checkpoint(self, mock_get):
+        self.run_main()
+        calls = mock_get.call_count
+        status, output = self.run_main()
+        self.assertEqual(mock_get.call_count, calls)
+        self.assertIn("skipped  extract (checkpointed)", output)
+        self.assertIn("skipped  wrapped (checkpointed)", output)
+        self.assertIn("failed   broken", output)
+
+        status, output = self.run_main("--force")
+        self.assertIn("started  extract", output)
+
+    # tasks depending on a task that ran again are not skipped
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_checkpoint_dependencies(self, mock_get):
+        self.run_main()
+        with open(self.manifest) as f:
+            tasks = json.load(f)["tasks"]
+        tasks[0]["line_width"] = 3
+        self.write_manifest(tasks)
+        status, output = self.run_main()
+        self.assertIn("started  extract", output)
+        self.assertIn("started  wrapped", output)
+
+        status, output = self.run_main()
+        self.assertIn("skipped  extract (checkpointed)", output)
+        self.assertIn("skipped  wrapped (checkpointed)", output)
+
+    # output directories are created, skipped pseudochromosomes are not counted
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_output_directories(self, mock_get):
+        self.write_manifest([
+            {"id": "extract", "type": "extract", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "output": "genes/fasta/a.fasta"},
+            {"id": "download", "type": "download", "genome": TEST_GENOME,
+             "file_prefix": "mirror/seq"},
+        ])
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_tasks(load_manifest(self.manifest), log=lambda message: None)
+        self.assertEqual([result["status"] for result in results], ["done", "done"])
+        self.assertEqual(results[1]["items"], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "genes", "fasta", "a.fasta")))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "mirror", "seq_hg19_chr1")))
+
+    # liftover tasks running at the same time do not share their bed files
+    @mock.patch('ucscpynome.Genome.liftover', side_effect=fake_liftover)
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_parallel_liftover(self, mock_get, mock_liftover):
+        with open(os.path.join(self.tmp.name, "b.bed"), "w") as f:
+            f.write("chr2\t7\t9\tthird\n")
+        self.write_manifest([
+            {"id": "lift_a", "type": "liftover", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "target_genome": TEST_TARGET_GENOME, "output": "a_lifted.bed"},
+            {"id": "lift_b", "type": "liftover", "genome": TEST_GENOME, "bed": ["b.bed"],
+             "target_genome": TEST_TARGET_GENOME, "output": "b_lifted.bed"},
+        ])
+        status, output = self.run_main("--workers", "2")
+        self.assertEqual(status, 0)
+        with open(os.path.join(self.tmp.name, "a_lifted.bed")) as f:
+            self.assertEqual(f.read(), "chr1\t0\t5\tfirst\nchr1\t10\t12\tsecond\n")
+        with open(os.path.join(self.tmp.name, "b_lifted.bed")) as f:
+            self.assertEqual(f.read(), "chr2\t7\t9\tthird\n")
+        src_files = [call[0][2] for call in mock_liftover.call_args_list]
+        self.assertEqual(len(set(src_files)), 2)
+
+    # liftovers between different genome pairs overlap, those of the same pair do not
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_concurrent_liftover(self, mock_get):
+        barrier = threading.Barrier(2, timeout=5)
+        lock = threading.Lock()
+        active = {}
+        overlaps = []
+        def pair_liftover(src_genome, target_genome, src_file, target_file, *args):
+            pair = (str(src_genome), str(target_genome))
+            with lock:
+                active[pair] = active.get(pair, 0) + 1
+                overlaps.append(active[pair])
+            if pair[1] == TEST_OTHER_TARGET_GENOME:
+                # only returns once a liftover to the other target runs at the same time
+                barrier.wait()
+            else:
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            fake_liftover(src_genome, target_genome, src_file, target_file)
+            with lock:
+                active[pair] -= 1
+
+        self.write_manifest([
+            {"id": "lift_%d" % i, "type": "liftover", "genome": TEST_GENOME, "bed": ["a.bed"],
+             "target_genome": target, "output": "lifted_%d.bed" % i}
+            for i, target in enumerate([TEST_TARGET_GENOME, TEST_OTHER_TARGET_GENOME,
+                                        TEST_TARGET_GENOME])])
+        with mock.patch('ucscpynome.Genome.liftover', side_effect=pair_liftover):
+            status, output = self.run_main("--workers", "3")
+        self.assertEqual(status, 0, output)
+        self.assertEqual(max(overlaps), 1)
+
+    # manifests with unknown tasks or dependency cycles are rejected before running
+    def test_bad_manifest(self):
+        self.write_manifest([{"id": "a", "type": "extract", "depends_on": ["b"]},
+                             {"id": "b", "type": "extract", "depends_on": ["a"]}])
+        self.assertRaises(ManifestError, load_manifest, self.manifest)
+        self.assertEqual(self.run_main()[0], 2)
+        self.write_manifest([{"id": "a", "type": "unknown"}])
+        self.assertRaises(ManifestError, load_manifest, self.manifest)
+        self.write_manifest([{"id": "a", "type": "extract", "depends_on": ["c"]}])
+        self.assertRaises(ManifestError, load_manifest, self.manifest)
+
+
+if __name__ == '__main__':
+    unittest.main()
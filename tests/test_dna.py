@@ -0,0 +1,85 @@
+import unittest
+import sys
+sys.path.append("..")
+from ucscpynome import Sequence, SequenceSet
+from ucscpynome.dna import pack, unpack_bases, apply_runs, DnaStore
+
+TEST_GENOME = "hg19"
+TEST_SEQUENCES = ["", "A", "ACGT", "ACGTA", "acgtNNNNacgtTTGA", "NNNNNNNN",
+                  "GATCACAGGTCTATCACCCTATTAACCACTCACGGGAGCTCTCCATGCAT",
+                  "ACGTRYKM"]
+
+
+class TestPackedDNA(unittest.TestCase):
+
+    # packing keeps bases, N runs, soft-masking and other IUPAC codes
+    def test_round_trip(self):
+        for dna in TEST_SEQUENCES:
+            self.assertEqual(pack(dna).decode(), dna)
+
+    # runs are applied to windows of a sequence as to the whole sequence
+    def test_apply_runs_window(self):
+        dna = "acgtNNNNacgtTTGAnnnnACGTacNN" * 3
+        packed = pack(dna)
+        for start in range(len(dna)):
+            for end in range(start, len(dna) + 1):
+                bases = unpack_bases(packed.data, end - start, start)
+                apply_runs(bases, packed.n_runs, packed.lower_runs, start)
+                self.assertEqual(bases.decode(), dna[start:end])
+        bases = bytearray(b"ACGT")
+        apply_runs(bases, [1, 2], [2, 4])
+        self.assertEqual(bases, b"ANgt")
+
+    # plain bases take about a quarter of the space
+    def test_packed_size(self):
+        packed = pack("ACGT" * 1000)
+        self.assertFalse(packed.raw)
+        self.assertEqual(len(packed.data), 1000)
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.dna = ["ACGT" * 250 + str_base * 10 for str_base in "ACGT" * 5]
+        self.ss = SequenceSet.from_sequences(
+            [Sequence(0, len(dna), TEST_GENOME, "chr1") for dna in self.dna], TEST_GENOME)
+
+    def fill(self):
+        for seq, dna in zip(self.ss.sequences, self.dna):
+            seq._cache_string(dna)
+
+    # over the budget the least recently used DNA is dropped
+    def test_evict(self):
+        self.ss.set_memory_budget(1000)
+        self.fill()
+        self.assertTrue(self.ss.cached_bytes() <= 1000)
+        self.assertIsNone(self.ss.sequences[0]._cached_string())
+        self.assertEqual(self.ss.sequences[-1]._cached_string(), self.dna[-1])
+
+    # with spill the DNA over the budget is kept on disk
+    def test_spill(self):
+        self.ss.set_memory_budget(1000, spill=True)
+        self.fill()
+        self.assertTrue(self.ss.cached_bytes() <= 1000)
+        for seq, dna in zip(self.ss.sequences, self.dna):
+            self.assertEqual(seq._cached_string(), dna)
+
+    # empty sequences spilled to disk are read back without mapping an empty file
+    def test_spill_empty(self):
+        store = DnaStore(0, spill=True)
+        for i in range(3):
+            store.put(i, pack(""))
+        self.assertEqual([store.get(i).decode() for i in range(3)], ["", "", ""])
+        store.close()
+
+    # removing the budget moves the DNA back into the sequences
+    def test_remove_budget(self):
+        self.ss.set_memory_budget(10 ** 6)
+        self.fill()
+        self.ss.set_memory_budget(None)
+        for seq, dna in zip(self.ss.sequences, self.dna):
+            self.assertEqual(seq._cached_string(), dna)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,20 @@
 import unittest
 from unittest import mock
+import copy
 import os
+import io
+import pickle
+import struct
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 sys.path.append("..")
-from ucscpynome import Genome
+from ucscpynome import Genome, InvalidTrackError, InvalidChromosomeError
+from ucscpynome.dna import pack
+from ucscpynome.twobit import TwoBitFile
+from ucscpynome.retry import NetworkError
 
 TEST_GENOME = "hg38"
 HUMAN_GENOMES = ["hg16", "hg17", "hg18", "hg19", "hg38"]
@@ -43,6 +54,69 @@ def mocked_requests_get(*args, **kwargs):
     return MockResponse(None, 404)
 
 
+TEST_ASSEMBLY = {TEST_CHROM_1: "NNNNACGTacgtTTGCAnnA", TEST_CHROM_M: "GATTACA",
+                 "chrUn_test": "CCCC"}
+
+def twobit_bytes(sequences):
+    """ A .2bit file holding the sequences, built with the package's 2-bit packing """
+    index = b""
+    records = b""
+    offset = 16 + sum(1 + len(name) + 4 for name in sequences)
+    for name, dna in sequences.items():
+        index += struct.pack("<B", len(name)) + name.encode() + struct.pack("<I", offset + len(records))
+        packed = pack(dna)
+        n_runs = list(packed.n_runs)
+        lower_runs = list(packed.lower_runs)
+        record = struct.pack("<II", len(dna), len(n_runs) // 2)
+        record += struct.pack("<%dI" % (len(n_runs) // 2), *n_runs[0::2])
+        record += struct.pack("<%dI" % (len(n_runs) // 2), *[e - s for s, e in zip(n_runs[0::2], n_runs[1::2])])
+        record += struct.pack("<I", len(lower_runs) // 2)
+        record += struct.pack("<%dI" % (len(lower_runs) // 2), *lower_runs[0::2])
+        record += struct.pack("<%dI" % (len(lower_runs) // 2), *[e - s for s, e in zip(lower_runs[0::2], lower_runs[1::2])])
+        records += record + struct.pack("<I", 0) + packed.data
+    return struct.pack("<IIII", 0x1A412743, 0, len(sequences), 0) + index + records
+
+def chrom_fa_bytes(sequences):
+    """ A chromFa.tar.gz archive with one FASTA file per sequence """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, dna in sequences.items():
+            fasta = (">" + name + "\n" + "\n".join(dna[i:i + 8] for i in range(0, len(dna), 8)) + "\n").encode()
+            info = tarfile.TarInfo("chroms/" + name + ".fa")
+            info.size = len(fasta)
+            tar.addfile(info, io.BytesIO(fasta))
+    return buffer.getvalue()
+
+class MockStreamResponse:
+    def __init__(self, content, status_code):
+        self.content = content
+        self.status_code = status_code
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), 5):
+            yield self.content[i:i + 5]
+
+    def close(self):
+        pass
+
+def mocked_bulk_requests_get(*args, **kwargs):
+    if args[0].endswith(f"bigZips/{TEST_GENOME}.2bit"):
+        return MockStreamResponse(twobit_bytes(TEST_ASSEMBLY), 200)
+    elif args[0].endswith(f"bigZips/{TEST_GENOME}.chromFa.tar.gz"):
+        return MockStreamResponse(chrom_fa_bytes(TEST_ASSEMBLY), 200)
+    elif "bigZips/" in args[0]:
+        return MockStreamResponse(b"", 404)
+    return mocked_requests_get(*args, **kwargs)
+
+def mocked_old_bulk_requests_get(*args, **kwargs):
+    """ Older assemblies publish chromFa.tar.gz without the genome name """
+    if args[0].endswith("bigZips/chromFa.tar.gz"):
+        return MockStreamResponse(chrom_fa_bytes(TEST_ASSEMBLY), 200)
+    elif "bigZips/" in args[0]:
+        return MockStreamResponse(b"", 404)
+    return mocked_requests_get(*args, **kwargs)
+
+
 class TestGenome(unittest.TestCase):
 
     @mock.patch('requests.get', side_effect=mocked_requests_get)
@@ -96,5 +170,260 @@ class TestGenome(unittest.TestCase):
         self.assertEqual(list(chromosome_list).count(TEST_CHROM_1), 1)
         self.assertEqual(list(chromosome_list).count(TEST_CHROM_M), 1)
 
+    # pickling and copying keep the single instance of a genome
+    def test_pickle(self):
+        self.assertTrue(pickle.loads(pickle.dumps(self.hg_genome)) is self.hg_genome)
+        self.assertTrue(copy.deepcopy(self.hg_genome) is self.hg_genome)
+
+    # concurrent first use fetches the genome and chromosome lists only once
+    def test_concurrent_registry(self):
+        calls = []
+        def slow_requests_get(*args, **kwargs):
+            calls.append(args[0])
+            time.sleep(0.05)
+            return mocked_requests_get(*args, **kwargs)
+
+        with mock.patch('requests.get', side_effect=slow_requests_get), \
+             mock.patch.object(Genome, '_Genome__populated', False), \
+             mock.patch.dict(Genome._Genome__genome_dict, clear=True), \
+             mock.patch.dict(Genome._Genome__organism_dict, clear=True):
+            genomes = []
+            def construct():
+                genome = Genome(TEST_GENOME)
+                genome.list_chromosomes()
+                genomes.append(genome)
+            threads = [threading.Thread(target=construct) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(genomes), 8)
+        self.assertTrue(all(genome is genomes[0] for genome in genomes))
+        self.assertEqual(len([url for url in calls if "list/ucscGenomes" in url]), 1)
+        self.assertEqual(len([url for url in calls if "list/chromosomes" in url]), 1)
+
+    # track items are fetched window by window, splitting windows over the item limit
+    def test_fetch_track(self):
+        items = {TEST_CHROM_1: [(i, i + 15) for i in range(0, 1234, 10)],
+                 TEST_CHROM_M: [(100, 5000), (5600, 5678)]}
+        urls = []
+        def track_requests_get(*args, **kwargs):
+            class MockResponse:
+                def __init__(self, json_data, status_code):
+                    self.json_data = json_data
+                    self.status_code = status_code
+
+                def json(self):
+                    return self.json_data
+
+            if "getData/track" not in args[0]:
+                return mocked_requests_get(*args, **kwargs)
+            urls.append(args[0])
+            params = dict(param.split("=") for param in args[0].split("?")[1].split(";"))
+            if params["track"] == "noCoordinates":
+                return MockResponse({"noCoordinates": [{"chrom": params["chrom"], "name": "x"}]}, 200)
+            if params["track"] != TEST_TRACK:
+                return MockResponse({"error": "no track"}, 400)
+            start, end = int(params["start"]), int(params["end"])
+            # knownGene items are genePred rows
+            overlapping = [{"chrom": params["chrom"], "txStart": s, "txEnd": e, "cdsStart": s,
+                            "cdsEnd": e, "exonCount": 1, "name": str(s)}
+                           for s, e in items[params["chrom"]] if s < end and e > start]
+            response = {TEST_TRACK: overlapping[:int(params["maxItemsOutput"])]}
+            if len(overlapping) > int(params["maxItemsOutput"]):
+                response["maxItemsLimit"] = True
+            return MockResponse(response, 200)
+
+        TEST_TRACK = "knownGene"
+        with mock.patch('requests.get', side_effect=track_requests_get):
+            ss = self.hg_genome.fetch_track(TEST_TRACK, window_size=500, max_items=20, workers=3)
+            self.assertRaises(InvalidTrackError, self.hg_genome.fetch_track, "noTrack")
+            self.assertRaises(InvalidTrackError, self.hg_genome.fetch_track, "noCoordinates")
+
+        expected = [(TEST_CHROM_1, s, e, str(s)) for s, e in items[TEST_CHROM_1]]
+        expected += [(TEST_CHROM_M, s, e, str(s)) for s, e in items[TEST_CHROM_M]]
+        self.assertEqual([(seq.chromosome, seq.start, seq.end, seq.label) for seq in ss.sequences],
+                         expected)
+        self.assertEqual(ss.genome, TEST_GENOME)
+        self.assertTrue(any("maxItemsOutput=20" in url and "end=500" in url for url in urls))
+        self.assertTrue(any("start=250" in url for url in urls))
+
+    # windows tile each chromosome, the last window ending at the chromosome end
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_windows(self, mock_get):
+        windows = [(seq.chromosome, seq.start, seq.end) for seq in self.hg_genome.windows(500)]
+        self.assertEqual(windows[:4], [(TEST_CHROM_1, 0, 500), (TEST_CHROM_1, 500, 1000),
+                                       (TEST_CHROM_1, 1000, 1234), (TEST_CHROM_M, 0, 500)])
+        self.assertEqual(windows[-1], (TEST_CHROM_M, 5500, 5678))
+        self.assertEqual(len(windows), 3 + 12)
+
+        sliding = self.hg_genome.windows(600, step=400, chromosomes=[TEST_CHROM_1])
+        self.assertEqual([(seq.start, seq.end) for seq in sliding],
+                         [(0, 600), (400, 1000), (800, 1234)])
+
+        batches = list(self.hg_genome.windows(500, batch_size=4))
+        self.assertEqual([len(batch.sequences) for batch in batches], [4, 4, 4, 3])
+        self.assertEqual(batches[0].genome, TEST_GENOME)
+        self.assertRaises(ValueError, self.hg_genome.windows, 0)
+
+    # windows overlapping assembly gaps are skipped
+    def test_windows_skip_gaps(self):
+        def gap_requests_get(*args, **kwargs):
+            if "getData/track" not in args[0]:
+                return mocked_requests_get(*args, **kwargs)
+            response = mock.Mock(status_code=200)
+            gaps = [{"chromStart": 0, "chromEnd": 100}, {"chromStart": 1100, "chromEnd": 1150}]
+            response.json.return_value = {"gap": gaps if TEST_CHROM_1 in args[0] else []}
+            return response
+
+        with mock.patch('requests.get', side_effect=gap_requests_get):
+            windows = self.hg_genome.windows(250, chromosomes=[TEST_CHROM_1, TEST_CHROM_M],
+                                             skip_gaps=True)
+            windows = [(seq.chromosome, seq.start) for seq in windows]
+        self.assertEqual(windows[:4], [(TEST_CHROM_1, 250), (TEST_CHROM_1, 500),
+                                       (TEST_CHROM_1, 750), (TEST_CHROM_M, 0)])
+        self.assertEqual(len(windows), 3 + 23)
+
+    # bulk downloads split the assembly file into the same files as the API download
+    def test_download_sequence_bulk(self):
+        for bulk in ("2bit", "chromFa"):
+            with tempfile.TemporaryDirectory() as tmp, \
+                 mock.patch('requests.get', side_effect=mocked_bulk_requests_get) as mock_get:
+                prefix = os.path.join(tmp, "bulk")
+                self.hg_genome.download_sequence(prefix, bulk=bulk)
+                for chrom in (TEST_CHROM_1, TEST_CHROM_M):
+                    with open(prefix + "_" + TEST_GENOME + "_" + chrom) as f:
+                        self.assertEqual(f.read(), TEST_ASSEMBLY[chrom])
+                self.assertFalse(os.path.exists(prefix + "_" + TEST_GENOME + "_chrUn_test"))
+                self.assertEqual(mock_get.call_count, 1)
+
+                # the assembly file is kept and reused
+                self.hg_genome.download_sequence(prefix, "chrUn_test", bulk=bulk)
+                with open(prefix + "_" + TEST_GENOME + "_chrUn_test") as f:
+                    self.assertEqual(f.read(), "CCCC")
+                self.assertRaises(InvalidChromosomeError, self.hg_genome.download_sequence,
+                                  prefix, "chr9", bulk=bulk)
+                self.assertEqual(mock_get.call_count, 1)
+
+                if bulk == "2bit":
+                    with TwoBitFile(prefix + "_" + TEST_GENOME + ".2bit") as twobit:
+                        dna = TEST_ASSEMBLY[TEST_CHROM_1]
+                        for start in range(len(dna)):
+                            for end in range(start, len(dna) + 2):
+                                self.assertEqual(twobit.sequence(TEST_CHROM_1, start, end), dna[start:end])
+        self.assertRaises(ValueError, self.hg_genome.download_sequence, "x", bulk="zip")
+
+        # older assemblies only have chromFa.tar.gz
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('requests.get', side_effect=mocked_old_bulk_requests_get) as mock_get:
+            prefix = os.path.join(tmp, "bulk")
+            self.hg_genome.download_sequence(prefix, TEST_CHROM_M, bulk="chromFa")
+            with open(prefix + "_" + TEST_GENOME + "_" + TEST_CHROM_M) as f:
+                self.assertEqual(f.read(), TEST_ASSEMBLY[TEST_CHROM_M])
+            self.assertEqual(mock_get.call_count, 2)
+
+    # the gap and repeat index is built from the 2bit file or chromosome files and cached
+    def test_mask_index(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('requests.get', side_effect=mocked_bulk_requests_get):
+            prefix = os.path.join(tmp, "mask")
+            index = self.hg_genome.mask_index(prefix)
+            self.assertEqual(sorted(index.chromosomes()), sorted(TEST_ASSEMBLY))
+            n_runs, lower_runs = index.runs(TEST_CHROM_1)
+            self.assertEqual(list(n_runs), [0, 4, 17, 19])
+            self.assertEqual(list(lower_runs), [8, 12, 17, 19])
+            self.assertEqual(index.fractions(TEST_CHROM_1, 2, 12), (0.2, 0.4))
+            self.assertEqual(index.fractions(TEST_CHROM_M, 0, 7), (0.0, 0.0))
+            self.assertTrue(os.path.exists(prefix + "_" + TEST_GENOME + "_2bit.mask"))
+
+            with mock.patch('ucscpynome.mask.MaskIndex.save') as save:
+                cached = self.hg_genome.mask_index(prefix)
+                save.assert_not_called()
+            self.assertEqual(cached.runs(TEST_CHROM_1), index.runs(TEST_CHROM_1))
+
+            # the cache of the 2bit index is not used for the chromosome files
+            self.hg_genome.download_sequence(prefix, bulk="2bit")
+            from_files = self.hg_genome.mask_index(prefix, source="files")
+            self.assertEqual(sorted(from_files.chromosomes()), [TEST_CHROM_1, TEST_CHROM_M])
+            self.assertEqual(from_files.runs(TEST_CHROM_1), index.runs(TEST_CHROM_1))
+            self.assertRaises(FileNotFoundError, self.hg_genome.mask_index,
+                              os.path.join(tmp, "other"), source="files")
+
+    # syncing only downloads chromosomes that are missing or do not have their size
+    def test_sync_sequence(self):
+        sizes = {TEST_CHROM_1: len(TEST_CHROM_1_SEQUENCE), TEST_CHROM_M: len(TEST_CHROM_M_SEQUENCE)}
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(self.hg_genome.chromosome_sizes(), sizes), \
+             mock.patch('requests.get', side_effect=mocked_requests_get) as mock_get:
+            prefix = os.path.join(tmp, "sync")
+            self.assertEqual(sorted(self.hg_genome.sync_sequence(prefix)), [TEST_CHROM_1, TEST_CHROM_M])
+            calls = mock_get.call_count
+            self.assertEqual(self.hg_genome.sync_sequence(prefix), [])
+            self.assertEqual(mock_get.call_count, calls)
+
+            with open(prefix + "_" + TEST_GENOME + "_" + TEST_CHROM_1, "w") as f:
+                f.write(TEST_CHROM_1_SEQUENCE[:5])
+            self.assertEqual(self.hg_genome.sync_sequence(prefix), [TEST_CHROM_1])
+            with open(prefix + "_" + TEST_GENOME + "_" + TEST_CHROM_1) as f:
+                self.assertEqual(f.read(), TEST_CHROM_1_SEQUENCE)
+
+    # with bulk, the assembly file is downloaded again when the remote copy changed
+    def test_sync_sequence_bulk(self):
+        sizes = {chrom: len(dna) for chrom, dna in TEST_ASSEMBLY.items()}
+        remote = {"Content-Length": str(len(twobit_bytes(TEST_ASSEMBLY))),
+                  "Last-Modified": "Mon, 01 Jan 2001 00:00:00 GMT"}
+        def mocked_requests_head(*args, **kwargs):
+            return mock.Mock(status_code=200, headers=dict(remote))
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(self.hg_genome.chromosome_sizes(), sizes), \
+             mock.patch('requests.head', side_effect=mocked_requests_head) as mock_head, \
+             mock.patch('requests.get', side_effect=mocked_bulk_requests_get) as mock_get:
+            prefix = os.path.join(tmp, "sync")
+            self.assertEqual(sorted(self.hg_genome.sync_sequence(prefix, bulk="2bit")),
+                             [TEST_CHROM_1, TEST_CHROM_M])
+            self.assertEqual(self.hg_genome.sync_sequence(prefix, bulk="2bit"), [])
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(mock_head.call_count, 1)
+
+            remote["Last-Modified"] = "Fri, 01 Jan 2100 00:00:00 GMT"
+            self.assertEqual(sorted(self.hg_genome.sync_sequence(prefix, bulk="2bit")),
+                             [TEST_CHROM_1, TEST_CHROM_M])
+            self.assertEqual(mock_get.call_count, 2)
+            self.assertRaises(ValueError, self.hg_genome.sync_sequence, prefix, bulk="zip")
+
+            # the assembly file is downloaded again when its metadata cannot be requested
+            with mock.patch('ucscpynome.retry.Requests.head', side_effect=NetworkError("timed out")):
+                self.assertEqual(sorted(self.hg_genome.sync_sequence(prefix, bulk="2bit")),
+                                 [TEST_CHROM_1, TEST_CHROM_M])
+            self.assertEqual(mock_get.call_count, 3)
+
+            # a failed refresh keeps the stale copy
+            mock_get.side_effect = lambda *args, **kwargs: mock.Mock(status_code=404)
+            self.assertRaises(FileNotFoundError, self.hg_genome.sync_sequence, prefix, bulk="2bit")
+            with open(prefix + "_" + TEST_GENOME + ".2bit", "rb") as f:
+                self.assertEqual(f.read(), twobit_bytes(TEST_ASSEMBLY))
+
+    # chromosomes missing from the assembly file do not make every sync split it again
+    def test_sync_sequence_bulk_missing_chromosome(self):
+        sizes = {chrom: len(dna) for chrom, dna in TEST_ASSEMBLY.items()}
+        sizes["chrX"] = 100
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(self.hg_genome.chromosome_sizes(), sizes), \
+             mock.patch('requests.head', return_value=mock.Mock(status_code=404)), \
+             mock.patch('requests.get', side_effect=mocked_bulk_requests_get) as mock_get:
+            prefix = os.path.join(tmp, "sync")
+            self.assertEqual(sorted(self.hg_genome.sync_sequence(prefix, bulk="2bit")),
+                             [TEST_CHROM_1, TEST_CHROM_M])
+            with mock.patch.object(Genome, "_Genome__split_2bit") as mock_split:
+                self.assertEqual(self.hg_genome.sync_sequence(prefix, bulk="2bit"), [])
+            mock_split.assert_not_called()
+            self.assertEqual(mock_get.call_count, 1)
+
+            os.remove(prefix + "_" + TEST_GENOME + "_" + TEST_CHROM_M)
+            self.assertEqual(self.hg_genome.sync_sequence(prefix, bulk="2bit"), [TEST_CHROM_M])
+            self.assertEqual(mock_get.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
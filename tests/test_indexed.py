@@ -0,0 +1,146 @@
+import unittest
+import os
+import struct
+import sys
+import tempfile
+import zlib
+sys.path.append("..")
+from ucscpynome import SequenceSet, MalformedBedFileError
+
+TEST_GENOME = "hg19"
+TEST_RECORDS = [("chr1", 100, 200, "a"), ("chr1", 150, 400, "b"),
+                ("chr1", 70000, 70100, "c"), ("chr1", 5000000, 5000500, "d"),
+                ("chr2", 100, 300, "e")]
+
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = 18 + len(deflated) + 8
+    header = b"\x1f\x8b\x08\x04" + b"\0" * 6 + struct.pack("<H", 6) + b"BC" + struct.pack("<HH", 2, block_size - 1)
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def reg2bin(start, end):
+    end -= 1
+    for shift, first in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if start >> shift == end >> shift:
+            return first + (start >> shift)
+    return 0
+
+
+def write_tabix(path, records):
+    """ Writes records as a bgzip BED file, one block per record, and its tabix index """
+    names = []
+    bins = {}
+    offset = 0
+    with open(path, "wb") as f:
+        for chrom, start, end, label in records:
+            block = bgzf_block(("%s\t%d\t%d\t%s\n" % (chrom, start, end, label)).encode())
+            f.write(block)
+            if chrom not in names:
+                names.append(chrom)
+                bins[chrom] = {}
+            bins[chrom].setdefault(reg2bin(start, end), []).append((offset << 16, (offset + len(block)) << 16))
+            offset += len(block)
+        f.write(bgzf_block(b""))
+
+    name_bytes = b"".join(name.encode() + b"\0" for name in names)
+    index = b"TBI\1" + struct.pack("<8i", len(names), 0x10000, 1, 2, 3, ord("#"), 0, len(name_bytes)) + name_bytes
+    for name in names:
+        index += struct.pack("<i", len(bins[name]))
+        for bin_number, chunks in bins[name].items():
+            index += struct.pack("<Ii", bin_number, len(chunks))
+            for chunk in chunks:
+                index += struct.pack("<QQ", *chunk)
+        index += struct.pack("<i", 0)
+    with open(path + ".tbi", "wb") as f:
+        f.write(bgzf_block(index) + bgzf_block(b""))
+
+
+def write_bigbed(path, records):
+    """ Writes records as a bigBed file with one data block per record """
+    chroms = sorted({record[0] for record in records})
+    chrom_tree = struct.pack("<IIIIQQ", 0x78CA8C91, len(chroms), 4, 8, len(chroms), 0)
+    chrom_tree += struct.pack("<BBH", 1, 0, len(chroms))
+    for i, chrom in enumerate(chroms):
+        chrom_tree += chrom.encode().ljust(4, b"\0") + struct.pack("<II", i, 10 ** 8)
+
+    data = b""
+    leaves = []
+    data_offset = 64 + len(chrom_tree)
+    for chrom, start, end, label in records:
+        chrom_id = chroms.index(chrom)
+        block = zlib.compress(struct.pack("<III", chrom_id, start, end) + label.encode() + b"\0")
+        leaves.append(struct.pack("<IIIIQQ", chrom_id, start, chrom_id, end,
+                                  data_offset + len(data), len(block)))
+        data += block
+
+    index_offset = data_offset + len(data)
+    rtree = struct.pack("<IIQIIIIQII", 0x2468ACE0, len(leaves), len(leaves), 0, 0, 0, 0, 0, 1, 0)
+    rtree += struct.pack("<BBH", 1, 0, len(leaves)) + b"".join(leaves)
+    header = struct.pack("<IHHQQQHHQQIQ", 0x8789F2EB, 4, 0, 64, data_offset, index_offset,
+                         4, 3, 0, 0, 1, 0)
+    with open(path, "wb") as f:
+        f.write(header + chrom_tree + data + rtree)
+
+
+class TestFromRegion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tabix = os.path.join(self.tmp.name, "test.bed.gz")
+        self.bigbed = os.path.join(self.tmp.name, "test.bb")
+        write_tabix(self.tabix, TEST_RECORDS)
+        write_bigbed(self.bigbed, TEST_RECORDS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def region(self, file_name, chrom, start, end):
+        ss = SequenceSet.from_region(file_name, chrom, start, end, TEST_GENOME)
+        self.assertEqual(ss.genome, TEST_GENOME)
+        return [seq.label for seq in ss.sequences]
+
+    def check_regions(self, file_name):
+        self.assertEqual(self.region(file_name, "chr1", 0, 1000), ["a", "b"])
+        self.assertEqual(self.region(file_name, "chr1", 199, 70001), ["a", "b", "c"])
+        self.assertEqual(self.region(file_name, "chr1", 200, 400), ["b"])
+        self.assertEqual(self.region(file_name, "chr1", 4000000, 6000000), ["d"])
+        self.assertEqual(self.region(file_name, "chr1", 400, 70000), [])
+        self.assertEqual(self.region(file_name, "chr2", 0, 10 ** 6), ["e"])
+        self.assertEqual(self.region(file_name, "chr3", 0, 10 ** 6), [])
+
+    # tabix-indexed bgzip BED files
+    def test_tabix(self):
+        self.check_regions(self.tabix)
+        ss = SequenceSet.from_region(self.tabix, "chr1", 0, 160, TEST_GENOME)
+        self.assertEqual([(seq.chromosome, seq.start, seq.end) for seq in ss.sequences],
+                         [("chr1", 100, 200), ("chr1", 150, 400)])
+
+    # bigBed files
+    def test_bigbed(self):
+        self.check_regions(self.bigbed)
+
+    # files that are not indexed
+    def test_not_indexed(self):
+        self.assertRaises(FileNotFoundError, SequenceSet.from_region,
+                          "test_files/hg19_ex.bed", "chr1", 0, 100, TEST_GENOME)
+        with open(self.tabix + ".tbi", "wb") as f:
+            f.write(bgzf_block(b"not an index"))
+        os.utime(self.tabix, ns=(0, 0))
+        self.assertRaises(MalformedBedFileError, SequenceSet.from_region,
+                          self.tabix, "chr1", 0, 100, TEST_GENOME)
+
+    # files too short to hold a magic number
+    def test_short_file(self):
+        for content in [b"", b"ch"]:
+            short = os.path.join(self.tmp.name, "short%d.bed" % len(content))
+            with open(short, "wb") as f:
+                f.write(content)
+            self.assertRaises(MalformedBedFileError, SequenceSet.from_region,
+                              short, "chr1", 0, 100, TEST_GENOME)
+
+
+if __name__ == '__main__':
+    unittest.main()
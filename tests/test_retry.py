@@ -0,0 +1,316 @@
+import unittest
+from unittest import mock
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+sys.path.append("..")
+from ucscpynome import Requests
+from ucscpynome.archive import ArchiveError
+from ucscpynome.retry import NetworkError, _ConcurrencyLimiter
+
+TEST_URL = "https://api.genome.ucsc.edu/getData/sequence?genome=hg38;chrom=chrM;start=0;end=16"
+TEST_CONTENT = b'{"dna": "GATCACAGGTCTATCA"}'
+
+
+def mocked_requests_get(*args, **kwargs):
+    class MockResponse:
+        def __init__(self, content, status_code):
+            self.content = content
+            self.status_code = status_code
+
+    if args[0] == TEST_URL:
+        return MockResponse(TEST_CONTENT, 200)
+    return MockResponse(b'{"error": "not found"}', 404)
+
+
+def offline_requests_get(*args, **kwargs):
+    raise AssertionError("network access while replaying")
+
+
+class TestRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.archive_path = os.path.join(self.archive_dir.name, "responses.archive")
+
+    def tearDown(self):
+        Requests.online()
+        self.archive_dir.cleanup()
+
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def record(self, urls, mock_get):
+        Requests.record(self.archive_path)
+        for url in urls:
+            Requests().get(url)
+        Requests.online()
+
+    # responses recorded online are replayed offline with the same status and body
+    @mock.patch('requests.get', side_effect=offline_requests_get)
+    def test_record_replay(self, mock_get):
+        self.record([TEST_URL, TEST_URL + "0"])
+
+        Requests.replay(self.archive_path)
+        response = Requests().get(TEST_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["dna"], "GATCACAGGTCTATCA")
+        self.assertEqual(Requests().get(TEST_URL + "0").status_code, 404)
+        mock_get.assert_not_called()
+
+    # urls missing from the archive fail instead of going to the network
+    @mock.patch('requests.get', side_effect=offline_requests_get)
+    def test_replay_missing_url(self, mock_get):
+        self.record([TEST_URL])
+
+        Requests.replay(self.archive_path)
+        self.assertRaises(NetworkError, Requests().get, TEST_URL + "1")
+
+    # recording into an existing archive appends to it
+    def test_record_appends(self):
+        self.record([TEST_URL])
+        self.record([TEST_URL + "0"])
+
+        Requests.replay(self.archive_path)
+        self.assertEqual(Requests().get(TEST_URL).status_code, 200)
+        self.assertEqual(Requests().get(TEST_URL + "0").status_code, 404)
+
+    # a recording killed mid-write leaves a partial record, which replaying refuses and
+    # recording drops before appending
+    @mock.patch('requests.get', side_effect=offline_requests_get)
+    def test_record_truncated(self, mock_get):
+        self.record([TEST_URL, TEST_URL + "0"])
+        with open(self.archive_path, "r+b") as f:
+            f.truncate(os.path.getsize(self.archive_path) - 3)
+        self.assertRaises(ArchiveError, Requests.replay, self.archive_path)
+
+        self.record([TEST_URL + "1"])
+        Requests.replay(self.archive_path)
+        self.assertEqual(Requests().get(TEST_URL).status_code, 200)
+        self.assertEqual(Requests().get(TEST_URL + "1").status_code, 404)
+        self.assertRaises(NetworkError, Requests().get, TEST_URL + "0")
+
+
+class MockStreamResponse:
+    def __init__(self, content, status_code):
+        self.status_code = status_code
+        self.content = content
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def streaming_requests_get(*args, **kwargs):
+    if args[0] == TEST_URL:
+        return MockStreamResponse(TEST_CONTENT, 200)
+    return MockStreamResponse(b"", 404)
+
+
+class TestDownload(unittest.TestCase):
+
+    # response bodies are streamed into the file, other statuses leave no file
+    def test_download(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('requests.get', side_effect=streaming_requests_get):
+            file_path = os.path.join(tmp, "body")
+            self.assertEqual(Requests().download(TEST_URL, file_path, chunk_size=4), 200)
+            with open(file_path, "rb") as f:
+                self.assertEqual(f.read(), TEST_CONTENT)
+            self.assertEqual(Requests().download(TEST_URL + "0", file_path + "0"), 404)
+            self.assertEqual(os.listdir(tmp), ["body"])
+
+    # errors while writing the body leave no partial file
+    def test_download_write_error(self):
+        class FailingResponse(MockStreamResponse):
+            def iter_content(self, chunk_size):
+                yield self.content
+                raise OSError("No space left on device")
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('requests.get', return_value=FailingResponse(TEST_CONTENT, 200)):
+            self.assertRaises(OSError, Requests().download, TEST_URL, os.path.join(tmp, "body"))
+            self.assertEqual(os.listdir(tmp), [])
+
+    # recorded downloads are streamed into the archive and can be replayed
+    def test_download_record(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = os.path.join(tmp, "responses.archive")
+            with mock.patch('requests.get', side_effect=streaming_requests_get):
+                Requests.record(archive_path)
+                try:
+                    Requests().download(TEST_URL, os.path.join(tmp, "recorded"), chunk_size=4)
+                finally:
+                    Requests.online()
+            Requests.replay(archive_path)
+            try:
+                with mock.patch('requests.get', side_effect=offline_requests_get):
+                    self.assertEqual(Requests().download(TEST_URL, os.path.join(tmp, "replayed")), 200)
+            finally:
+                Requests.online()
+            with open(os.path.join(tmp, "replayed"), "rb") as f:
+                self.assertEqual(f.read(), TEST_CONTENT)
+
+class TestCoalescing(unittest.TestCase):
+
+    # concurrent GETs for the same url share a single request
+    def test_concurrent_get(self):
+        def slow_requests_get(*args, **kwargs):
+            time.sleep(0.1)
+            return mocked_requests_get(*args, **kwargs)
+
+        responses = []
+        def get():
+            responses.append(Requests().get(TEST_URL))
+
+        Requests.reset_stats()
+        with mock.patch('requests.get', side_effect=slow_requests_get) as mock_get:
+            threads = [threading.Thread(target=get) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(len(responses), 8)
+        self.assertTrue(all(response is responses[0] for response in responses))
+        self.assertEqual(Requests.stats()["coalesced"], 7)
+
+    # the error of a failed request is raised in every waiting caller
+    def test_concurrent_error(self):
+        import requests
+        def failing_requests_get(*args, **kwargs):
+            time.sleep(0.1)
+            raise requests.exceptions.ConnectionError()
+
+        errors = []
+        def get():
+            try:
+                Requests(retries=1).get(TEST_URL)
+            except NetworkError as e:
+                errors.append(e)
+
+        with mock.patch('requests.get', side_effect=failing_requests_get):
+            threads = [threading.Thread(target=get) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(errors), 4)
+
+
+    # a child forked while a GET is in flight does not wait for the parent's response
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_fork_in_flight(self):
+        started = threading.Event()
+        def slow_requests_get(*args, **kwargs):
+            started.set()
+            time.sleep(0.3)
+            return mocked_requests_get(*args, **kwargs)
+
+        with mock.patch('requests.get', side_effect=slow_requests_get):
+            thread = threading.Thread(target=Requests().get, args=(TEST_URL,))
+            thread.start()
+            started.wait()
+            pid = os.fork()
+            if pid == 0:
+                signal.alarm(5)
+                os._exit(0 if Requests().get(TEST_URL).status_code == 200 else 1)
+            _, status = os.waitpid(pid, 0)
+            thread.join()
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def tearDown(self):
+        Requests.set_concurrency()
+
+    # no more requests than the limit are in flight at once
+    def test_limit(self):
+        lock = threading.Lock()
+        counts = {"now": 0, "max": 0}
+        def counting_requests_get(*args, **kwargs):
+            with lock:
+                counts["now"] += 1
+                counts["max"] = max(counts["max"], counts["now"])
+            time.sleep(0.02)
+            with lock:
+                counts["now"] -= 1
+            return mocked_requests_get(*args, **kwargs)
+
+        Requests.set_concurrency(max_requests=3, adaptive=False)
+        with mock.patch('requests.get', side_effect=counting_requests_get):
+            threads = [threading.Thread(target=Requests().get, args=(TEST_URL + str(i),))
+                       for i in range(12)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(counts["max"], 3)
+        self.assertEqual(Requests.stats()["concurrency_limit"], 3)
+        self.assertEqual(Requests.stats()["in_flight"], 0)
+
+    # the limit grows additively with fast responses and is halved on congestion
+    def test_aimd(self):
+        limiter = _ConcurrencyLimiter(initial=2, max_limit=6)
+        for _ in range(50):
+            limiter.acquire()
+            limiter.release(1.0)
+        self.assertEqual(limiter.limit, 6)
+        limiter.acquire()
+        limiter.release(congested=True)
+        self.assertEqual(limiter.limit, 3)
+        # failures within the same round trip count once
+        limiter.acquire()
+        limiter.release(congested=True)
+        self.assertEqual(limiter.limit, 3)
+
+        # responses much slower than the baseline reduce the limit, once per round trip
+        clock = iter(range(1000, 10 ** 6, 100))
+        with mock.patch('time.monotonic', side_effect=lambda: next(clock)):
+            for _ in range(20):
+                limiter.acquire()
+                limiter.release(5.0)
+        self.assertLess(limiter.limit, 3)
+        self.assertGreaterEqual(limiter.limit, 1)
+
+    # slow large downloads and slow endpoints are not compared with fast small requests
+    def test_latency_baselines(self):
+        limiter = _ConcurrencyLimiter(initial=4, max_limit=8)
+        clock = iter(range(1000, 10 ** 6, 100))
+        with mock.patch('time.monotonic', side_effect=lambda: next(clock)):
+            for _ in range(10):
+                limiter.acquire()
+                limiter.release(0.01, endpoint="https://api/list/chromosomes", size=100)
+            limit = limiter.limit
+            for _ in range(10):
+                limiter.acquire()
+                limiter.release(30.0, endpoint="https://download/hg38.2bit", size=100 << 20)
+                limiter.acquire()
+                limiter.release(0.5, endpoint="https://api/getData/sequence", size=4 << 20)
+                limiter.acquire()
+                limiter.release(2.0, endpoint="https://api/getData/sequence", size=16 << 20)
+        self.assertGreater(limiter.limit, limit)
+
+    # 429 responses are retried after the delay asked for by the server
+    def test_throttled(self):
+        responses = []
+        def throttling_requests_get(*args, **kwargs):
+            response = mock.Mock(content=TEST_CONTENT, status_code=429 if not responses else 200,
+                                 headers={"Retry-After": "0"})
+            responses.append(response)
+            return response
+
+        Requests.reset_stats()
+        with mock.patch('requests.get', side_effect=throttling_requests_get):
+            self.assertEqual(Requests().get(TEST_URL).status_code, 200)
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(Requests.stats()["throttled"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -39,11 +39,13 @@ class TestSequence(unittest.TestCase):
                        f"'genome': '{TEST_GENOME}', 'chromosome': '{TEST_CHROM}'}}"
         self.assertTrue((str(self.newSeq)) == expected_seq)
 
-    # ensure sequence string is same object and saved due to lazy evaluation
+    # ensure sequence string is saved due to lazy evaluation (it is stored packed,
+    # so each call decodes an equal string) and only fetched once
     # ensures the length is the equal to the difference of the coordinates
     @mock.patch('requests.get', side_effect=mocked_requests_get)
     def test_sequence_string(self, mock_get):
-        self.assertTrue(self.newSeq.string() is self.newSeq.string())
+        self.assertEqual(self.newSeq.string(), self.newSeq.string())
+        self.assertEqual(mock_get.call_count, 1)
         self.assertEqual(len(str(self.newSeq.string())),(TEST_CHROM_END-TEST_CHROM_START))
 
     # ensure users can't change immutable sequence attributes
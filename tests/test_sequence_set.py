@@ -1,9 +1,19 @@
 import unittest
+import gzip
 import os
+import pickle
 import sys
+import tempfile
+from array import array
+from unittest import mock
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append("..")
 from ucscpynome import SequenceSet, Sequence, Genome
-from ucscpynome import MalformedBedFileError, LiftoverError, InvalidGenomeError
+from ucscpynome import MalformedBedFileError, LiftoverError, InvalidGenomeError, MaskIndex
 
 TEST_GENOME = "hg19"
 class TestSequence(unittest.TestCase):
@@ -74,5 +84,311 @@ class TestSequence(unittest.TestCase):
         self.assertRaises(LiftoverError, bad_chain_file)
 
 
+def shared_set_summary(shared_set):
+    # runs in a process pool worker
+    return (len(shared_set), shared_set.chromosome(0), shared_set.starts[1],
+            shared_set.ends[1], shared_set.string(1), shared_set.label(0))
+
+
+class TestSequenceSetTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SequenceSet(["../tests/test_files/hg19_ex.bed"], TEST_GENOME)
+        self.ss.sequences[0].label = "gene1"
+        self.ss.sequences[1]._cache_string("ACGT")
+
+    # pickling keeps coordinates, labels and fetched sequences
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.ss))
+        self.assertEqual(copy.genome, self.ss.genome)
+        self.assertEqual([str(seq) for seq in copy.sequences],
+                         [str(seq) for seq in self.ss.sequences])
+        self.assertEqual(copy.sequences[1]._cached_string(), "ACGT")
+        self.assertIsNone(copy.sequences[0]._cached_string())
+
+    # the DNA is pickled and shared packed, with its N and soft-masked runs
+    def test_packed_transfer(self):
+        dna = "ACGT" * 2000 + "NNNNacgtA"
+        self.ss.sequences[2]._cache_string(dna)
+        self.assertLess(len(pickle.dumps(self.ss)), len(dna) // 2)
+        copy = pickle.loads(pickle.dumps(self.ss))
+        self.assertEqual(copy.sequences[2]._cached_string(), dna)
+        self.assertEqual(copy.sequences[1]._cached_string(), "ACGT")
+        with self.ss.to_shared_memory() as shared:
+            self.assertEqual(shared.string(2), dna)
+            self.assertEqual(len(shared.packed(2).data), (len(dna) + 3) // 4)
+            self.assertIsNone(shared.packed(0))
+            self.assertEqual(shared.to_sequence_set().sequences[2]._cached_string(), dna)
+
+    # a shared set can be read by pool workers and copied back
+    def test_shared_memory(self):
+        with self.ss.to_shared_memory() as shared:
+            with ProcessPoolExecutor(1) as executor:
+                summary = executor.submit(shared_set_summary, shared).result()
+            self.assertEqual(summary, (len(self.ss.sequences), "chr1", 213942363,
+                                       213943530, "ACGT", "gene1"))
+            copy = shared.to_sequence_set()
+            self.assertEqual([str(seq) for seq in copy.sequences],
+                             [str(seq) for seq in self.ss.sequences])
+
+
+@unittest.skipUnless(pyarrow, "pyarrow is not installed")
+class TestSequenceSetArrow(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SequenceSet(["../tests/test_files/hg19_ex.bed"], TEST_GENOME)
+        self.ss.sequences[0].label = "gene1"
+        self.ss.sequences[1]._cache_string("ACGTn")
+
+    def assertSameSet(self, ss1, ss2):
+        self.assertEqual(ss1.genome, ss2.genome)
+        self.assertEqual([str(seq) for seq in ss1.sequences], [str(seq) for seq in ss2.sequences])
+
+    # a set survives the round trip through an Arrow table
+    def test_arrow(self):
+        table = self.ss.to_arrow(include_sequences=True)
+        self.assertEqual(table.column_names, ["chrom", "start", "end", "label", "sequence"])
+        self.assertEqual(table.column("start")[0].as_py(), self.ss.sequences[0].start)
+        copy = SequenceSet.from_arrow(table)
+        self.assertSameSet(copy, self.ss)
+        self.assertEqual(copy.sequences[1]._cached_string(), "ACGTn")
+
+    # a set survives the round trip through a Parquet file
+    def test_parquet(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hg19.parquet")
+            self.ss.to_parquet(path)
+            self.assertSameSet(SequenceSet.from_parquet(path), self.ss)
+
+    # tables without metadata need a genome
+    def test_arrow_genome(self):
+        table = pyarrow.table({"chrom": ["chr1"], "start": [1], "end": [10]})
+        self.assertRaises(ValueError, SequenceSet.from_arrow, table)
+        self.assertEqual(SequenceSet.from_arrow(table, "hg38").sequences[0].end, 10)
+
+
+TEST_CHROM_SIZES = {"chr1": 1000, "chr2": 500}
+
+def mocked_requests_get(*args, **kwargs):
+    class MockResponse:
+        def __init__(self, json_data, status_code):
+            self.json_data = json_data
+            self.status_code = status_code
+
+        def json(self):
+            return self.json_data
+
+    if "getData/sequence" in args[0]:
+        start = int(args[0].split("start=")[1].split(";")[0])
+        end = int(args[0].split("end=")[1])
+        return MockResponse({"dna": "A" * (end - start)}, 200)
+    elif "list/ucscGenomes" in args[0]:
+        return MockResponse({"ucscGenomes": {TEST_GENOME: {"organism": "Human"}}}, 200)
+    elif f"list/chromosomes?genome={TEST_GENOME}" in args[0]:
+        return MockResponse({"chromosomes": TEST_CHROM_SIZES}, 200)
+    raise AssertionError("unexpected request " + args[0])
+
+
+class TestSequenceSetPrefetch(unittest.TestCase):
+
+    # prefetching yields every sequence in order with its DNA
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_prefetch(self, mock_get):
+        sequences = [Sequence(i, i + 10 + i, TEST_GENOME, "chr1", str(i)) for i in range(20)]
+        ss = SequenceSet.from_sequences(sequences, TEST_GENOME)
+        result = [(seq.label, dna) for seq, dna in ss.prefetch(ahead=4, workers=2)]
+        self.assertEqual(result, [(str(i), "A" * (10 + i)) for i in range(20)])
+
+
+class TestSequenceSetValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.bed_file = tempfile.NamedTemporaryFile("w", suffix=".bed", delete=False)
+        self.bed_file.write("chr1\t10\t20\tok\n"
+                            "chr1\t990\t1010\tpast_end\n"
+                            "chr2\t50\t40\tinverted\n"
+                            "chrZ\t0\t10\tunknown\n"
+                            "chr2\t600\t700\toutside\n")
+        self.bed_file.close()
+        self.ss = SequenceSet([self.bed_file.name], TEST_GENOME)
+        self.registry = [mock.patch.object(Genome, '_Genome__populated', False),
+                         mock.patch.dict(Genome._Genome__genome_dict, clear=True),
+                         mock.patch.dict(Genome._Genome__organism_dict, clear=True),
+                         mock.patch('requests.get', side_effect=mocked_requests_get)]
+        for patch in self.registry:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.registry:
+            patch.stop()
+        os.remove(self.bed_file.name)
+
+    # invalid rows are reported without changing the set
+    def test_validate(self):
+        problems = self.ss.validate()
+        self.assertEqual([(i, reason) for i, seq, reason in problems],
+                         [(1, SequenceSet.OUT_OF_RANGE), (2, SequenceSet.INVERTED),
+                          (3, SequenceSet.UNKNOWN_CHROMOSOME), (4, SequenceSet.OUT_OF_RANGE)])
+        self.assertEqual(len(self.ss.sequences), 5)
+
+    # clipping keeps valid rows, clips overhanging rows and drops the rest
+    def test_validate_clip(self):
+        self.ss.validate(clip=True)
+        self.assertEqual([(seq.chromosome, seq.start, seq.end, seq.label) for seq in self.ss.sequences],
+                         [("chr1", 10, 20, "ok"), ("chr1", 990, 1000, "past_end")])
+        self.assertEqual(self.ss.validate(), [])
+
+    # clipped rows keep the part of their DNA already fetched and their memory budget
+    def test_validate_clip_dna(self):
+        self.ss.set_memory_budget(10 ** 6)
+        self.ss.sequences[1]._cache_string("ACGT" * 5)
+        self.ss.validate(clip=True)
+        clipped = self.ss.sequences[1]
+        self.assertEqual(clipped._cached_string(), "ACGTACGTAC")
+        self.assertEqual(self.ss.cached_bytes(), clipped._cached_dna().nbytes)
+
+
+
+class TestSequenceSetWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ss = SequenceSet.from_sequences(
+            [Sequence(i, i + 5 + i % 7, TEST_GENOME, "chr1", str(i) if i % 3 else None)
+             for i in range(50)], TEST_GENOME)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # bed rows are written in batches, in order
+    def test_to_bed(self):
+        out = os.path.join(self.tmp.name, "out.bed")
+        with mock.patch.object(SequenceSet, 'WRITE_BATCH_ROWS', 8):
+            self.ss.to_bed(out)
+        with open(out) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[:3], ["chr1\t0\t5", "chr1\t1\t7\t1", "chr1\t2\t9\t2"])
+        self.assertEqual(lines[-1], "chr1\t49\t54\t49")
+
+        self.ss.to_bed(out + ".gz", compress=True)
+        with gzip.open(out + ".gz", "rt") as f:
+            self.assertEqual(f.read().splitlines(), lines)
+
+    # sequences fetched by several workers are written in order, optionally wrapped
+    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    def test_to_fasta(self, mock_get):
+        out = os.path.join(self.tmp.name, "out.fasta")
+        with mock.patch.object(SequenceSet, 'WRITE_BUFFER_CHARS', 16):
+            self.ss.to_fasta(out, workers=3)
+        with open(out) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[:4], ["> chr1:0-5", "AAAAA", "> 1", "AAAAAA"])
+        self.assertEqual(lines[-2:], ["> 49", "AAAAA"])
+        self.assertEqual(mock_get.call_count, 50)
+
+        self.ss.to_fasta(out + ".gz", line_width=4, compress=True)
+        with gzip.open(out + ".gz", "rt") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[:6], ["> chr1:0-5", "AAAA", "A", "> 1", "AAAA", "AA"])
+
+def fake_liftover(src_genome, target_genome, src_file, target_file, unmapped_file=None,
+                  path_to_chain=None):
+    """ Stands in for the liftOver tool: moves even rows by 1000 bases, drops odd rows """
+    with open(src_file) as src, open(target_file, "w") as target, open(unmapped_file, "w") as unmapped:
+        for line in src:
+            chrom, start, end, name = line.split()
+            if int(name) % 2 == 0:
+                target.write("%s\t%d\t%d\t%s\n" % (chrom, int(start) + 1000, int(end) + 1000, name))
+            else:
+                unmapped.write("#Deleted in new\n" + line)
+
+
+class TestSequenceSetLiftoverMapping(unittest.TestCase):
+
+    # lifted rows keep their source row, unmapped rows get the liftOver reason
+    @mock.patch.object(Genome, 'liftover', side_effect=fake_liftover)
+    def test_liftover_mapping(self, mock_liftover):
+        ss = SequenceSet.from_sequences([Sequence(10 * i, 10 * i + 5, TEST_GENOME, "chr1", "row %d" % i)
+                                         for i in range(5)], TEST_GENOME)
+        mapping = ss.liftover_mapping("hg38")
+        for suffix in ("source", "target", "unmapped"):
+            os.remove("../ucscpynome/liftover_files/bed_files/hg19Tohg38_mapping_" + suffix + ".bed")
+
+        self.assertEqual(mock_liftover.call_args[0][:2], (TEST_GENOME, "hg38"))
+        self.assertEqual(len(mapping), 5)
+        self.assertEqual(list(mapping.source_index), [0, 2, 4])
+        self.assertEqual(list(mapping.target_index), [0, -1, 1, -1, 2])
+        self.assertEqual(mapping.unmapped_reason, [None, "Deleted in new", None, "Deleted in new", None])
+        self.assertEqual(mapping.target.genome, "hg38")
+        self.assertEqual([(seq.start, seq.label) for seq in mapping.target.sequences],
+                         [(1000, "row 0"), (1020, "row 2"), (1040, "row 4")])
+        self.assertEqual([(source.start, lifted.start) for source, lifted in mapping.pairs(ss)],
+                         [(0, 1000), (20, 1020), (40, 1040)])
+
+class TestSequenceSetMask(unittest.TestCase):
+
+    # gap and repeat fractions come from the index, without fetching sequences
+    def test_mask_fractions(self):
+        index = MaskIndex({"chr1": (array('I', [0, 100, 500, 600]), array('I', [150, 250]))})
+        ss = SequenceSet.from_sequences([Sequence(0, 50, TEST_GENOME, "chr1", "gap"),
+                                         Sequence(90, 190, TEST_GENOME, "chr1", "mixed"),
+                                         Sequence(300, 400, TEST_GENOME, "chr1", "clean"),
+                                         Sequence(0, 10, TEST_GENOME, "chr2", "unindexed")],
+                                        TEST_GENOME)
+        gaps, repeats = ss.mask_fractions(index)
+        self.assertEqual(list(gaps), [1.0, 0.1, 0.0, 0.0])
+        self.assertEqual(list(repeats), [0.0, 0.4, 0.0, 0.0])
+
+        self.assertEqual(ss.filter_masked(index, max_gap_fraction=0.2, max_repeat_fraction=0.3), 2)
+        self.assertEqual([seq.label for seq in ss.sequences], ["clean", "unindexed"])
+
+class TestSequenceSetSort(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rows = [("chr2", 5, 10, "a"), ("chr1", 30, 40, "b"), ("chr10", 0, 5, "c"),
+                     ("chr1", 30, 35, "d"), ("chr2", 5, 10, "e"), ("chr1", 2, 3, "f")]
+        self.expected = [("chr1", 2, 3, "f"), ("chr1", 30, 35, "d"), ("chr1", 30, 40, "b"),
+                         ("chr10", 0, 5, "c"), ("chr2", 5, 10, "a"), ("chr2", 5, 10, "e")]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_bed(self, name, rows):
+        file_name = os.path.join(self.tmp.name, name)
+        with open(file_name, "w") as f:
+            f.write("track name=test\n")
+            for row in rows:
+                f.write("%s\t%d\t%d\t%s\n" % row)
+        return file_name
+
+    def read_bed(self, file_name):
+        with open(file_name) as f:
+            return [(L[0], int(L[1]), int(L[2]), L[3]) for L in (line.split() for line in f)]
+
+    # sorting is by chromosome name, start and end, keeping the order of equal rows
+    def test_sort(self):
+        ss = SequenceSet.from_sequences([Sequence(start, end, TEST_GENOME, chrom, label)
+                                         for chrom, start, end, label in self.rows], TEST_GENOME)
+        ss.sort()
+        self.assertEqual([(seq.chromosome, seq.start, seq.end, seq.label) for seq in ss.sequences],
+                         self.expected)
+        self.assertEqual(ss.dedupe(), 1)
+        self.assertEqual([seq.label for seq in ss.sequences], ["f", "d", "b", "c", "a"])
+
+    # files are sorted in runs merged from disk, with the same order as in memory
+    def test_sort_bed(self):
+        first = self.write_bed("first.bed", self.rows[:4])
+        second = self.write_bed("second.bed", self.rows[4:])
+        out = os.path.join(self.tmp.name, "sorted.bed")
+        for max_rows in (1, 2, 4, 100):
+            self.assertEqual(SequenceSet.sort_bed([first, second], out, max_rows=max_rows), 6)
+            self.assertEqual(self.read_bed(out), self.expected)
+        self.assertEqual(SequenceSet.sort_bed([first, second], out, dedupe=True, max_rows=2), 5)
+        self.assertEqual([row[3] for row in self.read_bed(out)], ["f", "d", "b", "c", "a"])
+        self.assertRaises(TypeError, SequenceSet.sort_bed, first, out)
+        self.assertRaises(MalformedBedFileError, SequenceSet.sort_bed,
+                          ["test_files/hg19_bad.bed"], out)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,46 @@
-from .retry import Requests
-from .genome import Genome, LiftoverError, InvalidGenomeError, InvalidChromosomeError, InvalidOrganismError
-from .sequence import Sequence
-from .sequence_set import SequenceSet, MalformedBedFileError
+"""
+    ucscpynome: a Python UCSC Genome Browser library
 
+    Submodules are imported lazily on first attribute access, so that scripts which
+    only need part of the package (e.g. BED parsing) do not pay for importing the
+    network stack.
+"""
+import importlib
+
+# public name -> submodule that defines it
+_LAZY_ATTRIBUTES = {
+    "Requests": "retry",
+    "Genome": "genome",
+    "LiftoverError": "genome",
+    "InvalidGenomeError": "genome",
+    "InvalidChromosomeError": "genome",
+    "InvalidOrganismError": "genome",
+    "InvalidTrackError": "genome",
+    "Sequence": "sequence",
+    "SequenceSet": "sequence_set",
+    "MalformedBedFileError": "sequence_set",
+    "LiftoverMapping": "sequence_set",
+    "MaskIndex": "mask",
+}
+
+# submodules, imported on first access as attributes of the package
+_SUBMODULES = ("archive", "arrow", "bedsort", "cli", "dna", "genome", "indexed", "mask",
+               "retry", "sequence", "sequence_set", "shared", "twobit")
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        # importing a submodule also binds it in the package namespace
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_SUBMODULES))
@@ -0,0 +1,220 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+
+class ArchiveError(ValueError):
+    """ ArchiveError is raised when a response archive cannot be read """
+    pass
+
+
+class ArchivedResponse():
+    """
+        A response replayed from a ResponseArchive. Mimics the parts of
+        requests.Response that ucscpynome uses.
+
+        Attributes:
+            url (string): url the response was recorded for
+            status_code (int): HTTP status code of the recorded response
+            content (bytes): body of the recorded response
+    """
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseArchive():
+    """
+        An append-only file of recorded HTTP responses, indexed by url.
+
+        The file starts with a magic line followed by one record per response:
+
+            key length (uint32) | body length (uint32) | status code (uint16) | url | body
+
+        Bodies are zlib compressed. Opening an archive only reads the record headers to
+        build the url -> record index, bodies are read from a memory map on demand.
+        If the same url is recorded twice the later record wins.
+
+        Raises:
+            ArchiveError: if the file is not a response archive, or is truncated and
+                          not opened for recording
+    """
+    MAGIC = b"UCSCPYNOME-ARCHIVE 1\n"
+    HEADER = struct.Struct("<IIH")
+    # largest compressed body a record can hold
+    MAX_BODY = 0xFFFFFFFF
+
+    def __init__(self, path, writable=False):
+        """
+            Opens (and when writable, creates) a response archive
+
+            Params:
+                path (string): path to the archive file
+                writable (bool): open the archive for recording
+        """
+        self.path = path
+        self.writable = writable
+        self.__lock = threading.Lock()
+        self.__index = {}
+        self.__map = None
+        self.__mapped_size = 0
+
+        if writable and (not os.path.exists(path) or os.path.getsize(path) == 0):
+            with open(path, "wb") as f:
+                f.write(self.MAGIC)
+        self.__file = open(path, "r+b" if writable else "rb")
+        self.__read_index()
+
+    def __read_index(self):
+        """ Scans the record headers and builds the url index """
+        f = self.__file
+        if f.read(len(self.MAGIC)) != self.MAGIC:
+            raise ArchiveError(self.path + " is not a ucscpynome response archive")
+        offset = len(self.MAGIC)
+        size = os.fstat(f.fileno()).st_size
+        while offset < size:
+            header = f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return self.__truncated(offset)
+            key_len, body_len, status = self.HEADER.unpack(header)
+            body_offset = offset + self.HEADER.size + key_len
+            if body_offset + body_len > size:
+                return self.__truncated(offset)
+            url = f.read(key_len).decode("utf-8")
+            self.__index[url] = (body_offset, body_len, status)
+            offset = body_offset + body_len
+            f.seek(offset)
+
+    def __truncated(self, offset):
+        """
+            Handles a last record cut short at offset, e.g. by a recording that was
+            killed mid-write: an archive opened for recording drops it and keeps
+            appending after the last complete record, a replayed one cannot be trusted
+        """
+        if not self.writable:
+            raise ArchiveError(self.path + " is truncated")
+        self.__file.truncate(offset)
+        self.__file.seek(offset)
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, url):
+        return url in self.__index
+
+    def urls(self):
+        """ Returns the urls recorded in the archive """
+        return list(self.__index)
+
+    def get(self, url):
+        """
+            Looks up the recorded response for a url
+
+            Params:
+                url (string): url of the request
+
+            Returns:
+                ArchivedResponse: the recorded response, or None if the url was not recorded
+        """
+        entry = self.__index.get(url)
+        if entry is None:
+            return None
+        offset, length, status = entry
+        with self.__lock:
+            if self.__map is None or offset + length > self.__mapped_size:
+                self.__remap()
+            body = self.__map[offset:offset + length]
+        return ArchivedResponse(url, status, zlib.decompress(body))
+
+    def __remap(self):
+        if self.__map is not None:
+            self.__map.close()
+        self.__file.flush()
+        self.__mapped_size = os.fstat(self.__file.fileno()).st_size
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def put(self, url, status_code, content):
+        """
+            Records a response
+
+            Params:
+                url (string): url of the request
+                status_code (int): HTTP status code of the response
+                content (bytes): body of the response
+        """
+        if not self.writable:
+            raise ArchiveError(self.path + " was not opened for recording")
+        key = url.encode("utf-8")
+        body = zlib.compress(content)
+        if len(body) > self.MAX_BODY:
+            raise ArchiveError("response for " + url + " is too large to record")
+        with self.__lock:
+            offset = self.__append_header(key, len(body), status_code)
+            self.__file.write(body)
+            self.__index[url] = (offset, len(body), status_code)
+
+    def put_file(self, url, status_code, path, chunk_size=1 << 20):
+        """
+            Records a response whose body is a file, compressing it chunk_size bytes at
+            a time instead of reading it whole
+
+            Params:
+                url (string): url of the request
+                status_code (int): HTTP status code of the response
+                path (string): file holding the body of the response
+
+            Raises:
+                ArchiveError: if the compressed body is over 4 GiB
+        """
+        import shutil
+        import tempfile
+        if not self.writable:
+            raise ArchiveError(self.path + " was not opened for recording")
+        key = url.encode("utf-8")
+        compressor = zlib.compressobj()
+        # compressed into a temporary file first, so that the archive is not locked
+        # while compressing
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path))) as body, \
+             open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                body.write(compressor.compress(chunk))
+            body.write(compressor.flush())
+            length = body.tell()
+            if length > self.MAX_BODY:
+                raise ArchiveError("response for " + url + " is too large to record")
+            body.seek(0)
+            with self.__lock:
+                offset = self.__append_header(key, length, status_code)
+                shutil.copyfileobj(body, self.__file, chunk_size)
+                self.__index[url] = (offset, length, status_code)
+
+    def __append_header(self, key, length, status_code):
+        """ Writes a record header at the end of the file, returns the body offset """
+        f = self.__file
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(self.HEADER.pack(len(key), length, status_code))
+        f.write(key)
+        return offset + self.HEADER.size + len(key)
+
+    def close(self):
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            self.__file.close()
@@ -0,0 +1,132 @@
+"""
+    Conversion between SequenceSet and Apache Arrow tables / Parquet files.
+
+    pyarrow is an optional dependency, it is only imported when these functions are
+    used. Client should use the SequenceSet methods (to_arrow, from_arrow, to_parquet,
+    from_parquet) rather than this module.
+
+    Tables have the columns:
+        chrom (dictionary<uint32, string>)
+        start (int64)
+        end (int64)
+        label (string, null for sequences without a label)
+        sequence (string, only with include_sequences, null for unfetched sequences)
+
+    and the genome in the schema metadata under "genome".
+"""
+from itertools import chain
+from .sequence import Sequence
+
+GENOME_KEY = b"genome"
+
+
+def import_pyarrow():
+    """ Imports pyarrow, with a helpful message if it is not installed """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow is required for Arrow and Parquet support, "
+                          "install it with: pip install pyarrow")
+    return pyarrow
+
+
+def _int64_values(column):
+    """
+        Yields the values of an integer column chunk by chunk. int64 chunks without
+        nulls are read straight from their data buffer, without conversion.
+    """
+    pa = import_pyarrow()
+    for chunk in column.chunks:
+        if chunk.null_count:
+            raise ValueError("coordinate columns must not contain nulls")
+        if chunk.type != pa.int64():
+            chunk = chunk.cast(pa.int64())
+        values = memoryview(chunk.buffers()[1]).cast('q')
+        yield values[chunk.offset:chunk.offset + len(chunk)]
+
+
+def _string_values(column):
+    """ Returns the values of a string or dictionary-encoded string column as a list """
+    pa = import_pyarrow()
+    values = []
+    for chunk in column.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            names = chunk.dictionary.to_pylist()
+            values.extend(names[i] if i is not None else None
+                          for i in chunk.indices.to_pylist())
+        else:
+            values.extend(chunk.to_pylist())
+    return values
+
+
+def to_arrow(sequence_set, include_sequences=False):
+    """
+        Converts a SequenceSet to a pyarrow.Table. The start and end columns wrap the
+        coordinate arrays of the set without copying them.
+
+        Params:
+            sequence_set (SequenceSet): set to convert
+            include_sequences (bool): add a sequence column with the fetched DNA
+
+        Returns:
+            pyarrow.Table: the set as a table
+    """
+    pa = import_pyarrow()
+    chrom_names, chrom_index, starts, ends, labels, _ = sequence_set._columns(False)
+    n = len(starts)
+
+    indices = pa.Array.from_buffers(pa.uint32(), n, [None, pa.py_buffer(chrom_index)])
+    columns = {
+        "chrom": pa.DictionaryArray.from_arrays(indices, pa.array(chrom_names, pa.string())),
+        "start": pa.Array.from_buffers(pa.int64(), n, [None, pa.py_buffer(starts)]),
+        "end": pa.Array.from_buffers(pa.int64(), n, [None, pa.py_buffer(ends)]),
+        "label": pa.array(labels if labels is not None else [None] * n, pa.string()),
+    }
+    if include_sequences:
+        columns["sequence"] = pa.array([seq._cached_string() for seq in sequence_set.sequences],
+                                       pa.large_string())
+    table = pa.table(columns)
+    return table.replace_schema_metadata({GENOME_KEY: sequence_set.genome.encode()})
+
+
+def from_arrow(sequence_set_class, table, genome=None):
+    """
+        Builds a SequenceSet from a pyarrow.Table with at least the chrom, start and
+        end columns (see the module documentation).
+
+        Params:
+            sequence_set_class (type): SequenceSet
+            table (pyarrow.Table): table to convert
+            genome (Genome): genome of the set, default the genome in the table metadata
+
+        Returns:
+            SequenceSet: the table as a set
+
+        Raises:
+            ValueError: if columns are missing or the genome is not known
+    """
+    if genome is None:
+        metadata = table.schema.metadata or {}
+        if GENOME_KEY not in metadata:
+            raise ValueError("the table has no genome metadata, pass the genome")
+        genome = metadata[GENOME_KEY].decode()
+    for name in ("chrom", "start", "end"):
+        if name not in table.column_names:
+            raise ValueError("the table has no " + name + " column")
+
+    genome_name = str(genome)
+    chroms = _string_values(table.column("chrom"))
+    n = table.num_rows
+    labels = _string_values(table.column("label")) if "label" in table.column_names else [None] * n
+    dna = _string_values(table.column("sequence")) if "sequence" in table.column_names else None
+
+    starts = chain.from_iterable(_int64_values(table.column("start")))
+    ends = chain.from_iterable(_int64_values(table.column("end")))
+
+    sequences = []
+    for i, start, end in zip(range(n), starts, ends):
+        seq = Sequence(start, end, genome_name, chroms[i], labels[i])
+        if dna is not None and dna[i] is not None:
+            seq._cache_string(dna[i])
+        sequences.append(seq)
+    return sequence_set_class.from_sequences(sequences, genome)
@@ -0,0 +1,94 @@
+"""
+    External merge sort of BED files, for files too big to load as a SequenceSet.
+
+    Lines are read in runs of at most max_rows lines; each run is sorted in memory and
+    written to a temporary file, then all runs are merged into the output. Only one
+    run and one line per run are held in memory at a time, and input that fits in a
+    single run never touches the disk.
+
+    Client should use SequenceSet.sort_bed rather than this module.
+"""
+import heapq
+import tempfile
+from contextlib import ExitStack
+from itertools import islice
+from .sequence_set import MalformedBedFileError, SequenceSet
+
+
+def _key(line):
+    """ Sort key (chromosome, start, end) of a BED line """
+    fields = line.split(None, 3)
+    return (fields[SequenceSet.CHROM_COL], int(fields[SequenceSet.START_COL]),
+            int(fields[SequenceSet.END_COL]))
+
+
+def _read_lines(bed_file_name):
+    """
+        Yields the lines of a BED file that hold intervals, checked the same way as
+        SequenceSet parses files, with the line ending stripped
+    """
+    num_columns = -1
+    with open(bed_file_name) as f:
+        for line in f:
+            L = line.split()
+            if len(L) == 0:
+                break
+            if L[0] in ("browser", "track", "#"):
+                continue
+            if num_columns == -1:
+                num_columns = len(L)
+                if num_columns < SequenceSet.MIN_NUM_COLS:
+                    raise MalformedBedFileError("Not enough columns")
+            elif len(L) != num_columns:
+                raise MalformedBedFileError("Number of columns is not the same across all lines in file: " + bed_file_name)
+            try:
+                int(L[SequenceSet.START_COL])
+                int(L[SequenceSet.END_COL])
+            except ValueError:
+                raise MalformedBedFileError("Coordinates are not integers in file: " + bed_file_name)
+            yield line.rstrip("\r\n")
+
+
+def _write_run(lines, tmp_dir):
+    """ Writes sorted lines to a temporary file and returns the file, rewound """
+    run = tempfile.TemporaryFile("w+", dir=tmp_dir)
+    run.writelines(line + "\n" for line in lines)
+    run.seek(0)
+    return run
+
+
+def sort_bed(bed_file_names, sorted_bed_file_name, dedupe=False, max_rows=1000000, tmp_dir=None):
+    """
+        Sorts the intervals of BED files by (chromosome, start, end) into one BED file.
+        See SequenceSet.sort_bed.
+
+        Returns:
+            int: number of lines written
+    """
+    lines = (line for name in bed_file_names for line in _read_lines(name))
+    written = 0
+    with ExitStack() as stack:
+        runs = []
+        while True:
+            chunk = sorted(islice(lines, max_rows), key=_key)
+            if len(chunk) < max_rows:
+                # the last run stays in memory
+                if chunk:
+                    runs.append(chunk)
+                break
+            run = stack.enter_context(_write_run(chunk, tmp_dir))
+            runs.append(line.rstrip("\n") for line in run)
+        merged = heapq.merge(*runs, key=_key)
+
+        previous = None
+        with open(sorted_bed_file_name, "w") as out:
+            for line in merged:
+                if dedupe:
+                    key = _key(line)
+                    if key == previous:
+                        continue
+                    previous = key
+                out.write(line)
+                out.write("\n")
+                written += 1
+    return written
@@ -0,0 +1,366 @@
+"""
+    Command line batch runner for ucscpynome.
+
+    Runs a manifest of download, liftover and extraction tasks on a pool of worker
+    threads, honouring dependencies between tasks:
+
+        python -m ucscpynome run manifest.json --workers 4
+
+    The manifest is a JSON file with a list of tasks. Every task has a unique "id", a
+    "type" and optionally "depends_on" (ids of tasks that must finish first):
+
+        {"tasks": [
+            {"id": "lift", "type": "liftover", "genome": "hg38", "bed": ["gene.bed"],
+             "target_genome": "panTro6", "output": "genes/panTro6_gene.bed"},
+            {"id": "fasta", "type": "extract", "genome": "panTro6",
+             "bed": ["genes/panTro6_gene.bed"], "output": "genes/panTro6_gene.fasta",
+             "depends_on": ["lift"]},
+            {"id": "download", "type": "download", "genome": "bosTau9",
+             "file_prefix": "mammals/"}
+        ]}
+
+    Task types and their fields:
+        download : genome, file_prefix, chromosome, include_pseudochromosomes
+                   (see Genome.download_sequence)
+        liftover : genome, bed (list of bed files), target_genome, output (bed file),
+                   path_to_chain (see Genome.liftover)
+        extract  : genome, bed (list of bed files), output (fasta file), line_width,
+                   compress (see SequenceSet.to_fasta)
+
+    Relative paths are relative to the directory of the manifest. Every completed
+    task is recorded in a checkpoint file (default: the manifest path + ".checkpoint"),
+    and tasks already recorded there are skipped when the manifest is run again, unless
+    their fields changed or a task they depend on ran again. Missing output directories
+    are created. A throughput summary is printed at the end.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+# fields of each task type holding a path, or a list of paths
+PATH_FIELDS = ("file_prefix", "bed", "output", "path_to_chain")
+
+# (source genome, target genome) -> lock held while running liftOver between them
+_liftover_locks = {}
+_liftover_locks_lock = threading.Lock()
+
+
+class ManifestError(ValueError):
+    """ ManifestError is raised when a manifest cannot be run """
+    pass
+
+
+def _make_parent_dirs(path):
+    """ Creates the directories a file will be written in """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def _run_download(task):
+    from . import Genome
+    from .genome import _is_pseudochromosome
+    genome = Genome(task["genome"])
+    if task.get("file_prefix"):
+        _make_parent_dirs(task["file_prefix"])
+    include_pseudochromosomes = task.get("include_pseudochromosomes", False)
+    genome.download_sequence(task.get("file_prefix"), task.get("chromosome"),
+                             include_pseudochromosomes)
+    if task.get("chromosome") is not None:
+        return 1
+    return len([chrom for chrom in genome.list_chromosomes()
+                if include_pseudochromosomes or not _is_pseudochromosome(chrom)])
+
+
+def _liftover_lock(src, target):
+    """ Lock held while running liftOver from genome src to genome target """
+    with _liftover_locks_lock:
+        return _liftover_locks.setdefault((src, target), threading.Lock())
+
+
+def _run_liftover(task):
+    # SequenceSet.liftover writes to bed files shared by all liftovers of the same
+    # genomes, so each task lifts its own temporary files instead
+    import tempfile
+    from . import Genome, SequenceSet
+    src_genome = Genome(task["genome"])
+    target_genome = Genome(task["target_genome"])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_file = os.path.join(tmp_dir, "source.bed")
+        target_file = os.path.join(tmp_dir, "target.bed")
+        SequenceSet(task["bed"], src_genome).to_bed(src_file)
+        # the liftOver log and downloaded chain file of a pair of genomes are shared
+        # by every liftover between them
+        with _liftover_lock(str(src_genome), str(target_genome)):
+            Genome.liftover(src_genome, target_genome, src_file, target_file,
+                            os.path.join(tmp_dir, "unmapped.bed"), task.get("path_to_chain"))
+        lifted = SequenceSet([target_file], target_genome)
+        _make_parent_dirs(task["output"])
+        lifted.to_bed(task["output"])
+    return len(lifted.sequences)
+
+
+def _run_extract(task):
+    from . import SequenceSet
+    sequence_set = SequenceSet(task["bed"], task["genome"])
+    _make_parent_dirs(task["output"])
+    sequence_set.to_fasta(task["output"], task.get("line_width"),
+                          compress=task.get("compress", False))
+    return len(sequence_set.sequences)
+
+
+# task type -> (function running a task and returning the number of items it
+# processed, unit of the items)
+TASK_TYPES = {
+    "download": (_run_download, "chromosomes"),
+    "liftover": (_run_liftover, "sequences"),
+    "extract": (_run_extract, "sequences"),
+}
+
+
+def _resolve_paths(task, base_dir):
+    """ Returns a copy of task with relative paths made relative to base_dir """
+    task = dict(task)
+    for field in PATH_FIELDS:
+        value = task.get(field)
+        if isinstance(value, str):
+            task[field] = os.path.join(base_dir, value)
+        elif isinstance(value, list):
+            task[field] = [os.path.join(base_dir, item) for item in value]
+    return task
+
+
+def _fingerprint(task):
+    """ Digest of the fields of a task, so that changed tasks are not skipped """
+    return hashlib.sha1(json.dumps(task, sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+        Reads and checks a manifest
+
+        Params:
+            manifest_path (string): path to the JSON manifest
+
+        Returns:
+            List[dict]: the tasks, in manifest order, with paths resolved
+
+        Raises:
+            ManifestError: if a task has no id, a duplicate id, an unknown type, a
+            dependency on an unknown task, or if dependencies form a cycle
+            OSError: if the manifest cannot be read
+    """
+    with open(manifest_path) as f:
+        try:
+            manifest = json.load(f)
+        except ValueError as e:
+            raise ManifestError("manifest " + manifest_path + " is not valid JSON: " + str(e))
+    tasks = manifest.get("tasks") if isinstance(manifest, dict) else manifest
+    if not isinstance(tasks, list):
+        raise ManifestError("manifest " + manifest_path + " has no list of tasks")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    ids = set()
+    for task in tasks:
+        if "id" not in task:
+            raise ManifestError("task without an id: " + json.dumps(task))
+        if task["id"] in ids:
+            raise ManifestError("duplicate task id " + task["id"])
+        if task.get("type") not in TASK_TYPES:
+            raise ManifestError("task " + task["id"] + " has unknown type " + str(task.get("type")))
+        ids.add(task["id"])
+    for task in tasks:
+        for dependency in task.get("depends_on", []):
+            if dependency not in ids:
+                raise ManifestError("task " + task["id"] + " depends on unknown task " + dependency)
+
+    # repeatedly take the tasks whose dependencies are all taken; whatever is left
+    # over is part of a cycle
+    ordered = set()
+    remaining = list(tasks)
+    while remaining:
+        ready = [task for task in remaining
+                 if all(dependency in ordered for dependency in task.get("depends_on", []))]
+        if not ready:
+            raise ManifestError("dependency cycle between tasks "
+                                + ", ".join(task["id"] for task in remaining))
+        ordered.update(task["id"] for task in ready)
+        remaining = [task for task in remaining if task["id"] not in ordered]
+    return [_resolve_paths(task, base_dir) for task in tasks]
+
+
+def _read_checkpoint(checkpoint_path):
+    """
+        Task id -> (fingerprint, line number of its last record) of the tasks recorded
+        in a checkpoint file
+    """
+    done = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            for number, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted run
+                    continue
+                done[entry["id"]] = (entry["fingerprint"], number)
+    return done
+
+
+def _is_checkpointed(task, done):
+    """
+        True if a task is recorded with its current fields, after every task it
+        depends on: a dependency that ran again since makes its outputs stale
+    """
+    recorded = done.get(task["id"])
+    if recorded is None or recorded[0] != _fingerprint(task):
+        return False
+    return all(dependency in done and done[dependency][1] < recorded[1]
+               for dependency in task.get("depends_on", []))
+
+
+def run_tasks(tasks, workers=4, checkpoint_path=None, log=print):
+    """
+        Runs tasks on a pool of worker threads, each as soon as its dependencies have
+        completed. Tasks depending on a failed task are not run, tasks depending on a
+        task that ran are run again even if they are checkpointed.
+
+        Params:
+            tasks (List[dict]): tasks, as returned by load_manifest
+            workers (int): number of worker threads
+            checkpoint_path (string): file recording completed tasks, tasks already
+            recorded in it are skipped
+            log (function): called with progress messages
+
+        Returns:
+            List[dict]: one result per task, in task order, with the keys "id",
+            "type", "status" ("done", "skipped", "failed" or "blocked"), "seconds",
+            "items" and "error"
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    done = _read_checkpoint(checkpoint_path) if checkpoint_path else {}
+    checkpoint_lock = threading.Lock()
+    results = {task["id"]: {"id": task["id"], "type": task["type"], "status": None,
+                            "seconds": 0.0, "items": 0, "error": None} for task in tasks}
+
+    def run(task):
+        function, _ = TASK_TYPES[task["type"]]
+        begin = time.perf_counter()
+        items = function(task)
+        seconds = time.perf_counter() - begin
+        if checkpoint_path:
+            entry = {"id": task["id"], "fingerprint": _fingerprint(task),
+                     "seconds": seconds, "items": items}
+            with checkpoint_lock, open(checkpoint_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return seconds, items
+
+    pending = list(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # marking a task skipped or blocked can make others ready, so look again
+            # until nothing changes
+            changed = True
+            while changed:
+                changed = False
+                for task in list(pending):
+                    dependencies = [results[d]["status"] for d in task.get("depends_on", [])]
+                    if any(status in ("failed", "blocked") for status in dependencies):
+                        results[task["id"]]["status"] = "blocked"
+                        log("blocked  " + task["id"])
+                    elif not all(status in ("done", "skipped") for status in dependencies):
+                        continue
+                    elif (all(status == "skipped" for status in dependencies)
+                          and _is_checkpointed(task, done)):
+                        results[task["id"]]["status"] = "skipped"
+                        log("skipped  " + task["id"] + " (checkpointed)")
+                    else:
+                        log("started  " + task["id"])
+                        running[executor.submit(run, task)] = task
+                    pending.remove(task)
+                    changed = True
+            if not running:
+                break
+
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                task = running.pop(future)
+                result = results[task["id"]]
+                try:
+                    result["seconds"], result["items"] = future.result()
+                    result["status"] = "done"
+                    log("done     %s (%.1f s)" % (task["id"], result["seconds"]))
+                except Exception as e:
+                    result["status"] = "failed"
+                    result["error"] = repr(e)
+                    log("failed   " + task["id"] + ": " + repr(e))
+    return [results[task["id"]] for task in tasks]
+
+
+def summarize(results, wall_seconds):
+    """
+        Formats a throughput summary of run results
+
+        Returns:
+            string: one line per task type and a total line
+    """
+    lines = ["%-10s %6s %7s %7s %7s %10s %10s" % ("type", "done", "skipped", "failed",
+                                                  "blocked", "items", "items/s")]
+    for task_type, (_, unit) in TASK_TYPES.items():
+        typed = [result for result in results if result["type"] == task_type]
+        if not typed:
+            continue
+        counts = [len([r for r in typed if r["status"] == status])
+                  for status in ("done", "skipped", "failed", "blocked")]
+        items = sum(r["items"] for r in typed if r["status"] == "done")
+        seconds = sum(r["seconds"] for r in typed if r["status"] == "done")
+        rate = "%.1f" % (items / seconds) if seconds > 0 else "-"
+        lines.append("%-10s %6d %7d %7d %7d %10s %10s" % (task_type, counts[0], counts[1], counts[2],
+                                                          counts[3], str(items) + " " + unit[:3], rate))
+    completed = len([r for r in results if r["status"] == "done"])
+    lines.append("%d of %d tasks run in %.1f s (%.2f tasks/s)"
+                 % (completed, len(results), wall_seconds,
+                    completed / wall_seconds if wall_seconds > 0 else 0.0))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+        Entry point of python -m ucscpynome
+
+        Returns:
+            int: exit status, 0 if every task completed or was skipped, 1 if a task
+            failed, 2 if the manifest cannot be run
+    """
+    parser = argparse.ArgumentParser(prog="python -m ucscpynome",
+                                     description="Batch runner for ucscpynome tasks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the tasks of a JSON manifest")
+    run_parser.add_argument("manifest", help="path to the JSON manifest")
+    run_parser.add_argument("--workers", type=int, default=4,
+                            help="number of tasks run at the same time (default 4)")
+    run_parser.add_argument("--checkpoint",
+                            help="checkpoint file (default: the manifest path + .checkpoint)")
+    run_parser.add_argument("--force", action="store_true",
+                            help="run every task, ignoring the checkpoint file")
+    args = parser.parse_args(argv)
+
+    try:
+        tasks = load_manifest(args.manifest)
+    except (ManifestError, OSError) as e:
+        print("error: " + str(e), file=sys.stderr)
+        return 2
+    checkpoint_path = args.checkpoint or args.manifest + ".checkpoint"
+    if args.force and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    begin = time.perf_counter()
+    results = run_tasks(tasks, args.workers, checkpoint_path)
+    print(summarize(results, time.perf_counter() - begin))
+    return 1 if any(result["status"] in ("failed", "blocked") for result in results) else 0
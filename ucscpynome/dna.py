@@ -0,0 +1,344 @@
+import mmap
+import os
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+# 2-bit codes in the order used by UCSC .2bit files
+BASES = b"TCAG"
+_ENCODE = bytes.maketrans(b"TCAGN", b"\x00\x01\x02\x03\x00")
+_DECODE = bytes.maketrans(b"\x00\x01\x02\x03", BASES)
+_NOT_ACGTN = b"TCAGN"
+
+
+def _runs(dna, pattern):
+    """ Flat array of [start, end) pairs of the runs of a regular expression in dna """
+    import re
+    runs = array('I')
+    for match in re.finditer(pattern, dna):
+        runs.append(match.start())
+        runs.append(match.end())
+    return runs
+
+
+def pack_bases(codes):
+    """
+        Packs bytes of 2-bit codes (values 0-3) four to a byte, first base in the
+        most significant bits
+
+        Params:
+            codes (bytes): one code per base
+
+        Returns:
+            bytes: packed codes, len(codes) / 4 rounded up bytes long
+    """
+    codes = codes + b"\x00" * (-len(codes) % 4)
+    # every byte of the four interleaved slices is at most 3, so shifting and or-ing
+    # them as big integers never carries into a neighbouring byte
+    packed = ((int.from_bytes(codes[0::4], "big") << 6) |
+              (int.from_bytes(codes[1::4], "big") << 4) |
+              (int.from_bytes(codes[2::4], "big") << 2) |
+              int.from_bytes(codes[3::4], "big"))
+    return packed.to_bytes(len(codes) // 4, "big")
+
+
+def unpack_bases(data, length, offset=0):
+    """
+        Unpacks 2-bit packed bases (see pack_bases) into upper case ASCII bases
+
+        Params:
+            data (bytes): packed bases
+            length (int): number of bases to unpack
+            offset (int): index of the first base to unpack
+
+        Returns:
+            bytearray: the bases, one ASCII character per base
+    """
+    first = offset // 4
+    last = (offset + length + 3) // 4
+    chunk = data[first:last]
+    nbytes = len(chunk)
+    packed = int.from_bytes(chunk, "big")
+    mask = int.from_bytes(b"\x03" * nbytes, "big")
+    codes = bytearray(nbytes * 4)
+    codes[0::4] = ((packed >> 6) & mask).to_bytes(nbytes, "big")
+    codes[1::4] = ((packed >> 4) & mask).to_bytes(nbytes, "big")
+    codes[2::4] = ((packed >> 2) & mask).to_bytes(nbytes, "big")
+    codes[3::4] = (packed & mask).to_bytes(nbytes, "big")
+    skip = offset - first * 4
+    return codes[skip:skip + length].translate(_DECODE)
+
+
+def _overlapping_runs(runs, start, end):
+    """
+        Range of the indexes (in pairs) of the runs overlapping [start, end), found by
+        bisection since runs are sorted and do not overlap
+    """
+    try:
+        # strided views of an array, without copying it
+        view = memoryview(runs)
+    except TypeError:
+        view = runs
+    first = bisect_right(view[1::2], start)
+    last = bisect_left(view[0::2], end)
+    return range(first, max(first, last))
+
+
+def apply_runs(bases, n_runs, lower_runs, offset=0):
+    """
+        Writes runs of N and lower case (soft-masked) bases into unpacked bases. Only
+        the runs overlapping the bases are visited, so windows of a chromosome with
+        many runs stay fast.
+
+        Params:
+            bases (bytearray): unpacked bases, modified in place
+            n_runs (sequence of int): flat [start, end) pairs of N runs, sorted
+            lower_runs (sequence of int): flat [start, end) pairs of lower case runs,
+            sorted
+            offset (int): coordinate of bases[0] in the coordinates of the runs
+    """
+    length = len(bases)
+    for i in _overlapping_runs(n_runs, offset, offset + length):
+        start = max(n_runs[2 * i] - offset, 0)
+        end = min(n_runs[2 * i + 1] - offset, length)
+        bases[start:end] = b"N" * (end - start)
+    for i in _overlapping_runs(lower_runs, offset, offset + length):
+        start = max(lower_runs[2 * i] - offset, 0)
+        end = min(lower_runs[2 * i + 1] - offset, length)
+        bases[start:end] = bases[start:end].lower()
+
+
+class PackedDNA():
+    """ A DNA sequence stored in about a quarter of the memory of a string.
+
+    Bases are packed 2 bits each (T, C, A, G as in UCSC .2bit files); runs of N and of
+    lower case (soft-masked) bases are kept as [start, end) pairs on the side. Sequences
+    with any other character (e.g. IUPAC ambiguity codes) are kept as ASCII bytes.
+
+    Use pack() to create one and decode() to get the string back.
+    """
+    __slots__ = ("length", "data", "n_runs", "lower_runs", "raw")
+
+    def __init__(self, length, data, n_runs=None, lower_runs=None, raw=False):
+        self.length = length
+        self.data = data
+        self.n_runs = n_runs if n_runs is not None else array('I')
+        self.lower_runs = lower_runs if lower_runs is not None else array('I')
+        self.raw = raw
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """ Approximate memory used by the packed sequence """
+        return (len(self.data) + self.n_runs.itemsize * (len(self.n_runs) + len(self.lower_runs))
+                + 120)
+
+    def decode(self):
+        """
+            Returns:
+                string: the DNA sequence
+        """
+        if self.raw:
+            return self.data.decode("ascii")
+        bases = unpack_bases(self.data, self.length)
+        apply_runs(bases, self.n_runs, self.lower_runs)
+        return bases.decode("ascii")
+
+    def __getstate__(self):
+        return (self.length, self.data, self.n_runs, self.lower_runs, self.raw)
+
+    def __setstate__(self, state):
+        self.length, self.data, self.n_runs, self.lower_runs, self.raw = state
+
+
+def pack(dna):
+    """
+        Packs a DNA sequence
+
+        Params:
+            dna (string): the DNA sequence
+
+        Returns:
+            PackedDNA: the packed sequence
+    """
+    encoded = dna.encode("ascii")
+    upper = encoded.upper()
+    if upper.translate(None, _NOT_ACGTN):
+        return PackedDNA(len(encoded), encoded, raw=True)
+    n_runs = _runs(upper, b"N+") if b"N" in upper else None
+    lower_runs = _runs(encoded, b"[a-z]+") if upper != encoded else None
+    return PackedDNA(len(encoded), pack_bases(upper.translate(_ENCODE)), n_runs, lower_runs)
+
+
+def join_packed(packed_list):
+    """
+        Lays out optional packed sequences as flat columns, without decoding them,
+        e.g. to pickle them or copy them to shared memory
+
+        Params:
+            packed_list (iterable of PackedDNA): packed sequences, None for missing ones
+
+        Returns:
+            tuple: number of bases of every sequence (array, -1 for missing ones),
+            raw flag of every sequence (array), number of N run and of lower case run
+            boundaries of every sequence (array, two per sequence), all the runs
+            (array) and all the packed bases (bytes), in order
+    """
+    lengths = array('q')
+    raw = array('B')
+    run_counts = array('q')
+    runs = array('I')
+    data = []
+    for packed in packed_list:
+        if packed is None:
+            lengths.append(-1)
+            raw.append(0)
+            run_counts.extend((0, 0))
+            continue
+        lengths.append(packed.length)
+        raw.append(packed.raw)
+        run_counts.extend((len(packed.n_runs), len(packed.lower_runs)))
+        runs.extend(packed.n_runs)
+        runs.extend(packed.lower_runs)
+        data.append(bytes(packed.data))
+    return lengths, raw, run_counts, runs, b"".join(data)
+
+
+def packed_nbytes(length, raw):
+    """ Number of bytes of packed bases of a sequence of length bases """
+    return length if raw else (length + 3) // 4
+
+
+def split_packed(lengths, raw, run_counts, runs, data):
+    """
+        Inverse of join_packed
+
+        Returns:
+            generator of PackedDNA: the packed sequences, None for missing ones
+    """
+    offset = 0
+    run_offset = 0
+    for i, length in enumerate(lengths):
+        if length < 0:
+            yield None
+            continue
+        nbytes = packed_nbytes(length, raw[i])
+        n_count = run_counts[2 * i]
+        lower_count = run_counts[2 * i + 1]
+        middle = run_offset + n_count
+        yield PackedDNA(length, bytes(data[offset:offset + nbytes]),
+                        array('I', runs[run_offset:middle]),
+                        array('I', runs[middle:middle + lower_count]), bool(raw[i]))
+        offset += nbytes
+        run_offset = middle + lower_count
+
+
+class DnaStore():
+    """ Keeps the packed DNA of many sequences within a memory budget.
+
+    Entries are kept in least recently used order. When the packed DNA held in memory
+    exceeds the budget, the least recently used entries are either dropped (and fetched
+    again when needed) or, with spill, moved to a temporary file that is read back
+    through a memory map.
+
+    Client should use SequenceSet.set_memory_budget instead of creating a DnaStore.
+    """
+
+    def __init__(self, max_bytes, spill=False, spill_dir=None):
+        """
+            Params:
+                max_bytes (int): budget for packed DNA held in memory
+                spill (bool): move entries over the budget to disk instead of dropping them
+                spill_dir (string): directory for the spill file, default temp directory
+        """
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self.spilled_bytes = 0
+        self.__entries = OrderedDict()
+        self.__spilled = {}
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__map = None
+
+    def __len__(self):
+        return len(self.__entries) + len(self.__spilled)
+
+    def put(self, key, packed):
+        """ Stores the packed DNA of key, evicting other entries if over budget """
+        with self.__lock:
+            self.__discard(key)
+            self.__entries[key] = packed
+            self.nbytes += packed.nbytes
+            while self.nbytes > self.max_bytes and len(self.__entries) > 1:
+                old_key, old = self.__entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+                if self.spill:
+                    self.__spill(old_key, old)
+
+    def get(self, key):
+        """ Returns the packed DNA of key, None if it is not stored """
+        with self.__lock:
+            packed = self.__entries.get(key)
+            if packed is not None:
+                self.__entries.move_to_end(key)
+                return packed
+            spilled = self.__spilled.get(key)
+            if spilled is None:
+                return None
+            offset, nbytes, length, n_runs, lower_runs, raw = spilled
+            if nbytes == 0:
+                # empty sequences take no space, and an empty file cannot be mapped
+                return PackedDNA(length, b"", n_runs, lower_runs, raw)
+            if self.__map is None or len(self.__map) < offset + nbytes:
+                self.__remap()
+            return PackedDNA(length, self.__map[offset:offset + nbytes], n_runs, lower_runs, raw)
+
+    def discard(self, key):
+        """ Forgets the packed DNA of key """
+        with self.__lock:
+            self.__discard(key)
+
+    def __discard(self, key):
+        packed = self.__entries.pop(key, None)
+        if packed is not None:
+            self.nbytes -= packed.nbytes
+        # space in the spill file is not reused, it is freed when the store is closed
+        self.__spilled.pop(key, None)
+
+    def __spill(self, key, packed):
+        if self.__file is None:
+            self.__file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.__file.seek(0, os.SEEK_END)
+        offset = self.__file.tell()
+        self.__file.write(packed.data)
+        self.spilled_bytes += len(packed.data)
+        # everything but the bases stays in memory
+        self.__spilled[key] = (offset, len(packed.data), packed.length,
+                               packed.n_runs, packed.lower_runs, packed.raw)
+
+    def __remap(self):
+        if self.__map is not None:
+            self.__map.close()
+        self.__file.flush()
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        """ Drops all entries and deletes the spill file """
+        with self.__lock:
+            self.__entries.clear()
+            self.__spilled.clear()
+            self.nbytes = 0
+            self.spilled_bytes = 0
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
@@ -1,11 +1,9 @@
-import sys
-import subprocess
+import os
 import os.path
 from os import path
-import gzip
-import requests
+import threading
 from . import Requests
-import re
+from . import retry
 
 
 class InvalidGenomeError(ValueError):
@@ -20,9 +18,25 @@ class InvalidOrganismError(ValueError):
     """ InvalidOrganismError is raised when the user inputs an invalid organism """
     pass
 
+class InvalidTrackError(ValueError):
+    """ InvalidTrackError is raised when a track cannot be fetched for the genome """
+    pass
+
 class LiftoverError(ValueError):
     pass
 
+# (start, end) fields of track items: BED-like tracks, genePred tracks (e.g.
+# knownGene), PSL tracks and others
+TRACK_COORDINATE_FIELDS = (("chromStart", "chromEnd"), ("txStart", "txEnd"),
+                           ("tStart", "tEnd"), ("start", "end"))
+
+
+def _is_pseudochromosome(chromosome):
+    """ True for unplaced, unlocalized and alternative sequences (ex: chrUn_XXX, chr1_XXX) """
+    import re
+    return re.match(r'chrUn_\w*|chr\d*_\w*', chromosome) is not None
+
+
 class Genome():
     """ 
         An instance of Genome represents a genome. Each unique genome only has one
@@ -35,15 +49,23 @@ class Genome():
         InvalidGenomeError
         InvalidChromosomeError
         InvalidOrganismError
+        InvalidTrackError
     """
     __genome_request = Requests()
     __genome_dict = {}
     __organism_dict = {}
+    # guards the two dicts above; held while /list/ucscGenomes is fetched so that
+    # concurrent first calls share a single request
+    __registry_lock = threading.RLock()
+    __populated = False
     
     def __new__(cls, genome):
         """
             Constructs one instance of the class for each unique genome.
 
+            Thread-safe: the list of genomes is fetched once per process, no matter how
+            many threads construct Genomes at the same time.
+
             Params:
             genome (string): the genome to create
 
@@ -52,39 +74,117 @@ class Genome():
         """
         # Populates all possible genomes in the genome dictionary the first time
         # the method is called, returns corresponding instance when requested.
-        if len(Genome.__genome_dict) > 0:
-            if genome in Genome.__genome_dict:
-                return Genome.__genome_dict[genome]
-            else:
-                raise InvalidGenomeError(genome + " is not a valid genome")
-        else: # call web api and populate the genome dict
+        if not Genome.__populated: # call web api and populate the genome dict
             Genome.__populate_dicts(cls)
-            if genome in Genome.__genome_dict:
-                return Genome.__genome_dict[genome]
-            else:
-                raise InvalidGenomeError(genome + " is not a valid genome")
+        if genome in Genome.__genome_dict:
+            return Genome.__genome_dict[genome]
+        else:
+            raise InvalidGenomeError(genome + " is not a valid genome")
+
+    def __new_instance(cls, genome):
+        """
+            Helper method to create the single instance of a genome.
+            Client should not call this method!
+        """
+        instance = super().__new__(cls)
+        instance.__chromosomes = []
+        instance.__chromosome_sizes = {}
+        instance.__chromosome_lock = threading.Lock()
+        instance.__genome = genome
+        return instance
 
     def __populate_dicts(cls):
         """
             Helper method to populate the genome and organism dictionaries. 
             Client should not call this method!
 
+            Only the first caller fetches, concurrent callers wait for its result.
+
             Calls endpoints:
                 - GET /list/ucscGenomes
         """
-        url = "http://api.genome.ucsc.edu/list/ucscGenomes"
-        response = requests.get(url)
-        info = response.json()
-        for g,data in info['ucscGenomes'].items():
-            instance = super().__new__(cls)
-            instance.__chromosomes = []
-            instance.__genome = g
-            Genome.__genome_dict[g] = instance
-            org = data["organism"].lower()
-            if org in Genome.__organism_dict:
-                Genome.__organism_dict[org].append(g)
-            else:
-                Genome.__organism_dict[org] = [g]
+        with Genome.__registry_lock:
+            if Genome.__populated:
+                return
+            url = retry.API_URL + "/list/ucscGenomes"
+            response = Genome.__genome_request.get(url)
+            info = response.json()
+            for g,data in info['ucscGenomes'].items():
+                if g not in Genome.__genome_dict:
+                    Genome.__genome_dict[g] = Genome.__new_instance(cls, g)
+                org = data["organism"].lower()
+                if org in Genome.__organism_dict:
+                    Genome.__organism_dict[org].append(g)
+                else:
+                    Genome.__organism_dict[org] = [g]
+            # drop genomes restored from pickles that turn out not to exist
+            for g in list(Genome.__genome_dict):
+                if g not in info['ucscGenomes']:
+                    del Genome.__genome_dict[g]
+            Genome.__populated = True
+
+    @staticmethod
+    def preload(genomes=(), chromosomes=True):
+        """
+            Static utility method to fetch the list of genomes, and optionally the
+            chromosome lists of some genomes, ahead of time.
+
+            Call this before creating a process pool with the fork start method: the
+            workers then inherit the populated registry and do not fetch it again.
+
+            Params:
+                genomes (List[string]): genomes whose chromosome lists should be fetched
+                chromosomes (bool): fetch the chromosome lists of genomes
+
+            Raises:
+                InvalidGenomeError: if one of the genomes is not a valid genome
+        """
+        Genome.__populate_dicts(Genome)
+        for g in genomes:
+            genome = Genome(str(g))
+            if chromosomes:
+                genome.list_chromosomes()
+
+    @staticmethod
+    def _reset_locks_after_fork():
+        """
+            Replaces all registry locks in a forked child process, where a lock held by
+            another thread of the parent at fork time would never be released.
+            Client should not call this method!
+        """
+        Genome.__registry_lock = threading.RLock()
+        for instance in Genome.__genome_dict.values():
+            instance.__chromosome_lock = threading.Lock()
+
+    @staticmethod
+    def _restore(genome):
+        """
+            Returns the instance of a genome when unpickling, without fetching the
+            genome list if it has not been fetched in this process yet.
+            Client should not call this method!
+
+            Raises:
+            InvalidGenomeError if the genome list is known and the genome is not in it
+        """
+        with Genome.__registry_lock:
+            if genome in Genome.__genome_dict:
+                return Genome.__genome_dict[genome]
+            if Genome.__populated:
+                raise InvalidGenomeError(genome + " is not a valid genome")
+            # the instance is kept when the genome list is fetched later
+            instance = Genome.__new_instance(Genome, genome)
+            Genome.__genome_dict[genome] = instance
+            return instance
+
+    def __reduce__(self):
+        # pickled by name, unpickling returns the one instance of the genome
+        return (Genome._restore, (self.__genome,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self):
         return self.__genome
@@ -108,7 +208,7 @@ class Genome():
             Raises: InvalidChromosomeError if the chromosome does not exist for the genome
         """
         print("Downloading sequence for chromosome " + chromosome + " in genome " + self.__genome)
-        url = "http://api.genome.ucsc.edu/getData/sequence?genome="
+        url = retry.API_URL + "/getData/sequence?genome="
         url += self.__genome + ";chrom="
         url += chromosome
         response = Genome.__genome_request.get(url)
@@ -123,7 +223,213 @@ class Genome():
         elif response.status_code == 400:
             raise InvalidChromosomeError("could not find chromosome " + chromosome + " in genome")
 
-    def download_sequence(self, file_prefix=None, chromosome=None, include_pseudochromosomes=False):
+    def __download_bulk_file(self, file_prefix, bulk, refresh=False):
+        """
+            Helper method to download the whole-assembly file of the genome from
+            hgdownload, unless it was downloaded before and refresh is False. The file
+            is kept next to the chromosome files, named file_prefix_{genome}.2bit or
+            file_prefix_{genome}_chromFa.tar.gz, and only replaced once a new copy has
+            been downloaded in full.
+            Client should not call this method!
+
+            Calls endpoints:
+                - GET {DOWNLOAD_URL}/goldenPath/{genome}/bigZips/{genome}.2bit
+                  or {DOWNLOAD_URL}/goldenPath/{genome}/bigZips/{genome}.chromFa.tar.gz,
+                  then .../bigZips/chromFa.tar.gz for older assemblies
+
+            Returns:
+                string: path of the downloaded file
+
+            Raises: FileNotFoundError if hgdownload has no such file for the genome
+        """
+        urls, local_path = self.__bulk_file_paths(file_prefix, bulk)
+        if refresh or not path.exists(local_path):
+            for url in urls:
+                print("Downloading " + url.rsplit("/", 1)[1] + " for genome " + self.__genome)
+                if Genome.__genome_request.download(url, local_path) == 200:
+                    break
+            else:
+                raise FileNotFoundError("File " + " or ".join(urls) + " does not exist for genome "
+                                        + self.__genome)
+        return local_path
+
+    def __bulk_file_paths(self, file_prefix, bulk):
+        """
+            Helper method giving the hgdownload urls the whole-assembly file of the
+            genome may have, most likely first, and its local path.
+            Client should not call this method!
+        """
+        if bulk == "2bit":
+            names = [self.__genome + ".2bit"]
+            local_path = file_prefix + "_" + self.__genome + ".2bit"
+        else:
+            # newer assemblies (e.g. hg38) name the archive after the genome
+            names = [self.__genome + ".chromFa.tar.gz", "chromFa.tar.gz"]
+            local_path = file_prefix + "_" + self.__genome + "_chromFa.tar.gz"
+        base_url = retry.DOWNLOAD_URL + "/goldenPath/" + self.__genome + "/bigZips/"
+        return [base_url + name for name in names], local_path
+
+    def __is_current(self, urls, local_path):
+        """
+            Helper method to check a downloaded file against the size and
+            Last-Modified date of its remote copy, the first of urls that exists.
+            Client should not call this method!
+
+            Calls endpoints:
+                - HEAD {url}, for each of urls until one exists
+
+            Returns:
+                bool: False if the local file is missing, has another size than the
+                remote file or is older than it, or if the remote metadata cannot be
+                requested; True otherwise, also when there is no remote copy or when
+                replaying recorded responses
+        """
+        if not path.exists(local_path):
+            return False
+        for url in urls:
+            try:
+                response = Genome.__genome_request.head(url)
+            except retry.NetworkError:
+                return False
+            if response is None or response.status_code == 200:
+                break
+        if response is None or response.status_code != 200:
+            return True
+        headers = response.headers
+        size = headers.get("Content-Length")
+        if size is not None and int(size) != os.path.getsize(local_path):
+            return False
+        modified = headers.get("Last-Modified")
+        if modified is not None:
+            from email.utils import parsedate_to_datetime
+            if parsedate_to_datetime(modified).timestamp() > os.path.getmtime(local_path):
+                return False
+        return True
+
+    def __bulk_chromosomes(self, bulk, local_path):
+        """
+            Helper method listing the chromosomes held by a downloaded whole-assembly
+            file, from the index of a .2bit file or the member names (chrN.fa) of a
+            chromFa archive. Client should not call this method!
+
+            Returns:
+                set: names of the chromosomes, None if the file was not downloaded
+        """
+        if not path.exists(local_path):
+            return None
+        if bulk == "2bit":
+            from .twobit import TwoBitFile
+            with TwoBitFile(local_path) as twobit:
+                return set(twobit.names())
+        import tarfile
+        with tarfile.open(local_path, "r|gz") as tar:
+            return {path.basename(member.name)[:-len(".fa")] for member in tar
+                    if member.isfile() and member.name.endswith(".fa")}
+
+    def __split_2bit(self, twobit_path, file_prefix, chromosomes):
+        """
+            Helper method to write the chromosomes of a .2bit file to
+            file_prefix_{genome}_{chromosome} files. Client should not call this method!
+        """
+        from .twobit import TwoBitFile
+        with TwoBitFile(twobit_path) as twobit:
+            for chrom in twobit.names():
+                if not chromosomes(chrom):
+                    continue
+                with open(file_prefix + "_" + self.__genome + "_" + chrom, "w", encoding='utf-8') as f:
+                    twobit.write_sequence(chrom, f)
+                print("Download complete for chromosome " + chrom + " in genome " + self.__genome)
+
+    def __split_chrom_fa(self, tar_path, file_prefix, chromosomes):
+        """
+            Helper method to write the sequences of the FASTA files in a chromFa archive
+            to file_prefix_{genome}_{chromosome} files. Client should not call this method!
+        """
+        import tarfile
+        with tarfile.open(tar_path, "r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                out = None
+                for line in tar.extractfile(member):
+                    line = line.decode('utf-8')
+                    if line.startswith(">"):
+                        if out is not None:
+                            out.close()
+                        chrom = line[1:].split()[0]
+                        out = None
+                        if chromosomes(chrom):
+                            out = open(file_prefix + "_" + self.__genome + "_" + chrom, "w", encoding='utf-8')
+                            print("Download complete for chromosome " + chrom + " in genome " + self.__genome)
+                    elif out is not None:
+                        out.write(line.rstrip("\r\n"))
+                if out is not None:
+                    out.close()
+
+    def mask_index(self, file_prefix, source="2bit"):
+        """
+            Gets the index of assembly gaps (runs of N) and soft-masked repeats (runs of
+            lower case bases) of the genome, used by SequenceSet.mask_fractions and
+            SequenceSet.filter_masked to judge intervals without fetching them.
+
+            The index is built once and cached on disk as file_prefix_{genome}_{source}
+            .mask, one cache per source since their chromosomes may differ; it is
+            rebuilt when the cache is older than its source.
+
+            Params:
+                file_prefix (string): identifier of the downloaded files, as in
+                download_sequence
+                source (string): "2bit" to build the index from the {genome}.2bit file
+                (downloaded with download_sequence(bulk="2bit") if missing), or "files"
+                to build it from the chromosome files file_prefix_{genome}_{chromosome}
+                already downloaded by download_sequence
+
+            Calls endpoints:
+                - GET {DOWNLOAD_URL}/goldenPath/{genome}/bigZips/{genome}.2bit
+                  (source "2bit", if the file was not downloaded before)
+                - GET /list/chromosomes?genome={genome} (source "files")
+
+            Returns:
+                MaskIndex: the index
+
+            Raises:
+                FileNotFoundError: if there is no source to build the index from
+                ValueError: if source is not "2bit" or "files"
+        """
+        from .mask import MaskIndex, sequence_file_runs
+        cache_path = file_prefix + "_" + self.__genome + "_" + str(source) + ".mask"
+        if source == "2bit":
+            sources = [self.__download_bulk_file(file_prefix, "2bit")]
+        elif source == "files":
+            sources = [file_prefix + "_" + self.__genome + "_" + chrom
+                       for chrom in self.list_chromosomes()]
+            sources = [source_path for source_path in sources if path.exists(source_path)]
+            if not sources:
+                raise FileNotFoundError("no chromosome files " + file_prefix + "_" + self.__genome
+                                        + "_* to build a mask index from")
+        else:
+            raise ValueError("source should be \"2bit\" or \"files\", not " + str(source))
+
+        newest = max(os.path.getmtime(source_path) for source_path in sources)
+        if path.exists(cache_path) and os.path.getmtime(cache_path) >= newest:
+            return MaskIndex.load(cache_path)
+
+        runs = {}
+        if source == "2bit":
+            from .twobit import TwoBitFile
+            with TwoBitFile(sources[0]) as twobit:
+                for chrom in twobit.names():
+                    runs[chrom] = twobit.runs(chrom)
+        else:
+            prefix_length = len(file_prefix + "_" + self.__genome + "_")
+            for source_path in sources:
+                runs[source_path[prefix_length:]] = sequence_file_runs(source_path)
+        index = MaskIndex(runs)
+        index.save(cache_path)
+        return index
+
+    def download_sequence(self, file_prefix=None, chromosome=None, include_pseudochromosomes=False,
+                          bulk=None):
         """
             Downloads a DNA sequence of a given chromosome for a genome
             If no chromosome is given, download all chromosomes of that genome
@@ -143,25 +449,151 @@ class Genome():
                 want to download pseudochromosome sequence data as well (ex: chrUn_XXX),
                 only relevant for downloading an entire genome and will be ignored if a
                 chromosome is specified in the input
+                bulk (string): optional parameter to download the whole assembly from
+                hgdownload in one transfer and split it locally instead of one API
+                request per chromosome: "2bit" for the {genome}.2bit file (smallest) or
+                "chromFa" for the chromFa.tar.gz archive (named {genome}.chromFa.tar.gz
+                for newer assemblies). The downloaded file is kept as
+                file_prefix_{genome}.2bit or file_prefix_{genome}_chromFa.tar.gz and
+                reused by later calls. The output files are the same as without bulk.
             
             Returns:
                 file(s): file object(s) containing the DNA sequence of the chromosome(s)
 
             Raises: InvalidChromosomeError if the input chromosome does not exist for the 
                     genome
+                    FileNotFoundError if the bulk file does not exist for the genome
+                    ValueError if bulk is not "2bit" or "chromFa"
         """
-        if chromosome == None:
+        if bulk is not None:
+            if bulk not in ("2bit", "chromFa"):
+                raise ValueError("bulk should be \"2bit\" or \"chromFa\", not " + str(bulk))
+            found = set()
+            def wanted(chrom):
+                if chromosome is not None:
+                    keep = chrom == chromosome
+                else:
+                    keep = include_pseudochromosomes or not _is_pseudochromosome(chrom)
+                if keep:
+                    found.add(chrom)
+                return keep
+            bulk_path = self.__download_bulk_file(file_prefix, bulk)
+            if bulk == "2bit":
+                self.__split_2bit(bulk_path, file_prefix, wanted)
+            else:
+                self.__split_chrom_fa(bulk_path, file_prefix, wanted)
+            if chromosome is not None and chromosome not in found:
+                raise InvalidChromosomeError("could not find chromosome " + chromosome + " in genome")
+        elif chromosome == None:
             chromosomes = self.list_chromosomes()
             for chrom in chromosomes: 
-                if not(include_pseudochromosomes):
-                    pseudos_u = re.compile('chrUn_\w*')
-                    pseudos_n = re.compile('chr\d*_\w*')
-                    if pseudos_u.match(chrom) or pseudos_n.match(chrom):
-                        continue
+                if not(include_pseudochromosomes) and _is_pseudochromosome(chrom):
+                    continue
                 self.__download_chrom_sequence(file_prefix, chrom)
         else:
             self.__download_chrom_sequence(file_prefix, chromosome)
     
+    def sync_sequence(self, file_prefix, include_pseudochromosomes=False, bulk=None):
+        """
+            Brings the chromosome files downloaded by download_sequence up to date,
+            downloading only what is missing or out of date. A refresh of files that are
+            already current makes no sequence request.
+
+            Chromosome files are compared with the chromosome sizes of the genome; files
+            that are missing or do not have the size of their chromosome (truncated or
+            from another version of the assembly) are downloaded again. With bulk, the
+            whole-assembly file is also compared with the size and Last-Modified date
+            of the file on hgdownload, and downloaded again if it changed or its metadata
+            cannot be requested, in which case all chromosome files are rewritten from
+            it. Chromosomes the whole-assembly file does not hold are not synced.
+
+            Params:
+                file_prefix (string): identifier for the file(s) where the sequence data
+                is stored, as in download_sequence
+                include_pseudochromosomes (boolean): also sync pseudochromosomes
+                (ex: chrUn_XXX)
+                bulk (string): None to download chromosomes through the API, "2bit" or
+                "chromFa" to use the whole-assembly file as in download_sequence
+
+            Calls endpoints:
+                - GET /list/chromosomes?genome={genome}
+                - HEAD {DOWNLOAD_URL}/goldenPath/{genome}/bigZips/... (with bulk)
+                - the endpoints of download_sequence, for out of date chromosomes
+
+            Returns:
+                List[string]: chromosomes that were downloaded
+
+            Raises:
+                FileNotFoundError: if the bulk file does not exist for the genome
+                ValueError: if bulk is not None, "2bit" or "chromFa"
+        """
+        if bulk not in (None, "2bit", "chromFa"):
+            raise ValueError("bulk should be None, \"2bit\" or \"chromFa\", not " + str(bulk))
+        sizes = self.chromosome_sizes()
+
+        def is_current(chrom):
+            chrom_path = file_prefix + "_" + self.__genome + "_" + chrom
+            if not path.exists(chrom_path):
+                return False
+            return chrom not in sizes or os.path.getsize(chrom_path) == sizes[chrom]
+
+        refreshed = False
+        chromosomes = sizes
+        if bulk is not None:
+            urls, local_path = self.__bulk_file_paths(file_prefix, bulk)
+            # the stale file is kept until the new one has been downloaded
+            refreshed = path.exists(local_path) and not self.__is_current(urls, local_path)
+            # chromosomes missing from the assembly file can never be synced from it
+            if not refreshed:
+                chromosomes = self.__bulk_chromosomes(bulk, local_path) or sizes
+
+        def needed(chrom):
+            return ((include_pseudochromosomes or not _is_pseudochromosome(chrom))
+                    and (refreshed or not is_current(chrom)))
+
+        fetched = []
+        def wanted(chrom):
+            keep = needed(chrom)
+            if keep:
+                fetched.append(chrom)
+            return keep
+
+        if bulk is None:
+            for chrom in self.list_chromosomes():
+                if wanted(chrom):
+                    self.__download_chrom_sequence(file_prefix, chrom)
+        elif refreshed or any(needed(chrom) for chrom in chromosomes):
+            bulk_path = self.__download_bulk_file(file_prefix, bulk, refreshed)
+            if bulk == "2bit":
+                self.__split_2bit(bulk_path, file_prefix, wanted)
+            else:
+                self.__split_chrom_fa(bulk_path, file_prefix, wanted)
+        print("Sync complete for genome " + self.__genome + ": " + str(len(fetched))
+              + " chromosome(s) downloaded")
+        return fetched
+
+    def __load_chromosomes(self):
+        """
+            Helper method to fetch the chromosomes and their sizes for the genome.
+            Client should not call this method!
+
+            Calls endpoints:
+                -GET /list/chromosomes?genome={genome}
+        """
+        # lazily populates chromosomes for the genome, only fetches once
+        if len(self.__chromosomes) == 0:
+            with self.__chromosome_lock:
+                if len(self.__chromosomes) == 0:
+                    url = retry.API_URL + "/list/chromosomes?genome="
+                    url += self.__genome
+                    response = Genome.__genome_request.get(url)
+                    info = response.json()
+                    chromosome_sizes = {}
+                    for chromosome, size in info["chromosomes"].items():
+                        chromosome_sizes[chromosome] = int(size)
+                    self.__chromosome_sizes = chromosome_sizes
+                    self.__chromosomes = list(chromosome_sizes)
+
     def list_chromosomes(self):
         """
             Lists all chromosomes for a genome
@@ -172,18 +604,247 @@ class Genome():
             Returns:
                 string: list of chromosomes for a genome
         """
-        # lazily populates chromosomes for the genome, only fetches once
-        if len(self.__chromosomes) == 0:
-            url = "http://api.genome.ucsc.edu/list/chromosomes?genome="
-            url += self.__genome
-            response = requests.get(url)
-            info = response.json()
-            chromosome_list = []
-            for chromosome in info["chromosomes"]:
-                chromosome_list.append(chromosome)
-            self.__chromosomes = chromosome_list
+        self.__load_chromosomes()
         return self.__chromosomes
+
+    def chromosome_sizes(self):
+        """
+            Gets the size of every chromosome of the genome. The result is shared,
+            do not modify it.
+
+            Calls endpoints:
+                -GET /list/chromosomes?genome={genome} (once per genome)
+
+            Returns:
+                dict: chromosome name -> size in bases
+        """
+        self.__load_chromosomes()
+        return self.__chromosome_sizes
+
+    def chromosome_size(self, chromosome):
+        """
+            Gets the size of a chromosome of the genome
+
+            Params:
+                chromosome (string): chromosome to get the size of
+
+            Returns:
+                int: size of the chromosome in bases
+
+            Raises: InvalidChromosomeError if the chromosome does not exist for the genome
+        """
+        sizes = self.chromosome_sizes()
+        if chromosome not in sizes:
+            raise InvalidChromosomeError("could not find chromosome " + chromosome + " in genome " + self.__genome)
+        return sizes[chromosome]
+
+    def __fetch_track_window(self, track, chromosome, start, end, max_items, label_field):
+        """
+            Helper method to fetch the items of a track that start in a window of a
+            chromosome. Windows with more than max_items items are split in half until
+            every part fits.
+            Client should not call this method!
+
+            Calls endpoints:
+                - GET /getData/track?genome={genome};track={track};chrom={chromosome};
+                  start={start};end={end};maxItemsOutput={max_items}
+
+            Returns:
+                List[tuple]: (start, end, label) of the items starting in the window
+        """
+        url = retry.API_URL + "/getData/track?genome=" + self.__genome
+        url += ";track=" + track + ";chrom=" + chromosome
+        url += ";start=" + str(start) + ";end=" + str(end)
+        url += ";maxItemsOutput=" + str(max_items)
+        response = Genome.__genome_request.get(url)
+        info = response.json()
+        if response.status_code not in [200, 201, 202, 204]:
+            raise InvalidTrackError("could not fetch track " + track + " for " + chromosome
+                                    + " in genome " + self.__genome + ": " + str(info.get("error")))
+
+        if info.get("maxItemsLimit") and end - start > 1:
+            middle = (start + end) // 2
+            return (self.__fetch_track_window(track, chromosome, start, middle, max_items, label_field)
+                    + self.__fetch_track_window(track, chromosome, middle, end, max_items, label_field))
+
+        items = info.get(track, [])
+        # tracks of split tables are keyed by chromosome
+        if isinstance(items, dict):
+            items = items.get(chromosome, [])
+        rows = []
+        for item in items:
+            for start_field, end_field in TRACK_COORDINATE_FIELDS:
+                if start_field in item and end_field in item:
+                    break
+            else:
+                raise InvalidTrackError("items of track " + track + " in genome " + self.__genome
+                                        + " have no coordinate fields: " + ", ".join(item))
+            item_start = int(item[start_field])
+            # items overlapping the window boundary are returned for both windows, keep
+            # each in the window it starts in
+            if item_start < start or item_start >= end:
+                continue
+            item_end = int(item[end_field])
+            label = item.get(label_field)
+            rows.append((item_start, item_end, str(label) if label is not None else None))
+        return rows
+
+    def fetch_track(self, track, chromosomes=None, window_size=10000000, max_items=100000,
+                    workers=4, include_pseudochromosomes=False, label_field="name"):
+        """
+            Fetches the items of an annotation track (e.g. knownGene) as a SequenceSet.
+
+            Chromosomes are split into windows of window_size bases that are fetched by
+            several threads at the same time. Windows that hold more than max_items
+            items are split further, so no response is truncated. Items are added to the
+            set as windows complete, in chromosome and position order, and only a few
+            windows are held in memory at any time.
+
+            Params:
+                track (string): name of the track
+                chromosomes (List[string]): chromosomes to fetch, default all chromosomes
+                window_size (int): size of the windows fetched in one request
+                max_items (int): maximum number of items returned by one request
+                workers (int): number of fetch threads
+                include_pseudochromosomes (boolean): also fetch pseudochromosomes
+                (ex: chrUn_XXX) when chromosomes is not given
+                label_field (string): field of the items used as sequence label
+
+            Calls endpoints:
+                - GET /list/chromosomes?genome={genome}
+                - GET /getData/track?genome={genome};track={track};chrom={chromosome};
+                  start={start};end={end};maxItemsOutput={max_items}
+
+            Returns:
+                SequenceSet: one sequence per track item
+
+            Raises:
+                InvalidChromosomeError: if one of the chromosomes does not exist for the
+                genome
+                InvalidTrackError: if the track cannot be fetched
+        """
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        from .sequence import Sequence
+        from .sequence_set import SequenceSet
+
+        if chromosomes is None:
+            chromosomes = [chrom for chrom in self.list_chromosomes()
+                           if include_pseudochromosomes or not _is_pseudochromosome(chrom)]
+        windows = ((chrom, start, min(start + window_size, self.chromosome_size(chrom)))
+                   for chrom in chromosomes
+                   for start in range(0, self.chromosome_size(chrom), window_size))
+
+        sequences = []
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+        try:
+            for chrom, start, end in windows:
+                pending.append((chrom, executor.submit(self.__fetch_track_window, track, chrom,
+                                                       start, end, max_items, label_field)))
+                if len(pending) >= 2 * workers:
+                    chrom, future = pending.popleft()
+                    sequences.extend(Sequence(item_start, item_end, self.__genome, chrom, label)
+                                     for item_start, item_end, label in future.result())
+            while pending:
+                chrom, future = pending.popleft()
+                sequences.extend(Sequence(item_start, item_end, self.__genome, chrom, label)
+                                 for item_start, item_end, label in future.result())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return SequenceSet.from_sequences(sequences, self)
        
+    def __gaps(self, chromosome):
+        """
+            Helper method to get the assembly gaps (runs of N) of a chromosome as sorted
+            (start, end) pairs. Client should not call this method!
+
+            Calls endpoints:
+                - GET /getData/track?genome={genome};track=gap;chrom={chromosome};...
+        """
+        gaps = self.fetch_track("gap", chromosomes=[chromosome], workers=1)
+        return sorted((seq.start, seq.end) for seq in gaps.sequences)
+
+    def windows(self, size, step=None, chromosomes=None, include_pseudochromosomes=False,
+                skip_gaps=False, batch_size=None):
+        """
+            Tiles the genome into windows of size bases, every step bases along each
+            chromosome. Windows are generated lazily from the chromosome sizes, so a
+            whole genome can be processed without building a BED file. The last window
+            of a chromosome ends at the end of the chromosome and may be shorter.
+
+            Example:
+                for windows in Genome("hg38").windows(100000, batch_size=1000):
+                    for seq, dna in windows.prefetch():
+                        analyse(seq, dna)
+
+            Params:
+                size (int): size of the windows in bases
+                step (int): distance between the starts of consecutive windows, default
+                size (adjacent windows); smaller than size for sliding windows
+                chromosomes (List[string]): chromosomes to tile, default all chromosomes
+                include_pseudochromosomes (boolean): also tile pseudochromosomes
+                (ex: chrUn_XXX) when chromosomes is not given, as in download_sequence
+                skip_gaps (boolean): skip windows that overlap an assembly gap (a run of
+                N in the gap track of the genome)
+                batch_size (int): yield SequenceSets of up to batch_size windows rather
+                than single sequences
+
+            Calls endpoints:
+                - GET /list/chromosomes?genome={genome}
+                - GET /getData/track?genome={genome};track=gap;... (with skip_gaps)
+
+            Yields:
+                Sequence: each window, by chromosome and start (SequenceSet with
+                batch_size)
+
+            Raises:
+                ValueError: if size or step is not positive
+                InvalidChromosomeError: if one of the chromosomes does not exist for the
+                genome
+                InvalidTrackError: with skip_gaps, if the genome has no gap track
+        """
+        if step is None:
+            step = size
+        if size <= 0 or step <= 0:
+            raise ValueError("window size and step must be positive")
+        if batch_size is not None:
+            return self.__window_batches(size, step, chromosomes, include_pseudochromosomes,
+                                         skip_gaps, batch_size)
+        return self.__windows(size, step, chromosomes, include_pseudochromosomes, skip_gaps)
+
+    def __windows(self, size, step, chromosomes, include_pseudochromosomes, skip_gaps):
+        """ Generator of the windows of windows(). Client should not call this method! """
+        from .sequence import Sequence
+        if chromosomes is None:
+            chromosomes = [chrom for chrom in self.list_chromosomes()
+                           if include_pseudochromosomes or not _is_pseudochromosome(chrom)]
+        for chrom in chromosomes:
+            chrom_size = self.chromosome_size(chrom)
+            gaps = self.__gaps(chrom) if skip_gaps else []
+            gap = 0
+            for start in range(0, chrom_size, step):
+                end = min(start + size, chrom_size)
+                # windows move forward, so do gaps that end before them
+                while gap < len(gaps) and gaps[gap][1] <= start:
+                    gap += 1
+                if gap == len(gaps) or gaps[gap][0] >= end:
+                    yield Sequence(start, end, self.__genome, chrom)
+                if end == chrom_size:
+                    break
+
+    def __window_batches(self, size, step, chromosomes, include_pseudochromosomes, skip_gaps,
+                         batch_size):
+        """ Generator of the batches of windows(). Client should not call this method! """
+        from itertools import islice
+        from .sequence_set import SequenceSet
+        windows = self.__windows(size, step, chromosomes, include_pseudochromosomes, skip_gaps)
+        while True:
+            batch = list(islice(windows, batch_size))
+            if not batch:
+                return
+            yield SequenceSet.from_sequences(batch, self)
+
     @staticmethod
     def list_genomes(organism=None):
         """
@@ -204,7 +865,7 @@ class Genome():
 
         """
         # genome_dict and organism_dict is not yet populated
-        if len(Genome.__genome_dict) == 0:
+        if not Genome.__populated:
             Genome.__populate_dicts(Genome)
 
         if organism == None:
@@ -268,6 +929,7 @@ class Genome():
         BED_FILES_PATH = "liftover_files/bed_files/"
 
         script_dir = os.path.dirname(__file__)
+        import gzip
         
         def check_liftover_success(liftover_log):
             liftover_file = open(liftover_log, 'r')
@@ -286,7 +948,7 @@ class Genome():
             path_to_gz = path_to_chain + '.gz'
 
             if redownload or (not path.exists(path_to_chain) and not path.exists(path_to_gz)):
-                r = requests.get(url, allow_redirects=True)
+                r = Genome.__genome_request.get(url)
                 if r.status_code != 200:
                     raise FileNotFoundError("Chain file " + chain_name + " does not exist. There may not be a valid mapping between these genomes")
 
@@ -318,7 +980,7 @@ class Genome():
             chainprovided = False
             capitalized_target = target[0].capitalize() + target[1:]
             chain_name = src + 'To' + capitalized_target + '.over.chain'
-            url = 'https://hgdownload.cse.ucsc.edu/goldenpath/' + src + '/liftOver/' + chain_name + '.gz'
+            url = retry.DOWNLOAD_URL + '/goldenpath/' + src + '/liftOver/' + chain_name + '.gz'
             path_to_chain = download_chain_file(chain_name, url, redownload=False)
 
         # make a call to liftover command-line tool
@@ -376,8 +1038,5 @@ class Genome():
         Genome.__genome_request.set_retries(retries)
 
 
-
-
-
-
-
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Genome._reset_locks_after_fork)
@@ -0,0 +1,262 @@
+"""
+    Readers for indexed interval files, used by SequenceSet.from_region to read only
+    the parts of a file that overlap a region:
+
+        - bgzip-compressed BED files with a tabix index ({file}.tbi next to the file)
+        - UCSC bigBed files
+
+    Client should use SequenceSet.from_region rather than this module.
+"""
+import gzip
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from .sequence_set import MalformedBedFileError
+
+BIGBED_MAGIC = 0x8789F2EB
+BPT_MAGIC = 0x78CA8C91
+RTREE_MAGIC = 0x2468ACE0
+TABIX_MAGIC = b"TBI\1"
+TABIX_UCSC_FLAG = 0x10000
+
+
+def _bgzf_blocks(f, offset):
+    """ Yields (compressed offset, decompressed data) of the BGZF blocks from offset on """
+    f.seek(offset)
+    while True:
+        header = f.read(12)
+        if len(header) < 12:
+            return
+        if header[:4] != b"\x1f\x8b\x08\x04":
+            raise MalformedBedFileError("not a bgzip compressed file: " + f.name)
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = f.read(xlen)
+        block_size = None
+        i = 0
+        while i + 4 <= len(extra):
+            subfield, length = extra[i:i + 2], struct.unpack("<H", extra[i + 2:i + 4])[0]
+            if subfield == b"BC":
+                block_size = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+            i += 4 + length
+        if block_size is None:
+            raise MalformedBedFileError("not a bgzip compressed file: " + f.name)
+        rest = f.read(block_size - 12 - xlen)
+        yield offset, zlib.decompress(rest[:-8], -15)
+        offset += block_size
+
+
+def _reg2bins(start, end):
+    """ Bins of the tabix/BAM binning scheme that may hold intervals overlapping [start, end) """
+    end -= 1
+    bins = [0]
+    for shift, first in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(first + (start >> shift), first + (end >> shift) + 1))
+    return bins
+
+
+class TabixFile():
+    """ A bgzip-compressed BED file with a tabix index """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".tbi", "rb") as f:
+            index = gzip.decompress(f.read())
+        if index[:4] != TABIX_MAGIC:
+            raise MalformedBedFileError("not a tabix index: " + path + ".tbi")
+        (n_ref, fmt, self.col_seq, self.col_beg, self.col_end,
+         meta, self.skip, l_nm) = struct.unpack_from("<8i", index, 4)
+        self.zero_based = bool(fmt & TABIX_UCSC_FLAG)
+        self.meta = chr(meta)
+        pos = 36
+        names = index[pos:pos + l_nm].split(b"\0")
+        pos += l_nm
+        self.references = {}
+        for ref in range(n_ref):
+            bins = {}
+            n_bin = struct.unpack_from("<i", index, pos)[0]
+            pos += 4
+            for _ in range(n_bin):
+                bin_number, n_chunk = struct.unpack_from("<Ii", index, pos)
+                pos += 8
+                bins[bin_number] = struct.unpack_from("<%dQ" % (2 * n_chunk), index, pos)
+                pos += 16 * n_chunk
+            n_intv = struct.unpack_from("<i", index, pos)[0]
+            pos += 4
+            linear = struct.unpack_from("<%dQ" % n_intv, index, pos)
+            pos += 8 * n_intv
+            self.references[names[ref].decode()] = (bins, linear)
+
+    def query(self, chromosome, start, end):
+        """ Yields (chromosome, start, end, label) of the records overlapping [start, end) """
+        if chromosome not in self.references or start >= end:
+            return
+        bins, linear = self.references[chromosome]
+        window = start >> 14
+        min_offset = linear[window] if window < len(linear) else 0
+        chunks = []
+        for bin_number in _reg2bins(start, end):
+            pairs = bins.get(bin_number, ())
+            for i in range(0, len(pairs), 2):
+                if pairs[i + 1] > min_offset:
+                    chunks.append((max(pairs[i], min_offset), pairs[i + 1]))
+        chunks.sort()
+
+        with open(self.path, "rb") as f:
+            done = 0
+            for chunk_start, chunk_end in chunks:
+                chunk_start = max(chunk_start, done)
+                if chunk_start >= chunk_end:
+                    continue
+                for record in self.__read_chunk(f, chunk_start, chunk_end):
+                    if record[0] == chromosome and record[1] < end and record[2] > start:
+                        yield record
+                done = chunk_end
+
+    def __read_chunk(self, f, chunk_start, chunk_end):
+        """ Parses the lines between two virtual file offsets, which are line boundaries """
+        data = []
+        for block_offset, block in _bgzf_blocks(f, chunk_start >> 16):
+            begin = (chunk_start & 0xFFFF) if block_offset == chunk_start >> 16 else 0
+            if block_offset >= chunk_end >> 16:
+                data.append(block[begin:chunk_end & 0xFFFF])
+                break
+            data.append(block[begin:])
+        for line in b"".join(data).split(b"\n"):
+            record = self.__parse(line)
+            if record is not None:
+                yield record
+
+    def __parse(self, line):
+        line = line.decode().rstrip("\r")
+        if not line or line.startswith(self.meta) or line.startswith(("track", "browser")):
+            return None
+        fields = line.split("\t")
+        start = int(fields[self.col_beg - 1])
+        if not self.zero_based:
+            start -= 1
+        end = int(fields[self.col_end - 1]) if self.col_end else start + 1
+        used = {self.col_seq - 1, self.col_beg - 1, self.col_end - 1}
+        extra = [field for i, field in enumerate(fields) if i not in used]
+        return (fields[self.col_seq - 1], start, end, " ".join(extra) if extra else None)
+
+
+class BigBedFile():
+    """ A UCSC bigBed file """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(64)
+            self.order = "<"
+            if struct.unpack("<I", header[:4])[0] != BIGBED_MAGIC:
+                self.order = ">"
+                if struct.unpack(">I", header[:4])[0] != BIGBED_MAGIC:
+                    raise MalformedBedFileError("not a bigBed file: " + path)
+            (_, _, _, chrom_tree_offset, _, self.index_offset, _, _, _, _,
+             self.uncompress_buf_size, _) = struct.unpack(self.order + "IHHQQQHHQQIQ", header)
+            self.chrom_ids = self.__read_chrom_tree(f, chrom_tree_offset)
+
+    def __unpack(self, fmt, data, offset=0):
+        return struct.unpack_from(self.order + fmt, data, offset)
+
+    def __read_chrom_tree(self, f, offset):
+        """ Reads the chromosome B+ tree into a chromosome name -> id dict """
+        f.seek(offset)
+        magic, _, key_size, _, _ = self.__unpack("IIIIQ", f.read(24))
+        if magic != BPT_MAGIC:
+            raise MalformedBedFileError("bad chromosome tree in bigBed file: " + self.path)
+        chrom_ids = {}
+        nodes = [offset + 32]
+        while nodes:
+            f.seek(nodes.pop())
+            is_leaf, _, count = self.__unpack("BBH", f.read(4))
+            item_size = key_size + 8
+            items = f.read(count * item_size)
+            for i in range(count):
+                item = items[i * item_size:(i + 1) * item_size]
+                if is_leaf:
+                    chrom_id = self.__unpack("I", item, key_size)[0]
+                    chrom_ids[item[:key_size].rstrip(b"\0").decode()] = chrom_id
+                else:
+                    nodes.append(self.__unpack("Q", item, key_size)[0])
+        return chrom_ids
+
+    def __blocks(self, f, chrom_id, start, end):
+        """ (offset, size) of the data blocks whose R-tree entry overlaps the region """
+        f.seek(self.index_offset)
+        if self.__unpack("I", f.read(48))[0] != RTREE_MAGIC:
+            raise MalformedBedFileError("bad R-tree index in bigBed file: " + self.path)
+        blocks = []
+        nodes = [self.index_offset + 48]
+        while nodes:
+            f.seek(nodes.pop())
+            is_leaf, _, count = self.__unpack("BBH", f.read(4))
+            item_size = 32 if is_leaf else 24
+            items = f.read(count * item_size)
+            for i in range(count):
+                start_chrom, start_base, end_chrom, end_base = self.__unpack("4I", items, i * item_size)
+                if (start_chrom, start_base) < (chrom_id, end) and (end_chrom, end_base) > (chrom_id, start):
+                    if is_leaf:
+                        blocks.append(self.__unpack("QQ", items, i * item_size + 16))
+                    else:
+                        nodes.append(self.__unpack("Q", items, i * item_size + 16)[0])
+        return sorted(blocks)
+
+    def query(self, chromosome, start, end):
+        """ Yields (chromosome, start, end, label) of the records overlapping [start, end) """
+        chrom_id = self.chrom_ids.get(chromosome)
+        if chrom_id is None or start >= end:
+            return
+        with open(self.path, "rb") as f:
+            for offset, size in self.__blocks(f, chrom_id, start, end):
+                f.seek(offset)
+                data = f.read(size)
+                if self.uncompress_buf_size:
+                    data = zlib.decompress(data)
+                pos = 0
+                while pos < len(data):
+                    record_chrom, record_start, record_end = self.__unpack("3I", data, pos)
+                    rest_end = data.index(b"\0", pos + 12)
+                    rest = data[pos + 12:rest_end].decode()
+                    pos = rest_end + 1
+                    if record_chrom == chrom_id and record_start < end and record_end > start:
+                        label = " ".join(rest.split("\t")) if rest else None
+                        yield (chromosome, record_start, record_end, label)
+
+
+# recently opened files, so that repeated lookups do not parse the index again
+_open_files = OrderedDict()
+_open_files_lock = threading.Lock()
+MAX_OPEN_FILES = 16
+
+
+def open_indexed(path):
+    """
+        Opens a bigBed file or a tabix-indexed bgzip BED file, reusing the parsed
+        index of recently opened files that have not changed since
+
+        Raises:
+            FileNotFoundError: if the file (or its .tbi index) does not exist
+            MalformedBedFileError: if the file is neither a bigBed nor a tabix-indexed file
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _open_files_lock:
+        if key in _open_files:
+            _open_files.move_to_end(key)
+            return _open_files[key]
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if len(magic) < 4:
+        raise MalformedBedFileError("not a bigBed or tabix-indexed file: " + path)
+    if struct.unpack("<I", magic)[0] == BIGBED_MAGIC or struct.unpack(">I", magic)[0] == BIGBED_MAGIC:
+        indexed = BigBedFile(path)
+    else:
+        indexed = TabixFile(path)
+    with _open_files_lock:
+        _open_files[key] = indexed
+        while len(_open_files) > MAX_OPEN_FILES:
+            _open_files.popitem(last=False)
+    return indexed
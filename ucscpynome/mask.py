@@ -0,0 +1,195 @@
+"""
+    Per-chromosome index of assembly gaps (runs of N) and soft-masked repeats (runs of
+    lower case bases), used to tell how much of an interval is gap or repeat without
+    fetching its sequence.
+
+    Client should use Genome.mask_index and the SequenceSet methods mask_fractions and
+    filter_masked rather than this module.
+
+    On disk, an index is MAGIC followed by one record per chromosome:
+        HEADER (name length, number of N runs, number of masked runs), the name, then
+        the N runs and the masked runs as flat [start, end) pairs of little-endian
+        uint32
+"""
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAGIC = b"UCSCPYNOME-MASK 1\n"
+HEADER = struct.Struct("<HII")
+
+
+class MaskIndexError(ValueError):
+    """ MaskIndexError is raised when a file is not a valid mask index """
+    pass
+
+
+class _Runs():
+    """ Sorted, non-overlapping runs with prefix sums of their lengths """
+
+    def __init__(self, runs):
+        self.runs = runs
+        self.starts = runs[0::2]
+        self.ends = runs[1::2]
+        self.covered_before = array('q', [0])
+        total = 0
+        for start, end in zip(self.starts, self.ends):
+            total += end - start
+            self.covered_before.append(total)
+
+    def covered(self, start, end):
+        """ Number of bases of [start, end) inside a run """
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first >= last:
+            return 0
+        covered = self.covered_before[last] - self.covered_before[first]
+        covered -= max(0, start - self.starts[first])
+        covered -= max(0, self.ends[last - 1] - end)
+        return covered
+
+
+def _append_runs(runs, matches, offset):
+    """ Appends the spans of regular expression matches, joining touching runs """
+    for match in matches:
+        start = match.start() + offset
+        if runs and runs[-1] == start:
+            runs[-1] = match.end() + offset
+        else:
+            runs.append(start)
+            runs.append(match.end() + offset)
+
+
+def sequence_file_runs(path, chunk_size=1 << 22):
+    """
+        Finds the N runs and lower case runs of a chromosome file written by
+        Genome.download_sequence, chunk_size bytes at a time
+
+        Returns:
+            (array, array): flat [start, end) pairs of the N runs and of the lower case
+            runs
+    """
+    n_runs = array('I')
+    lower_runs = array('I')
+    offset = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            _append_runs(n_runs, re.finditer(rb"[Nn]+", data), offset)
+            _append_runs(lower_runs, re.finditer(rb"[a-z]+", data), offset)
+            offset += len(data)
+    return n_runs, lower_runs
+
+
+class MaskIndex():
+    """ N runs and soft-masked runs of the chromosomes of a genome """
+
+    def __init__(self, runs=None):
+        """
+            Params:
+                runs (dict): chromosome -> (N runs, lower case runs), each a flat array
+                of [start, end) pairs
+        """
+        self.__raw = dict(runs or {})
+        self.__runs = {}
+
+    def chromosomes(self):
+        """
+            Returns:
+                List[string]: chromosomes in the index
+        """
+        return list(self.__raw)
+
+    def __contains__(self, chromosome):
+        return chromosome in self.__raw
+
+    def runs(self, chromosome):
+        """
+            Returns:
+                (array, array): flat [start, end) pairs of the N runs and of the lower
+                case runs of a chromosome
+        """
+        return self.__raw[chromosome]
+
+    def __indexed(self, chromosome):
+        indexed = self.__runs.get(chromosome)
+        if indexed is None:
+            n_runs, lower_runs = self.__raw[chromosome]
+            indexed = (_Runs(n_runs), _Runs(lower_runs))
+            self.__runs[chromosome] = indexed
+        return indexed
+
+    def fractions(self, chromosome, start, end):
+        """
+            Fractions of an interval that are gap (N) and soft-masked repeat
+
+            Params:
+                chromosome (string): chromosome of the interval
+                start (int): start of the interval
+                end (int): end of the interval
+
+            Returns:
+                (float, float): gap fraction and repeat fraction, (0.0, 0.0) for empty
+                intervals and chromosomes that are not in the index
+        """
+        if end <= start or chromosome not in self.__raw:
+            return 0.0, 0.0
+        gaps, repeats = self.__indexed(chromosome)
+        length = end - start
+        return gaps.covered(start, end) / length, repeats.covered(start, end) / length
+
+    def save(self, path):
+        """ Writes the index to a file, replacing it at once """
+        partial_path = path + ".part"
+        with open(partial_path, "wb") as f:
+            f.write(MAGIC)
+            for chromosome, (n_runs, lower_runs) in self.__raw.items():
+                name = chromosome.encode("utf-8")
+                f.write(HEADER.pack(len(name), len(n_runs) // 2, len(lower_runs) // 2))
+                f.write(name)
+                for runs in (n_runs, lower_runs):
+                    if sys.byteorder == "big":
+                        runs = array('I', runs)
+                        runs.byteswap()
+                    f.write(runs.tobytes())
+        os.replace(partial_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+            Reads an index written by save
+
+            Raises:
+                MaskIndexError: if the file is not a mask index
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise MaskIndexError("not a mask index: " + path)
+        runs = {}
+        pos = len(MAGIC)
+        while pos < len(data):
+            if pos + HEADER.size > len(data):
+                raise MaskIndexError("truncated mask index: " + path)
+            name_length, n_count, lower_count = HEADER.unpack_from(data, pos)
+            pos += HEADER.size
+            chromosome = data[pos:pos + name_length].decode("utf-8")
+            pos += name_length
+            pair = []
+            for count in (n_count, lower_count):
+                chunk = data[pos:pos + 8 * count]
+                if len(chunk) != 8 * count:
+                    raise MaskIndexError("truncated mask index: " + path)
+                chromosome_runs = array('I')
+                chromosome_runs.frombytes(chunk)
+                if sys.byteorder == "big":
+                    chromosome_runs.byteswap()
+                pair.append(chromosome_runs)
+                pos += 8 * count
+            runs[chromosome] = tuple(pair)
+        return cls(runs)
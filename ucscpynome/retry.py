@@ -1,10 +1,118 @@
-import requests
+import os
+import threading
 import time
 
+# Base URLs of the UCSC REST API and download server. Override these (or set the
+# UCSC_API_URL / UCSC_DOWNLOAD_URL environment variables) to point ucscpynome at
+# a mirror or a local mock server.
+API_URL = os.environ.get("UCSC_API_URL", "https://api.genome.ucsc.edu")
+DOWNLOAD_URL = os.environ.get("UCSC_DOWNLOAD_URL", "https://hgdownload.cse.ucsc.edu")
 
 class NetworkError(ValueError):
     pass
 
+class _InFlight():
+    """ A GET request in progress, shared by all callers asking for the same url """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class _ConcurrencyLimiter():
+    """
+        Limits the number of requests in flight, adapting the limit AIMD-style (as TCP
+        congestion control does): the limit grows by about one per round of successful
+        requests and is cut when the server shows congestion, either with errors
+        (timeouts, connection errors, 429 and 5xx gateway statuses: halved) or with
+        latency rising well above the lowest latency seen (cut by 10%).
+
+        Latency baselines are kept per endpoint (url without its query), and latencies
+        of responses over SIZE_UNIT bytes are divided by their size in SIZE_UNITs, so
+        that a large download is not mistaken for congestion after small requests.
+        Client should not use this class!
+    """
+    # latency over LATENCY_TOLERANCE times the baseline counts as congestion
+    LATENCY_TOLERANCE = 2.0
+    SIZE_UNIT = 1 << 16
+    ERROR_DECREASE = 0.5
+    LATENCY_DECREASE = 0.9
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, adaptive=True):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.latency = None
+        # endpoint -> [smoothed latency, baseline latency], per SIZE_UNIT
+        self.__endpoints = {}
+        self.__last_decrease = 0.0
+        self.__condition = threading.Condition()
+
+    def acquire(self):
+        """ Waits for a free slot and takes it """
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, congested=False, endpoint=None, size=0):
+        """
+            Frees a slot and adapts the limit
+
+            Args:
+                latency (float): seconds until the whole response arrived, None if it
+                failed
+                congested (bool): the request failed or was turned away by the server
+                endpoint (string): url of the request without its query
+                size (int): bytes in the body of the response
+        """
+        with self.__condition:
+            self.in_flight -= 1
+            if self.adaptive:
+                if congested:
+                    self.__decrease(self.ERROR_DECREASE)
+                elif latency is not None:
+                    self.__observe(latency, endpoint, size)
+            self.__condition.notify_all()
+
+    def __observe(self, latency, endpoint, size):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        latency /= max(1.0, size / self.SIZE_UNIT)
+        timing = self.__endpoints.get(endpoint)
+        if timing is None:
+            timing = self.__endpoints[endpoint] = [latency, latency]
+        else:
+            timing[0] = 0.8 * timing[0] + 0.2 * latency
+            if latency < timing[1]:
+                timing[1] = latency
+            else:
+                # let the baseline decay towards lasting changes, e.g. a slower mirror
+                timing[1] += 0.01 * (latency - timing[1])
+        if timing[0] > self.LATENCY_TOLERANCE * timing[1]:
+            self.__decrease(self.LATENCY_DECREASE)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def __decrease(self, factor):
+        # at most one decrease per round trip: the failures of requests sent in the
+        # same round are one congestion signal
+        now = time.monotonic()
+        if now - self.__last_decrease < (self.latency or 0.0):
+            return
+        self.__last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+
+
 class Requests():
     """
         Constructs a new Requests instance 
@@ -12,9 +120,34 @@ class Requests():
 
         Methods here sets the timeout and retries for the Request object
 
+        All Requests instances share one transport. By default it goes to the network;
+        Requests.record(path) additionally saves every response into a response archive
+        and Requests.replay(path) serves responses from such an archive without any
+        network access. Setting the UCSC_REPLAY_ARCHIVE environment variable replays
+        from that archive from the start.
+
+        Concurrent GET requests for the same url are coalesced: only the first one goes
+        to the network and the others wait for and share its response.
+
+        The number of requests in flight at once is limited by an adaptive controller
+        shared by all instances, which raises the limit while responses come back fast
+        and cuts it on timeouts, 429/5xx responses and rising latency (see
+        set_concurrency and stats). 429 responses are retried after the delay the
+        server asks for.
+
         Raises:
             NetworkError: raised if a connection issue occurs during the API request
     """
+    __archive = None
+    __replaying = False
+    __lock = threading.Lock()
+    __in_flight = {}
+    __stats = {"requests": 0, "errors": 0, "coalesced": 0, "replayed": 0, "throttled": 0}
+    __limiter = _ConcurrencyLimiter()
+    # statuses showing that the server is overloaded
+    CONGESTION_STATUS = (429, 502, 503, 504)
+    MAX_RETRY_AFTER = 60
+
     def __init__(self, timeout=600, retries = 2):
         """ 
             Creates an instance of a Request. Client should not call use this constructor!
@@ -38,20 +171,256 @@ class Requests():
             Raises:
                 NetworkError
         """
-        request_exceptions = (
+        archive = Requests.__archive
+        if archive is not None and Requests.__replaying:
+            result = archive.get(url)
+            if result is None:
+                raise NetworkError("No recorded response for " + url + " in " + archive.path)
+            Requests.__count("replayed")
+            return result
+
+        with Requests.__lock:
+            call = Requests.__in_flight.get(url)
+            leader = call is None
+            if leader:
+                call = _InFlight()
+                Requests.__in_flight[url] = call
+            else:
+                Requests.__stats["coalesced"] += 1
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = self.__get(url, archive)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with Requests.__lock:
+                del Requests.__in_flight[url]
+            call.done.set()
+        return call.result
+
+    @staticmethod
+    def __request_exceptions():
+        """ Exceptions of the requests package that are retried """
+        import requests  # imported on first use, it is slow to import
+        return (
             requests.exceptions.Timeout,
             requests.exceptions.ConnectionError,
-            requests.exceptions.HTTPError
+            requests.exceptions.HTTPError,
+            requests.exceptions.ChunkedEncodingError
         )
+
+    def __get(self, url, archive):
+        """ Sends the GET request and records its response when recording """
+        result = self.__send("get", url)
+        if archive is not None:
+            archive.put(url, result.status_code, result.content)
+        return result
+
+    def __send(self, method, url, on_response=None, **kwargs):
+        """
+            Sends a request through the concurrency limiter, retrying on connection
+            errors, timeouts and 429 responses
+
+            Args:
+                method (string): name of the requests function to call, "get" or "head"
+                url (string): url to send the request to
+                on_response (function): called with each response while its slot is
+                still held, e.g. to stream the body, returns the number of bytes in the
+                body
+                kwargs: passed on to the requests function
+
+            Returns:
+                the last response received
+
+            Raises:
+                NetworkError: if every try failed with a connection error or timeout
+        """
+        import requests  # imported on first use, it is slow to import
+        request_exceptions = Requests.__request_exceptions()
         for i in range(self.retries):
+            Requests.__count("requests")
+            limiter = Requests.__limiter
+            limiter.acquire()
+            begin = time.monotonic()
+            latency = None
+            size = 0
+            congested = False
             try:
-                result = requests.get(url, timeout=self.timeout)
+                response = getattr(requests, method)(url, timeout=self.timeout, **kwargs)
+                congested = response.status_code in Requests.CONGESTION_STATUS
+                if on_response is not None:
+                    size = on_response(response)
+                else:
+                    content = getattr(response, "content", None)
+                    size = len(content) if isinstance(content, bytes) else 0
+                # measured to the end of the body, so streamed downloads count in full
+                latency = time.monotonic() - begin
             except request_exceptions:
+                congested = True
+                Requests.__count("errors")
                 continue
-            else:
-                return result
-        else:
-            raise NetworkError("GET Request timed out at " + str(self.timeout) + " seconds") 
+            finally:
+                limiter.release(latency, congested, url.split("?", 1)[0], size)
+            if response.status_code == 429 and i + 1 < self.retries:
+                Requests.__count("throttled")
+                time.sleep(Requests.__retry_after(response, i))
+                continue
+            return response
+        raise NetworkError(method.upper() + " Request timed out at " + str(self.timeout) + " seconds")
+
+    def head(self, url):
+        """
+            Sends a HEAD request to the specified url, to read metadata such as
+            Content-Length and Last-Modified without the body. Retries like get.
+
+            Args:
+                url (string): url to send a HEAD request to
+
+            Returns:
+                response with status_code and headers, None while replaying an archive
+                (archives do not record headers)
+
+            Raises:
+                NetworkError
+        """
+        if Requests.__archive is not None and Requests.__replaying:
+            return None
+        return self.__send("head", url, lambda response: 0, allow_redirects=True)
+
+    def download(self, url, file_path, chunk_size=1 << 20):
+        """
+            Sends a GET request to the specified url and streams the body of a
+            successful response into a file, without holding it in memory. The file
+            only appears once the whole body has been received. Retries like get.
+
+            When recording, the body is streamed into the archive too; bodies that do
+            not fit in an archive record (4 GiB compressed) raise ArchiveError after
+            the file has been written.
+
+            Args:
+                url (string): url to send a GET request to
+                file_path (string): file to write the body to
+                chunk_size (int): bytes read from the network at a time
+
+            Returns:
+                int: HTTP status code of the response, the file is only written if it
+                is 200
+
+            Raises:
+                NetworkError
+        """
+        archive = Requests.__archive
+        if archive is not None and Requests.__replaying:
+            response = self.get(url)
+            if response.status_code == 200:
+                with open(file_path, "wb") as f:
+                    f.write(response.content)
+            return response.status_code
+
+        partial_path = file_path + ".part"
+        def write_body(response):
+            size = 0
+            try:
+                if response.status_code == 200:
+                    with open(partial_path, "wb") as f:
+                        for chunk in response.iter_content(chunk_size):
+                            f.write(chunk)
+                            size += len(chunk)
+            finally:
+                response.close()
+            return size
+
+        try:
+            status_code = self.__send("get", url, write_body, stream=True).status_code
+            if status_code != 200:
+                return status_code
+            os.replace(partial_path, file_path)
+        finally:
+            # left behind by failed tries or errors while writing
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        if archive is not None:
+            archive.put_file(url, 200, file_path)
+        return 200
+
+    @staticmethod
+    def __retry_after(response, attempt):
+        """ Seconds to wait before retrying a 429 response """
+        headers = getattr(response, "headers", None) or {}
+        try:
+            return min(float(headers.get("Retry-After")), Requests.MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            return min(0.5 * 2 ** attempt, Requests.MAX_RETRY_AFTER)
+
+    @staticmethod
+    def set_concurrency(max_requests=32, min_requests=1, initial=None, adaptive=True):
+        """
+            Configures the limit on requests in flight at once, shared by all Requests
+            instances
+
+            Args:
+                max_requests (int): highest limit the controller may reach
+                min_requests (int): lowest limit the controller may reach
+                initial (int): starting limit, default 4 (max_requests if not adaptive)
+                adaptive (bool): adapt the limit to latency and errors; if False the
+                limit stays at initial
+        """
+        if initial is None:
+            initial = min(4, max_requests) if adaptive else max_requests
+        Requests.__limiter = _ConcurrencyLimiter(initial, min_requests, max_requests, adaptive)
+
+    @staticmethod
+    def _reset_after_fork():
+        """
+            Forgets the requests in flight in a forked child process, where the threads
+            of the parent that would complete them do not exist, and replaces the locks
+            they may have held.
+            Client should not call this method!
+        """
+        Requests.__lock = threading.Lock()
+        Requests.__in_flight = {}
+        limiter = Requests.__limiter
+        Requests.__limiter = _ConcurrencyLimiter(max(int(limiter.limit), limiter.min_limit),
+                                                 limiter.min_limit, limiter.max_limit,
+                                                 limiter.adaptive)
+
+    @staticmethod
+    def __count(stat):
+        with Requests.__lock:
+            Requests.__stats[stat] += 1
+
+    @staticmethod
+    def stats():
+        """
+            Counters shared by all Requests instances
+
+            Returns:
+                dict: "requests" (HTTP requests sent, including retries), "errors"
+                (requests that failed with a connection error or timeout), "coalesced"
+                (GETs that shared the response of a concurrent identical GET),
+                "replayed" (GETs served from a response archive) and "throttled" (429
+                responses that were retried); and the current state of the concurrency
+                controller: "concurrency_limit" (requests allowed in flight at once),
+                "in_flight" and "latency_ms" (smoothed response latency, None before the
+                first response)
+        """
+        limiter = Requests.__limiter
+        with Requests.__lock:
+            stats = dict(Requests.__stats)
+        stats["concurrency_limit"] = int(limiter.limit)
+        stats["in_flight"] = limiter.in_flight
+        stats["latency_ms"] = limiter.latency * 1000 if limiter.latency is not None else None
+        return stats
+
+    @staticmethod
+    def reset_stats():
+        """ Sets all counters returned by stats() to zero, the concurrency limit is kept """
+        with Requests.__lock:
+            for stat in Requests.__stats:
+                Requests.__stats[stat] = 0
 
     
     def set_timeout(self, timeout):
@@ -72,5 +441,45 @@ class Requests():
         """
         self.retries = retry
 
+    @staticmethod
+    def record(archive_path):
+        """
+            Records every response received from now on into a response archive,
+            appending to the archive if it already exists
+
+            Args:
+                archive_path (string): path to the archive file
+        """
+        from .archive import ResponseArchive
+        Requests.__use_archive(ResponseArchive(archive_path, writable=True), False)
+
+    @staticmethod
+    def replay(archive_path):
+        """
+            Serves every request from now on from a response archive, without
+            network access. Requests for urls that were not recorded raise NetworkError.
+
+            Args:
+                archive_path (string): path to the archive file
+        """
+        from .archive import ResponseArchive
+        Requests.__use_archive(ResponseArchive(archive_path), True)
+
+    @staticmethod
+    def online():
+        """ Stops recording or replaying and goes back to plain network requests """
+        Requests.__use_archive(None, False)
+
+    @staticmethod
+    def __use_archive(archive, replaying):
+        if Requests.__archive is not None:
+            Requests.__archive.close()
+        Requests.__archive = archive
+        Requests.__replaying = replaying
+
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Requests._reset_after_fork)
 
+if os.environ.get("UCSC_REPLAY_ARCHIVE"):
+    Requests.replay(os.environ["UCSC_REPLAY_ARCHIVE"])
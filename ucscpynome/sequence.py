@@ -1,6 +1,6 @@
-import requests
-import re
 from . import Requests
+from . import retry
+from .dna import pack
 
 
 class NetworkError(Exception):
@@ -14,6 +14,9 @@ class Sequence():
 
     Use methods here to get the string value of a certain sequence.
 
+    Fetched DNA is kept packed (2 bits per base, see dna.PackedDNA) and decoded to a
+    string on each call to string().
+
     Attributes:
         Read-only:
             start (int): Start index in chromosome
@@ -31,6 +34,7 @@ class Sequence():
     """ 
 
     __sequence_request = Requests()
+    __slots__ = ("_start", "_end", "_genome", "_chromosome", "label", "__dna", "__store")
 
     def __init__(self, start, end, genome, chromosome, label=None):
         """ Get an instance of a Sequence. Client should not use the constructor!
@@ -42,12 +46,14 @@ class Sequence():
             chromosome (string): target chromosome
             label (string): optional string for the user to identify the Sequence by
         """
-        self._start = start
-        self._end = end
+        self._start = int(start)
+        self._end = int(end)
         self._genome = genome 
         self._chromosome = chromosome
         self.label = label
-        self.__sequence = None
+        self.__dna = None
+        # DnaStore holding the DNA when the sequence is in a SequenceSet with a memory budget
+        self.__store = None
 
     @property
     def start(self):
@@ -72,9 +78,73 @@ class Sequence():
         Returns: 
             string: DNA sequence of the Sequence() object 
         """
-        if self.__sequence is None:
-            self.__sequence = self.__get_sequence()
-        return self.__sequence
+        dna = self._cached_dna()
+        if dna is None:
+            dna = pack(self.__get_sequence())
+            self.__keep_dna(dna)
+        return dna.decode()
+
+    def _cached_dna(self):
+        """ Returns the fetched DNA as a dna.PackedDNA, None if not fetched yet """
+        if self.__store is not None:
+            return self.__store.get(self)
+        return self.__dna
+
+    def __keep_dna(self, dna):
+        if self.__store is not None:
+            self.__store.put(self, dna)
+        else:
+            self.__dna = dna
+
+    def _cached_string(self):
+        """ Returns the DNA sequence if it has been fetched already, None otherwise """
+        dna = self._cached_dna()
+        return dna.decode() if dna is not None else None
+
+    def _cache_string(self, dna):
+        """ Sets the DNA sequence, e.g. when it was fetched or transferred in bulk """
+        self.__keep_dna(pack(dna))
+
+    def _cache_dna(self, dna):
+        """ Sets the DNA sequence from a dna.PackedDNA, without decoding it """
+        self.__keep_dna(dna)
+
+    def _clipped(self, start, end):
+        """
+            Returns a copy of the sequence narrowed to [start, end) that replaces it in
+            its DnaStore, with the matching part of the DNA if it was fetched already.
+            Client should use SequenceSet.validate instead!
+        """
+        seq = Sequence(start, end, self._genome, self._chromosome, self.label)
+        seq.__store = self.__store
+        dna = self._cached_dna()
+        if dna is not None:
+            if self.__store is not None:
+                self.__store.discard(self)
+            seq.__keep_dna(pack(dna.decode()[start - self._start:end - self._start]))
+        return seq
+
+    def _set_store(self, store):
+        """
+            Moves the DNA of the sequence into a DnaStore, or back into the sequence if
+            store is None. Client should use SequenceSet.set_memory_budget instead!
+        """
+        dna = self._cached_dna()
+        if self.__store is not None:
+            self.__store.discard(self)
+        self.__store = store
+        self.__dna = None
+        if dna is not None:
+            self.__keep_dna(dna)
+
+    def __getstate__(self):
+        # the store is local to the process, the DNA travels with the sequence
+        return (self._start, self._end, self._genome, self._chromosome, self.label,
+                self._cached_dna())
+
+    def __setstate__(self, state):
+        self._start, self._end, self._genome, self._chromosome, self.label, self.__dna = state
+        self.__store = None
 
     def __str__(self):
         """ Returns the Sequence info """
@@ -100,7 +170,7 @@ class Sequence():
         Calls endpoints:
             - GET /getData/sequence?/genome={genome};chrom={chromosome};start={start};end={end}
         """
-        url = 'https://api.genome.ucsc.edu/getData/sequence?'
+        url = retry.API_URL + '/getData/sequence?'
         url += 'genome=' + str(self.genome) + ';'
         url += 'chrom=' + self.chromosome + ';'
         url += 'start=' + str(self.start) + ';'
@@ -112,6 +182,7 @@ class Sequence():
             return info['dna']
 
         elif response.status_code == 400:
+            import re
             error_msg = info['error']
             new_error_msg = re.sub('for endpoint \'.*(,|$)', '', error_msg).rstrip()
             raise BadRequestError(new_error_msg)
@@ -1,16 +1,53 @@
 from . import Sequence
 from . import Genome
-import sys
-import subprocess
-import requests
 import os.path
 from os import path
-import gzip
+from array import array
 
 class MalformedBedFileError(Exception):
     pass
 
 
+class LiftoverMapping():
+    """ The result of SequenceSet.liftover_mapping: the lifted set, aligned with the
+    rows of the source set.
+
+    Attributes: (all are read-only)
+        target (SequenceSet): the lifted sequences, in source order, with the labels
+        of their source sequences
+        source_index (array): for each sequence of target, the index of its source
+        sequence in the source set
+        target_index (array): for each sequence of the source set, the index of its
+        lifted sequence in target, -1 if it was not mapped
+        unmapped_reason (List[string]): for each sequence of the source set, the reason
+        given by liftOver for not mapping it (e.g. "Deleted in new"), None if it was
+        mapped
+    """
+
+    def __init__(self, target, source_index, target_index, unmapped_reason):
+        self.target = target
+        self.source_index = source_index
+        self.target_index = target_index
+        self.unmapped_reason = unmapped_reason
+
+    def __len__(self):
+        return len(self.target_index)
+
+    def pairs(self, source):
+        """
+            Pairs source sequences with their lifted sequences
+
+            Params:
+                source (SequenceSet): the set that was lifted
+
+            Returns:
+                List[(Sequence, Sequence)]: (source sequence, lifted sequence) of every
+                mapped sequence
+        """
+        return [(source.sequences[i], lifted)
+                for i, lifted in zip(self.source_index, self.target.sequences)]
+
+
 
 class SequenceSet():
     """ Represents a set of sequences pulled from one or more bed files.
@@ -38,6 +75,16 @@ class SequenceSet():
     START_COL = 1
     END_COL = 2
 
+    # reasons reported by validate
+    UNKNOWN_CHROMOSOME = "unknown chromosome"
+    INVERTED = "start is not before end"
+    OUT_OF_RANGE = "outside of chromosome"
+
+    # rows formatted and written at a time by to_bed
+    WRITE_BATCH_ROWS = 65536
+    # characters of FASTA output buffered before a write
+    WRITE_BUFFER_CHARS = 1 << 22
+
     def __init__(self, bed_file_names, genome):
         """
         Get an instance of a SequenceSet for a given genome.
@@ -52,9 +99,271 @@ class SequenceSet():
 
         self.genome = str(genome)
         self.sequences = list()
+        self.__store = None
         for filename in bed_file_names:
             self.__parse_bed_file(filename)
 
+    @classmethod
+    def from_sequences(cls, sequences, genome):
+        """
+        Get an instance of a SequenceSet from existing Sequence objects.
+
+        Params:
+            sequences (iterable of Sequence): sequences to put in the set
+            genome (Genome): Genome object to which sequences belong
+        """
+        sequence_set = cls([], genome)
+        sequence_set.sequences = list(sequences)
+        return sequence_set
+
+    @classmethod
+    def from_region(cls, file_name, chromosome, start, end, genome):
+        """
+        Get an instance of a SequenceSet with the intervals of an indexed file that
+        overlap a region. Only the parts of the file that the index points to are read,
+        so lookups in genome-wide files stay fast.
+
+        Supported files:
+            - bgzip-compressed BED files with a tabix index (file_name + ".tbi")
+            - UCSC bigBed files
+
+        Params:
+            file_name (string): path of the indexed file
+            chromosome (string): chromosome of the region
+            start (int): start coordinate of the region (0-based)
+            end (int): end coordinate of the region (exclusive)
+            genome (Genome): Genome object to which sequences belong
+
+        Raises:
+            FileNotFoundError: if the file or its tabix index does not exist
+            MalformedBedFileError: if the file is not a supported indexed file
+        """
+        from .indexed import open_indexed
+        genome_name = str(genome)
+        sequences = [Sequence(record_start, record_end, genome_name, record_chrom, label)
+                     for record_chrom, record_start, record_end, label
+                     in open_indexed(file_name).query(chromosome, int(start), int(end))]
+        return cls.from_sequences(sequences, genome)
+
+    def _columns(self, include_sequences=True):
+        """
+            Splits the set into columns. Client should not call this method!
+
+            Params:
+                include_sequences (bool): also return the DNA of fetched sequences
+
+            Returns:
+                tuple: chromosome names (List[string]), per-row index into the
+                chromosome names (array), starts (array), ends (array), labels
+                (List[string], None if no row has a label) and the packed DNA of the
+                rows as columns from dna.join_packed (None if no row was fetched),
+                without decoding it
+        """
+        from .dna import join_packed
+        chrom_names = []
+        chrom_lookup = {}
+        chrom_index = array('I')
+        starts = array('q')
+        ends = array('q')
+        labels = []
+        packed = []
+        for seq in self.sequences:
+            chrom = seq.chromosome
+            if chrom not in chrom_lookup:
+                chrom_lookup[chrom] = len(chrom_names)
+                chrom_names.append(chrom)
+            chrom_index.append(chrom_lookup[chrom])
+            starts.append(int(seq.start))
+            ends.append(int(seq.end))
+            labels.append(seq.label)
+            packed.append(seq._cached_dna() if include_sequences else None)
+        if all(label is None for label in labels):
+            labels = None
+        dna = join_packed(packed) if any(dna is not None for dna in packed) else None
+        return chrom_names, chrom_index, starts, ends, labels, dna
+
+    @classmethod
+    def _from_columns(cls, genome, chrom_names, chrom_index, starts, ends,
+                      labels=None, dna=None):
+        """
+            Builds a SequenceSet from the columns returned by _columns. The DNA stays
+            packed until it is asked for. Client should not call this method!
+        """
+        from .dna import split_packed
+        genome_name = str(genome)
+        packed = split_packed(*dna) if dna is not None else None
+        sequences = []
+        for i in range(len(starts)):
+            seq = Sequence(starts[i], ends[i], genome_name, chrom_names[chrom_index[i]],
+                           labels[i] if labels is not None else None)
+            if packed is not None:
+                seq_dna = next(packed)
+                if seq_dna is not None:
+                    seq._cache_dna(seq_dna)
+            sequences.append(seq)
+        return cls.from_sequences(sequences, genome)
+
+    def __reduce__(self):
+        # pickled column-wise rather than as a list of Sequence objects, with the DNA
+        # still packed
+        return (SequenceSet._from_columns, (self.genome,) + self._columns())
+
+    def set_memory_budget(self, max_bytes, spill=False, spill_dir=None):
+        """
+            Limits the memory used by fetched DNA of the sequences in the set.
+
+            Once the (packed) DNA of the set exceeds max_bytes, the least recently used
+            sequences give up their DNA: it is either dropped and fetched again when
+            needed, or, with spill, written to a temporary file and read back through a
+            memory map. The budget applies to the sequences in the set when this is
+            called; call it again after adding sequences.
+
+            Params:
+                max_bytes (int): budget in bytes, None to remove the budget
+                spill (bool): spill DNA over the budget to disk instead of dropping it
+                spill_dir (string): directory for the spill file, default temp directory
+        """
+        from .dna import DnaStore
+        store = DnaStore(max_bytes, spill, spill_dir) if max_bytes is not None else None
+        for seq in self.sequences:
+            seq._set_store(store)
+        if self.__store is not None:
+            self.__store.close()
+        self.__store = store
+
+    def cached_bytes(self):
+        """
+            Returns:
+                int: approximate memory in bytes used by fetched DNA held in memory
+        """
+        if self.__store is not None:
+            return self.__store.nbytes
+        total = 0
+        for seq in self.sequences:
+            dna = seq._cached_dna()
+            if dna is not None:
+                total += dna.nbytes
+        return total
+
+    def prefetch(self, ahead=8, workers=4):
+        """
+            Iterates over the sequences of the set together with their DNA, fetching the
+            next sequences in background threads while the caller processes the
+            current one, which hides network latency in streaming workloads.
+
+            Example:
+                for seq, dna in sequence_set.prefetch():
+                    analyse(seq.label, dna)
+
+            Params:
+                ahead (int): number of sequences to fetch ahead of the current one
+                workers (int): number of fetch threads
+
+            Yields:
+                (Sequence, string): each sequence of the set, in order, and its DNA
+
+            Raises:
+                NetworkError, BadRequestError: when a sequence cannot be fetched, raised
+                at its position in the iteration
+        """
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+        sequences = iter(list(self.sequences))
+        try:
+            for seq in sequences:
+                pending.append((seq, executor.submit(seq.string)))
+                if len(pending) > ahead:
+                    break
+            while pending:
+                seq, future = pending.popleft()
+                next_seq = next(sequences, None)
+                if next_seq is not None:
+                    pending.append((next_seq, executor.submit(next_seq.string)))
+                yield seq, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def to_arrow(self, include_sequences=False):
+        """
+            Converts the set to an Apache Arrow table with chrom, start, end and label
+            columns (and sequence, with include_sequences). The coordinate columns are
+            handed to Arrow without copying or formatting. Requires pyarrow.
+
+            Params:
+                include_sequences (bool): add a sequence column with the DNA of
+                fetched sequences (null for sequences that were not fetched)
+
+            Returns:
+                pyarrow.Table: the set as a table, with the genome in its metadata
+        """
+        from . import arrow
+        return arrow.to_arrow(self, include_sequences)
+
+    @classmethod
+    def from_arrow(cls, table, genome=None):
+        """
+            Get an instance of a SequenceSet from an Apache Arrow table with chrom,
+            start and end columns, and optionally label and sequence columns.
+            Requires pyarrow.
+
+            Params:
+                table (pyarrow.Table): table to read
+                genome (Genome): genome of the sequences, default the genome in the
+                table metadata (as written by to_arrow)
+
+            Raises:
+                ValueError: if a column is missing or the genome is not known
+        """
+        from . import arrow
+        return arrow.from_arrow(cls, table, genome)
+
+    def to_parquet(self, parquet_file_name, include_sequences=False):
+        """
+            Writes the set to a Parquet file, see to_arrow. Requires pyarrow.
+
+            WARNING: If parquet_file_name already exists, this will overwite that file.
+
+            Params:
+                parquet_file_name (string): name of the Parquet file to write to
+                include_sequences (bool): also write the DNA of fetched sequences
+        """
+        from . import arrow
+        arrow.import_pyarrow()
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(self.to_arrow(include_sequences), parquet_file_name)
+
+    @classmethod
+    def from_parquet(cls, parquet_file_name, genome=None):
+        """
+            Get an instance of a SequenceSet from a Parquet file, see from_arrow.
+            Requires pyarrow.
+
+            Params:
+                parquet_file_name (string): name of the Parquet file to read
+                genome (Genome): genome of the sequences, default the genome stored in
+                the file by to_parquet
+        """
+        from . import arrow
+        arrow.import_pyarrow()
+        import pyarrow.parquet
+        return cls.from_arrow(pyarrow.parquet.read_table(parquet_file_name), genome)
+
+    def to_shared_memory(self, include_sequences=True):
+        """
+            Copies the set into a shared memory block, for cheap transfer to process
+            pool workers. See SharedSequenceSet.
+
+            Params:
+                include_sequences (bool): also copy the DNA of fetched sequences
+
+            Returns:
+                SharedSequenceSet: handle to the shared copy, owned by the caller
+        """
+        from .shared import SharedSequenceSet
+        return SharedSequenceSet(self, include_sequences)
+
     def __is_header_line(self, L):
         """ 
             Check if the given line is part of the header of a bed file
@@ -94,75 +403,267 @@ class SequenceSet():
                             raise MalformedBedFileError("Not enough columns")
                     elif len(L) != num_columns:
                         raise MalformedBedFileError("Number of columns is not the same across all lines in file: " + bed_file_name)
+                    try:
+                        start = int(L[self.START_COL])
+                        end = int(L[self.END_COL])
+                    except ValueError:
+                        raise MalformedBedFileError("Coordinates are not integers in file: " + bed_file_name)
                     if len(L) > self.MIN_NUM_COLS:
                         # there is additional line data
                         additional_cols = L[self.MIN_NUM_COLS:]
                         label = " ".join(additional_cols)
-                        seq = Sequence(L[self.START_COL], L[self.END_COL], str(self.genome),
+                        seq = Sequence(start, end, str(self.genome),
                                             L[self.CHROM_COL], label)
                         curr_file_sequences.append(seq)
                     else:
-                        seq = Sequence(L[self.START_COL], L[self.END_COL],
+                        seq = Sequence(start, end,
                                             str(self.genome), L[self.CHROM_COL])
                         curr_file_sequences.append(seq)
         # successfully parsed bed file
         self.sequences.extend(curr_file_sequences)
     
-    def to_bed(self, bed_file_name):
+    def validate(self, clip=False):
+        """
+            Checks the coordinates of all sequences against the chromosome sizes of the
+            genome, before any sequence is fetched. Only the chromosome sizes are
+            downloaded (once per genome), so invalid rows never cost a sequence request.
+
+            A sequence is invalid if its chromosome does not exist in the genome, its start
+            is not before its end, or it extends beyond either end of its chromosome.
+
+            Params:
+                clip (bool): fix the set instead of only reporting problems. Sequences
+                that extend beyond their chromosome are replaced by sequences clipped to
+                the chromosome; sequences that cannot be fixed (unknown chromosome,
+                start not before end, or no overlap with the chromosome) are removed.
+
+            Returns:
+                List[(int, Sequence, string)]: index in the set before clipping, sequence
+                and reason (SequenceSet.UNKNOWN_CHROMOSOME, INVERTED or OUT_OF_RANGE) of
+                every invalid sequence
+
+            Calls endpoints:
+                -GET /list/chromosomes?genome={genome}
+        """
+        sizes = Genome(self.genome).chromosome_sizes()
+        problems = []
+        kept = []
+        for i, seq in enumerate(self.sequences):
+            size = sizes.get(seq.chromosome)
+            start = seq.start
+            end = seq.end
+            if size is None:
+                problems.append((i, seq, self.UNKNOWN_CHROMOSOME))
+                continue
+            if start >= end:
+                problems.append((i, seq, self.INVERTED))
+                continue
+            if start < 0 or end > size:
+                problems.append((i, seq, self.OUT_OF_RANGE))
+                if not clip:
+                    continue
+                start = max(start, 0)
+                end = min(end, size)
+                if start >= end:
+                    continue
+                seq = seq._clipped(start, end)
+            if clip:
+                kept.append(seq)
+        if clip:
+            self.sequences = kept
+        return problems
+
+    def mask_fractions(self, mask_index):
+        """
+            Computes the fraction of every sequence that is assembly gap (N) and
+            soft-masked repeat, from a mask index rather than from sequence strings, so
+            nothing is fetched.
+
+            Params:
+                mask_index (MaskIndex): index of the genome, see Genome.mask_index
+
+            Returns:
+                (array, array): gap fractions and repeat fractions (floats), aligned with
+                the sequences of the set; 0.0 for chromosomes that are not in the index
+        """
+        gap_fractions = array('d')
+        repeat_fractions = array('d')
+        for seq in self.sequences:
+            gap, repeat = mask_index.fractions(seq.chromosome, seq.start, seq.end)
+            gap_fractions.append(gap)
+            repeat_fractions.append(repeat)
+        return gap_fractions, repeat_fractions
+
+    def filter_masked(self, mask_index, max_gap_fraction=0.0, max_repeat_fraction=1.0):
+        """
+            Removes sequences that are mostly assembly gap or soft-masked repeat, before
+            any of them is fetched.
+
+            Params:
+                mask_index (MaskIndex): index of the genome, see Genome.mask_index
+                max_gap_fraction (float): highest gap fraction kept, default no gap at all
+                max_repeat_fraction (float): highest repeat fraction kept, default any
+
+            Returns:
+                int: number of sequences removed
+        """
+        gap_fractions, repeat_fractions = self.mask_fractions(mask_index)
+        kept = [seq for seq, gap, repeat in zip(self.sequences, gap_fractions, repeat_fractions)
+                if gap <= max_gap_fraction and repeat <= max_repeat_fraction]
+        removed = len(self.sequences) - len(kept)
+        self.sequences = kept
+        return removed
+
+    def sort(self):
+        """
+            Sorts the sequences of the set by (chromosome, start, end), the order
+            expected by tabix, bedtools and other tools reading sorted BED files.
+            Chromosomes are compared by name. Sequences with equal coordinates keep their
+            order.
+        """
+        self.sequences.sort(key=lambda seq: (seq.chromosome, seq.start, seq.end))
+
+    def dedupe(self):
+        """
+            Removes sequences with the same chromosome, start and end as an earlier
+            sequence of the set, keeping the first one.
+
+            Returns:
+                int: number of sequences removed
+        """
+        seen = set()
+        kept = []
+        for seq in self.sequences:
+            key = (seq.chromosome, seq.start, seq.end)
+            if key not in seen:
+                seen.add(key)
+                kept.append(seq)
+        removed = len(self.sequences) - len(kept)
+        self.sequences = kept
+        return removed
+
+    @staticmethod
+    def sort_bed(bed_file_names, sorted_bed_file_name, dedupe=False, max_rows=1000000, tmp_dir=None):
+        """
+            Static utility method to sort the intervals of bed files by (chromosome,
+            start, end) into one bed file, for files too big to load as a SequenceSet.
+
+            At most max_rows lines are held in memory: bigger inputs are sorted in runs
+            written to temporary files, which are then merged. Lines are written as they
+            are in the input files; header lines are dropped.
+
+            WARNING: If sorted_bed_file_name already exists, this will overwite that file.
+
+            Params:
+                bed_file_names (List[string]): bed files to sort
+                sorted_bed_file_name (string): name of the bed file to write to
+                dedupe (bool): only keep the first line of lines with the same
+                chromosome, start and end
+                max_rows (int): number of lines sorted in memory at a time
+                tmp_dir (string): directory for the sorted runs, default temp directory
+
+            Returns:
+                int: number of lines written
+
+            Raises:
+                TypeError: if bed_file_names is a single file name rather than a list
+                MalformedBedFileError: if a bed file cannot be successfully parsed
+                OSError: if a file cannot be opened or created
+        """
+        if not isinstance(bed_file_names, list):
+            raise TypeError("bed_file_names should be of type list")
+        from .bedsort import sort_bed
+        return sort_bed(bed_file_names, sorted_bed_file_name, dedupe, max_rows, tmp_dir)
+
+    def __open_output(self, file_name, compress):
+        """
+            Opens an output file for writing text, gzip compressed if compress.
+            Client should not call this method!
+        """
+        if compress:
+            import gzip
+            return gzip.open(file_name, "wt", compresslevel=6)
+        return open(file_name, "w", buffering=1 << 20)
+
+    def to_bed(self, bed_file_name, compress=False):
         """
             Dump the sequence set data into a single bed file.
 
+            Rows are formatted and written in large batches.
+
             WARNING: If bed_file_name already exists, this will overwite that file.
 
             Params:
                 bed_file_name (string) : name of the bed file to write to
+                compress (bool) : write a gzip compressed file
             Raises:
                 OSError: if bed_file_name cannot be opened with write permissions
 
         """
-        f = open(bed_file_name, "w")
-        for sequence in self.sequences:
-            f.write(sequence.chromosome)
-            f.write("\t")
-            f.write(sequence.start)
-            f.write("\t")
-            f.write(sequence.end)
-            if sequence.label != None:
-                f.write("\t")
-                f.write(sequence.label)
-            f.write("\n")
-        f.close()
+        with self.__open_output(bed_file_name, compress) as f:
+            self.__write_bed(f, lambda i, seq: seq.label)
 
-    def to_fasta(self, fasta_file_name):
+    def __write_bed(self, f, name):
+        """
+            Helper method writing the sequences to an open file as BED rows, in batches
+            of WRITE_BATCH_ROWS. name(i, seq) gives the name column of the sequence at
+            index i, rows without a name (None) have 3 columns.
+            Client should not call this method!
+        """
+        sequences = self.sequences
+        for first in range(0, len(sequences), self.WRITE_BATCH_ROWS):
+            rows = []
+            for i, seq in enumerate(sequences[first:first + self.WRITE_BATCH_ROWS], first):
+                label = name(i, seq)
+                if label != None:
+                    rows.append("%s\t%d\t%d\t%s\n" % (seq.chromosome, seq.start, seq.end, label))
+                else:
+                    rows.append("%s\t%d\t%d\n" % (seq.chromosome, seq.start, seq.end))
+            f.write("".join(rows))
+
+    def to_fasta(self, fasta_file_name, line_width=None, workers=4, compress=False):
         """
             Dump actual sequence strings from sequence set into a fasta file.
 
             WARNING: If fasta_file_name already exists, this will overwite that file.
 
-            The call to sequence.string() may cause a network request if the sequence
-            string has not been populated yet.
+            Sequence strings that have not been populated yet are fetched by a pool of
+            workers threads while earlier sequences are written, so network requests
+            overlap with each other and with writing. The file is written in order.
 
             Params:
                 fasta_file_name (string): name of fasta file to write to
+                line_width (int): wrap sequences into lines of at most line_width
+                bases, default one line per sequence
+                workers (int): number of threads fetching sequence strings
+                compress (bool): write a gzip compressed file
 
             Raises:
                 OSError: if fasta_file_name cannot be opened with write permissions
                 NetworkError: if cannot download sequence string
 
         """
-        f = open(fasta_file_name, "w")
-        for seq in self.sequences:
-            seq_string = seq.string()
-            f.write("> ")
-            if seq.label != None:
-                f.write(seq.label)
-            else:
-                f.write(seq.chromosome + ":" + seq.start + "-" + seq.end)
-            f.write("\n")
-            f.write(seq_string)
-            f.write("\n")
-        f.close()
-    
+        with self.__open_output(fasta_file_name, compress) as f:
+            buffer = []
+            buffered = 0
+            for seq, seq_string in self.prefetch(ahead=4 * workers, workers=workers):
+                if seq.label != None:
+                    buffer.append("> " + seq.label + "\n")
+                else:
+                    buffer.append("> %s:%d-%d\n" % (seq.chromosome, seq.start, seq.end))
+                if line_width and len(seq_string) > line_width:
+                    buffer.append("\n".join([seq_string[i:i + line_width]
+                                             for i in range(0, len(seq_string), line_width)]))
+                else:
+                    buffer.append(seq_string)
+                buffer.append("\n")
+                buffered += len(seq_string)
+                if buffered >= self.WRITE_BUFFER_CHARS:
+                    f.write("".join(buffer))
+                    buffer = []
+                    buffered = 0
+            f.write("".join(buffer))
+
     # Liftover functionality
     def liftover(self, target_genome, path_to_chain = None):
         """
@@ -232,3 +733,79 @@ class SequenceSet():
         # create a new object of the lifted result
         lifted_sequence = SequenceSet([target_file], target_genome)
         return lifted_sequence
+
+    def liftover_mapping(self, target_genome, path_to_chain = None):
+        """
+            Perform liftover to a specified genome, keeping track of which source
+            sequence every lifted sequence comes from.
+
+            Each sequence is given its index in the set as BED name while it goes
+            through liftOver, so lifted and unmapped rows can be matched to the source
+            set without comparing coordinates. Files are generated in /liftover_files
+            like liftover does, the bed files being named {self.genome}To{target_genome}
+            _mapping_source.bed, _mapping_target.bed and _mapping_unmapped.bed.
+
+            Example:
+                mapping = hg19_set.liftover_mapping(Genome("hg38"))
+                for i, reason in enumerate(mapping.unmapped_reason):
+                    if reason is not None:
+                        print(hg19_set.sequences[i].label + " not mapped: " + reason)
+
+            Params:
+                target_genome (Genome): genome to liftover to
+                path_to_chain (string): optional parameter to specify the path to a
+                custom chain file to use for the liftover
+
+            Returns:
+                LiftoverMapping: lifted set aligned with the rows of this set
+
+            Raises:
+                LookupError: If the chain file for the specified target genome doesn't 
+                exist.
+                LiftoverError: If there is an error during liftover using UCSC's 
+                command-line liftover tool.
+        """
+        BED_FILES_PATH = "liftover_files/bed_files/"
+        script_dir = os.path.dirname(__file__)
+
+        src = str(self.genome)
+        target = str(target_genome)
+        prefix = os.path.join(script_dir, BED_FILES_PATH + src + "To" + target + "_mapping_")
+        src_file = prefix + "source.bed"
+        target_file = prefix + "target.bed"
+        unmapped_file = prefix + "unmapped.bed"
+
+        # the row id is the only name column, labels are restored from the source
+        with self.__open_output(src_file, False) as f:
+            self.__write_bed(f, lambda i, seq: i)
+
+        Genome.liftover(self.genome, target_genome, src_file, target_file,
+                        unmapped_file=unmapped_file, path_to_chain=path_to_chain)
+
+        target_name = str(target_genome)
+        source_index = array('q')
+        target_index = array('q', [-1]) * len(self.sequences)
+        lifted = []
+        with open(target_file) as f:
+            for line in f:
+                L = line.split()
+                if len(L) < self.MIN_NUM_COLS + 1:
+                    continue
+                i = int(L[self.MIN_NUM_COLS])
+                target_index[i] = len(lifted)
+                source_index.append(i)
+                lifted.append(Sequence(int(L[self.START_COL]), int(L[self.END_COL]), target_name,
+                                       L[self.CHROM_COL], self.sequences[i].label))
+
+        unmapped_reason = [None] * len(self.sequences)
+        with open(unmapped_file) as f:
+            reason = None
+            for line in f:
+                if line.startswith("#"):
+                    reason = line[1:].strip()
+                    continue
+                L = line.split()
+                if len(L) >= self.MIN_NUM_COLS + 1:
+                    unmapped_reason[int(L[self.MIN_NUM_COLS])] = reason
+        return LiftoverMapping(SequenceSet.from_sequences(lifted, target_genome), source_index,
+                               target_index, unmapped_reason)
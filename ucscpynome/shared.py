@@ -0,0 +1,230 @@
+from array import array
+from multiprocessing import shared_memory
+from .dna import PackedDNA, packed_nbytes
+from .sequence_set import SequenceSet
+
+
+def _pack_strings(strings):
+    """ Encodes a list of optional strings as (lengths, offsets, bytes), -1 length for None """
+    lengths = array('q')
+    offsets = array('q')
+    chunks = []
+    offset = 0
+    for string in strings:
+        offsets.append(offset)
+        if string is None:
+            lengths.append(-1)
+        else:
+            encoded = string.encode("utf-8")
+            lengths.append(len(encoded))
+            chunks.append(encoded)
+            offset += len(encoded)
+    return lengths, offsets, b"".join(chunks)
+
+
+def _attach(name):
+    """ Attaches to an existing shared memory block without taking ownership of it """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 attaching always registers the block with the resource
+        # tracker; pool workers share the creator's tracker, so this is a no-op there
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedSequenceSet():
+    """ A read-only copy of a SequenceSet stored in one shared memory block.
+
+    The coordinates, labels and (optionally) fetched DNA of the set are laid out as
+    flat columns in a multiprocessing.shared_memory block. The DNA is stored packed,
+    2 bits per base as in dna.PackedDNA, and only decoded when it is read. Pickling a
+    SharedSequenceSet only sends the name of the block and its layout, so passing it
+    to process pool workers is cheap whatever the size of the set; workers attach to
+    the block and read the columns without copying them.
+
+    The process that creates a SharedSequenceSet owns the block and must call
+    unlink() once all workers are done with it (or use it as a context manager).
+
+    Attributes: (all are read-only)
+        genome (string): genome to which sequences belong
+        chromosomes (List[string]): chromosome names, indexed by chrom_index
+        starts (memoryview of int): start coordinate of every sequence
+        ends (memoryview of int): end coordinate of every sequence
+        chrom_index (memoryview of int): index into chromosomes of every sequence
+    """
+
+    def __init__(self, sequence_set, include_sequences=True):
+        """
+        Copies a SequenceSet into a new shared memory block.
+        Client should use SequenceSet.to_shared_memory instead!
+
+        Params:
+            sequence_set (SequenceSet): set to copy
+            include_sequences (bool): also copy the DNA of fetched sequences
+        """
+        (chrom_names, chrom_index, starts, ends, labels,
+         dna) = sequence_set._columns(include_sequences)
+        n = len(starts)
+        label_lengths, label_offsets, label_bytes = _pack_strings(labels or [None] * n)
+        if dna is None:
+            dna = (array('q', [-1] * n), array('B', [0] * n), array('q', [0] * 2 * n),
+                   array('I'), b"")
+        dna_lengths, dna_raw, dna_run_counts, dna_runs, dna_bytes = dna
+        # offsets of every row into the packed bases and into the runs
+        dna_offsets = array('q')
+        dna_run_offsets = array('q')
+        offset = 0
+        run_offset = 0
+        for i, length in enumerate(dna_lengths):
+            dna_offsets.append(offset)
+            dna_run_offsets.append(run_offset)
+            if length >= 0:
+                offset += packed_nbytes(length, dna_raw[i])
+                run_offset += dna_run_counts[2 * i] + dna_run_counts[2 * i + 1]
+
+        columns = [("starts", starts), ("ends", ends), ("chrom_index", chrom_index),
+                   ("label_lengths", label_lengths), ("label_offsets", label_offsets),
+                   ("dna_lengths", dna_lengths), ("dna_offsets", dna_offsets),
+                   ("dna_run_counts", dna_run_counts), ("dna_run_offsets", dna_run_offsets),
+                   ("dna_runs", dna_runs), ("dna_raw", dna_raw),
+                   ("label", label_bytes), ("dna", dna_bytes)]
+        layout = {}
+        size = 0
+        for name, column in columns:
+            nbytes = len(column) * (column.itemsize if isinstance(column, array) else 1)
+            typecode = column.typecode if isinstance(column, array) else "B"
+            layout[name] = (size, nbytes, typecode)
+            size += (nbytes + 7) // 8 * 8  # keep every column 8-byte aligned
+
+        self.__block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, column in columns:
+            offset, nbytes, _ = layout[name]
+            self.__block.buf[offset:offset + nbytes] = column if isinstance(column, bytes) else column.tobytes()
+
+        self.__owner = True
+        self.__setup(sequence_set.genome, chrom_names, n, layout)
+
+    def __setup(self, genome, chromosomes, length, layout):
+        self.genome = genome
+        self.chromosomes = chromosomes
+        self.__length = length
+        self.__layout = layout
+        self.__views = {}
+        for name, (offset, nbytes, typecode) in layout.items():
+            self.__views[name] = self.__block.buf[offset:offset + nbytes].cast(typecode)
+
+    def __getstate__(self):
+        return {"name": self.__block.name, "genome": self.genome,
+                "chromosomes": self.chromosomes, "length": self.__length,
+                "layout": self.__layout}
+
+    def __setstate__(self, state):
+        self.__block = _attach(state["name"])
+        self.__owner = False
+        self.__setup(state["genome"], state["chromosomes"], state["length"], state["layout"])
+
+    @property
+    def name(self):
+        """ Name of the shared memory block """
+        return self.__block.name
+
+    @property
+    def starts(self):
+        return self.__views["starts"]
+
+    @property
+    def ends(self):
+        return self.__views["ends"]
+
+    @property
+    def chrom_index(self):
+        return self.__views["chrom_index"]
+
+    def __len__(self):
+        return self.__length
+
+    def chromosome(self, i):
+        """ Chromosome of the i-th sequence """
+        return self.chromosomes[self.chrom_index[i]]
+
+    def __string(self, i, kind, encoding):
+        length = self.__views[kind + "_lengths"][i]
+        if length < 0:
+            return None
+        offset = self.__views[kind + "_offsets"][i]
+        return bytes(self.__views[kind][offset:offset + length]).decode(encoding)
+
+    def label(self, i):
+        """ Label of the i-th sequence, None if it has none """
+        return self.__string(i, "label", "utf-8")
+
+    def packed(self, i):
+        """
+            Packed DNA of the i-th sequence, copied out of the block without decoding
+            it, None if it was not fetched when the set was shared
+
+            Returns:
+                dna.PackedDNA: the packed sequence
+        """
+        views = self.__views
+        length = views["dna_lengths"][i]
+        if length < 0:
+            return None
+        raw = bool(views["dna_raw"][i])
+        offset = views["dna_offsets"][i]
+        run_offset = views["dna_run_offsets"][i]
+        middle = run_offset + views["dna_run_counts"][2 * i]
+        end = middle + views["dna_run_counts"][2 * i + 1]
+        runs = views["dna_runs"]
+        return PackedDNA(length, bytes(views["dna"][offset:offset + packed_nbytes(length, raw)]),
+                         array('I', runs[run_offset:middle]), array('I', runs[middle:end]), raw)
+
+    def string(self, i):
+        """ DNA of the i-th sequence, None if it was not fetched when the set was shared """
+        packed = self.packed(i)
+        return packed.decode() if packed is not None else None
+
+    def to_sequence_set(self):
+        """
+            Copies the shared set back into a regular SequenceSet
+
+            Returns:
+                SequenceSet: a new SequenceSet with the same sequences
+        """
+        n = self.__length
+        labels = [self.label(i) for i in range(n)]
+        views = self.__views
+        # copied still packed, sequences decode their DNA when it is asked for
+        dna = (array('q', views["dna_lengths"]), array('B', views["dna_raw"]),
+               array('q', views["dna_run_counts"]), array('I', views["dna_runs"]),
+               bytes(views["dna"]))
+        return SequenceSet._from_columns(self.genome, self.chromosomes, self.chrom_index,
+                                         self.starts, self.ends, labels, dna)
+
+    def close(self):
+        """ Detaches this process from the shared memory block """
+        for view in self.__views.values():
+            view.release()
+        self.__views = {}
+        self.__block.close()
+
+    def unlink(self):
+        """ Detaches from and frees the shared memory block. Only the creator may call this. """
+        if not self.__owner:
+            raise PermissionError("only the process that created the shared set may unlink it")
+        self.close()
+        self.__block.unlink()
+
+    def __del__(self):
+        # views into the block must be released before the block can be closed
+        for view in getattr(self, "_SharedSequenceSet__views", {}).values():
+            view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.__owner:
+            self.unlink()
+        else:
+            self.close()
@@ -0,0 +1,162 @@
+"""
+    Reader for UCSC .2bit files, the compact form in which whole assemblies are
+    distributed on hgdownload (goldenPath/{genome}/bigZips/{genome}.2bit).
+
+    A .2bit file holds every sequence of an assembly packed 2 bits per base, in the same
+    order as dna.pack_bases, with runs of N and of lower case (soft-masked) bases kept
+    as blocks on the side. Sequences are decoded through a memory map, a window at a
+    time, so chromosomes are never held in memory in full.
+
+    Client should use Genome.download_sequence(bulk="2bit") rather than this module.
+"""
+import mmap
+import struct
+from array import array
+from .dna import unpack_bases, apply_runs
+
+TWOBIT_MAGIC = 0x1A412743
+
+
+class TwoBitError(ValueError):
+    """ TwoBitError is raised when a file is not a valid .2bit file """
+    pass
+
+
+def _blocks(starts, sizes):
+    """ Flat array of [start, end) pairs from block starts and sizes """
+    runs = array('I')
+    for start, size in zip(starts, sizes):
+        runs.append(start)
+        runs.append(start + size)
+    return runs
+
+
+class TwoBitFile():
+    """ A .2bit file, opened for reading """
+
+    def __init__(self, path):
+        """
+            Params:
+                path (string): path of the .2bit file
+
+            Raises:
+                OSError: if the file cannot be opened
+                TwoBitError: if the file is not a .2bit file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < 16:
+            raise TwoBitError("not a 2bit file: " + path)
+        self.__order = "<"
+        if struct.unpack_from("<I", self.__map)[0] != TWOBIT_MAGIC:
+            self.__order = ">"
+            if struct.unpack_from(">I", self.__map)[0] != TWOBIT_MAGIC:
+                raise TwoBitError("not a 2bit file: " + path)
+        version, count, _ = self.__unpack("III", 4)
+        if version not in (0, 1):
+            raise TwoBitError("unsupported 2bit version " + str(version) + ": " + path)
+        # version 1 files (over 4 GB) have 64-bit offsets
+        offset_format = "Q" if version == 1 else "I"
+
+        # sequence name -> offset of its record, in file order
+        self.__offsets = {}
+        pos = 16
+        for _ in range(count):
+            name_size = self.__map[pos]
+            name = self.__map[pos + 1:pos + 1 + name_size].decode()
+            pos += 1 + name_size
+            self.__offsets[name] = self.__unpack(offset_format, pos)[0]
+            pos += struct.calcsize(offset_format)
+        self.__records = {}
+
+    def __unpack(self, fmt, offset):
+        return struct.unpack_from(self.__order + fmt, self.__map, offset)
+
+    def __record(self, name):
+        """ (size, N runs, mask runs, offset of the packed bases) of a sequence """
+        record = self.__records.get(name)
+        if record is None:
+            pos = self.__offsets[name]
+            size, n_count = self.__unpack("II", pos)
+            pos += 8
+            n_starts = self.__unpack("%dI" % n_count, pos)
+            n_sizes = self.__unpack("%dI" % n_count, pos + 4 * n_count)
+            pos += 8 * n_count
+            mask_count = self.__unpack("I", pos)[0]
+            pos += 4
+            mask_starts = self.__unpack("%dI" % mask_count, pos)
+            mask_sizes = self.__unpack("%dI" % mask_count, pos + 4 * mask_count)
+            pos += 8 * mask_count + 4  # reserved word
+            record = (size, _blocks(n_starts, n_sizes), _blocks(mask_starts, mask_sizes), pos)
+            self.__records[name] = record
+        return record
+
+    def names(self):
+        """
+            Returns:
+                List[string]: names of the sequences in the file, in file order
+        """
+        return list(self.__offsets)
+
+    def __contains__(self, name):
+        return name in self.__offsets
+
+    def size(self, name):
+        """
+            Returns:
+                int: number of bases of a sequence
+        """
+        return self.__record(name)[0]
+
+    def runs(self, name):
+        """
+            Returns:
+                (array, array): flat [start, end) pairs of the N runs and of the lower
+                case (soft-masked) runs of a sequence
+        """
+        _, n_runs, mask_runs, _ = self.__record(name)
+        return n_runs, mask_runs
+
+    def sequence(self, name, start=0, end=None):
+        """
+            Decodes part of a sequence, with N and lower case runs applied
+
+            Params:
+                name (string): name of the sequence
+                start (int): first base to decode
+                end (int): base after the last base to decode, default end of sequence
+
+            Returns:
+                string: the bases
+        """
+        size, n_runs, mask_runs, data_offset = self.__record(name)
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return ""
+        packed = self.__map[data_offset + start // 4:data_offset + (end + 3) // 4]
+        bases = unpack_bases(packed, end - start, start % 4)
+        apply_runs(bases, n_runs, mask_runs, start)
+        return bases.decode("ascii")
+
+    def write_sequence(self, name, f, window=1 << 22):
+        """
+            Writes a whole sequence to a text file, window bases at a time
+
+            Params:
+                name (string): name of the sequence
+                f (file): file opened for writing text
+                window (int): bases decoded at a time
+        """
+        size = self.size(name)
+        for start in range(0, size, window):
+            f.write(self.sequence(name, start, start + window))
+
+    def close(self):
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()